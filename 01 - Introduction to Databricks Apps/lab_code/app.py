@@ -1,12 +1,20 @@
 import gradio as gr
 import logging
+from admission_control import AdmissionRejected, forwarded_user
 from model_serving_utils import (
+    admit_request,
+    endpoint_router,
     endpoint_supports_feedback, 
+    start_warm_up,
     query_endpoint, 
     query_endpoint_stream, 
+    query_endpoint_text_stream,
     _get_endpoint_task_type,
 )
+from stream_coalescing import coalesce_deltas
+import math
 import os
+import time
 
 # Set up logging
 logging.basicConfig(level=logging.INFO)
@@ -21,37 +29,85 @@ assert SERVING_ENDPOINT,\
      "'serving_endpoint' with CAN_QUERY permissions, as described in "
      "https://docs.databricks.com/aws/en/generative-ai/agent-framework/chat-app#deploy-the-databricks-app")
 
-ENDPOINT_SUPPORTS_FEEDBACK = endpoint_supports_feedback(SERVING_ENDPOINT)
+# Look up the endpoint in the background, so the app starts serving right away
+start_warm_up(SERVING_ENDPOINT)
 
-def query_llm(message, history):
+# Optional comma-separated endpoints (name or name:weight) to route to and fail over to
+# when the main endpoint is slow or failing
+ENDPOINT = endpoint_router(SERVING_ENDPOINT, os.getenv('FALLBACK_SERVING_ENDPOINTS'))
+
+# Stream the answer token by token; set STREAM_RESPONSES to "false" to wait for the full response
+STREAM_RESPONSES = os.getenv('STREAM_RESPONSES', 'true').lower() == 'true'
+# Tokens streamed within this many seconds are sent to the browser as one update; 0 sends every token
+STREAM_UPDATE_INTERVAL_SECONDS = float(os.getenv('STREAM_UPDATE_INTERVAL_SECONDS', '0.05'))
+
+def query_llm(message, history, request: gr.Request):
     """
     Query the LLM with the given message and chat history.
     `message`: str - the latest user input.
     `history`: list of dicts - OpenAI-style messages.
+    `request`: the Gradio request, whose session identifies the conversation.
     """
     if not message.strip():
-        return "ERROR: The question should not be empty"
+        yield "ERROR: The question should not be empty"
+        return
 
     # Convert from Gradio-style history to OpenAI-style messages
     message_history = []
-    for user_msg, assistant_msg in history:
-        message_history.append({"role": "user", "content": user_msg})
-        message_history.append({"role": "assistant", "content": assistant_msg})
+    for turn in history:
+        if isinstance(turn, dict):
+            # type="messages" chat interfaces pass OpenAI-style messages already
+            message_history.append({"role": turn["role"], "content": turn["content"]})
+        else:
+            user_msg, assistant_msg = turn
+            message_history.append({"role": "user", "content": user_msg})
+            message_history.append({"role": "assistant", "content": assistant_msg})
 
     # Add the latest user message
     message_history.append({"role": "user", "content": message})
 
+    # requests are limited per user, as forwarded by the Databricks Apps proxy
+    user = forwarded_user(getattr(request, 'headers', None), default=request.session_hash)
     try:
-        logger.info(f"Sending request to model endpoint: {SERVING_ENDPOINT}")
-        messages, request_id = query_endpoint(
-            endpoint_name=SERVING_ENDPOINT,
-            messages=message_history,
-            return_traces=ENDPOINT_SUPPORTS_FEEDBACK
-        )
-        return messages[-1]
+        with admit_request(user):
+            # cached after the first lookup
+            return_traces = endpoint_supports_feedback(SERVING_ENDPOINT)
+            logger.info(f"Sending request to model endpoint: {ENDPOINT}")
+            if not STREAM_RESPONSES:
+                messages, request_id = query_endpoint(
+                    endpoint_name=ENDPOINT,
+                    messages=message_history,
+                    return_traces=return_traces,
+                    session_id=request.session_hash
+                )
+                yield messages[-1]
+                return
+
+            start_time = time.perf_counter()
+            response = ""
+            for text in coalesce_deltas(query_endpoint_text_stream(
+                endpoint_name=ENDPOINT,
+                messages=message_history,
+                return_traces=return_traces,
+                session_id=request.session_hash
+            ), STREAM_UPDATE_INTERVAL_SECONDS):
+                if not text:
+                    continue
+                if not response:
+                    logger.info(f"Time to first token: {time.perf_counter() - start_time:.3f}s")
+                response += text
+                yield response
+            logger.info(f"Response streamed in {time.perf_counter() - start_time:.3f}s")
+    except AdmissionRejected as e:
+        logger.warning(f"Request from {user} not admitted: {e}")
+        if math.isfinite(e.retry_after):
+            yield f"The assistant is busy, please try again in {int(e.retry_after) + 1} seconds."
+        else:
+            # a user rate of 0 never refills
+            yield "The assistant is busy, please try again later."
     except Exception as e:
         logger.error(f"Error querying model: {str(e)}", exc_info=True)
-        return f"Error: {str(e)}"
+        yield f"Error: {str(e)}"
 
 demo = gr.ChatInterface(
     fn=query_llm,
@@ -1,7 +1,25 @@
-from mlflow.deployments import get_deploy_client
-from databricks.sdk import WorkspaceClient
+from admission_control import AdmissionController, AdmissionRejected
+from client_registry import aclose_async_http_client, get_async_http_client, get_deploy_client, get_workspace_client
+from endpoint_router import EndpointRouter
+from feedback_queue import FeedbackQueue
+from history_compaction import HistoryCompactor
+from metrics import COUNT_BUCKETS, SIZE_BUCKETS, JsonLinesExporter, MetricsRegistry, PrometheusExporter
+from response_cache import ResponseCache, response_cache_key
+from responses_events import ResponsesStreamAssembler, TEXT_DELTA, iter_responses_events
+from singleflight import SingleFlight
+from stream_buffer import StreamBuffer
+from trace_store import TraceSampler, TraceStore
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import NamedTuple, Optional
+import asyncio
 import json
-import uuid
+import os
+import hashlib
+import random
+import threading
+import time
 
 import logging
 
@@ -11,212 +29,1049 @@ logging.basicConfig(
     level=logging.DEBUG
 )
 
+logger = logging.getLogger(__name__)
+
+# Latency, size and error metrics of endpoint calls, labelled by endpoint and operation
+_metrics = MetricsRegistry()
+_metrics.define_histogram("endpoint_metadata_lookup_seconds", "Time to look up the task type of an endpoint")
+_metrics.define_histogram("endpoint_request_seconds", "Total latency of endpoint requests")
+_metrics.define_histogram("endpoint_time_to_first_chunk_seconds", "Time until the first chunk of a stream arrives")
+_metrics.define_histogram("endpoint_stream_chunks", "Number of chunks per streamed response", COUNT_BUCKETS)
+_metrics.define_histogram("endpoint_request_bytes", "Size of the messages sent to the endpoint", SIZE_BUCKETS)
+_metrics.define_histogram("endpoint_response_bytes", "Size of the messages returned by the endpoint", SIZE_BUCKETS)
+_metrics.define_histogram("admission_wait_seconds", "Time requests waited in the admission queue")
+
+# Append a JSON line per metric series to METRICS_JSONL_PATH every METRICS_EXPORT_INTERVAL_SECONDS
+METRICS_JSONL_PATH = os.getenv("METRICS_JSONL_PATH")
+METRICS_EXPORT_INTERVAL_SECONDS = float(os.getenv("METRICS_EXPORT_INTERVAL_SECONDS", "60"))
+
+if METRICS_JSONL_PATH:
+    _metrics.add_exporter(JsonLinesExporter(METRICS_JSONL_PATH))
+    _metrics.start_periodic_export(METRICS_EXPORT_INTERVAL_SECONDS)
+
+def endpoint_metrics() -> MetricsRegistry:
+    """The registry endpoint calls are recorded in; add exporters to it with `add_exporter`."""
+    return _metrics
+
+def prometheus_metrics() -> str:
+    """Endpoint metrics in the Prometheus text format."""
+    return PrometheusExporter().render(_metrics)
+
+def _payload_bytes(value) -> int:
+    # the deployments client sends JSON with ASCII escapes, so this is the size on the wire
+    return len(json.dumps(value, default=str))
+
+def _record_error(endpoint_name, operation, error):
+    _metrics.increment("endpoint_errors_total", endpoint=endpoint_name, operation=operation, error=type(error).__name__)
+
+def _record_request(endpoint_name, operation, start_time, messages, response_messages):
+    labels = {"endpoint": endpoint_name, "operation": operation}
+    _metrics.observe("endpoint_request_seconds", time.perf_counter() - start_time, **labels)
+    _metrics.observe("endpoint_request_bytes", _payload_bytes(messages), **labels)
+    _metrics.observe("endpoint_response_bytes", _payload_bytes(response_messages), **labels)
+
+def _instrumented_stream(endpoint_name, operation, start_time, messages, chunks):
+    """Pass `chunks` through, recording time to first chunk, total latency and chunk count."""
+    labels = {"endpoint": endpoint_name, "operation": operation}
+    _metrics.observe("endpoint_request_bytes", _payload_bytes(messages), **labels)
+    chunk_count = 0
+    try:
+        for chunk in chunks:
+            if not chunk_count:
+                _metrics.observe("endpoint_time_to_first_chunk_seconds", time.perf_counter() - start_time, **labels)
+            chunk_count += 1
+            yield chunk
+    except Exception as e:
+        _record_error(endpoint_name, operation, e)
+        raise
+    _metrics.observe("endpoint_request_seconds", time.perf_counter() - start_time, **labels)
+    _metrics.observe("endpoint_stream_chunks", chunk_count, **labels)
+
+async def _ainstrumented_stream(endpoint_name, operation, start_time, messages, chunks):
+    """Async version of `_instrumented_stream`."""
+    labels = {"endpoint": endpoint_name, "operation": operation}
+    _metrics.observe("endpoint_request_bytes", _payload_bytes(messages), **labels)
+    chunk_count = 0
+    try:
+        async for chunk in chunks:
+            if not chunk_count:
+                _metrics.observe("endpoint_time_to_first_chunk_seconds", time.perf_counter() - start_time, **labels)
+            chunk_count += 1
+            yield chunk
+    except Exception as e:
+        _record_error(endpoint_name, operation, e)
+        raise
+    _metrics.observe("endpoint_request_seconds", time.perf_counter() - start_time, **labels)
+    _metrics.observe("endpoint_stream_chunks", chunk_count, **labels)
+
+# How long endpoint metadata (task type, served entities) is trusted before it is fetched again
+ENDPOINT_METADATA_TTL_SECONDS = float(os.getenv("ENDPOINT_METADATA_TTL_SECONDS", "300"))
+# A failed lookup is remembered this long, so requests don't each call the control plane while it fails
+ENDPOINT_METADATA_FAILURE_TTL_SECONDS = float(os.getenv("ENDPOINT_METADATA_FAILURE_TTL_SECONDS", "30"))
+
+class EndpointDescriptor(NamedTuple):
+    """Metadata of a serving endpoint that the query functions depend on."""
+    name: str
+    task_type: str
+    served_entities: tuple
+    supports_feedback: bool
+
+def _fetch_endpoint_descriptor(endpoint_name: str) -> EndpointDescriptor:
+    """Look up a serving endpoint through the control plane."""
+    ep = get_workspace_client().serving_endpoints.get(endpoint_name)
+    served_entities = tuple(
+        entity.name for entity in (ep.config.served_entities if ep.config else None) or []
+    )
+    return EndpointDescriptor(
+        name=endpoint_name,
+        task_type=ep.task if ep.task else "chat/completions",
+        served_entities=served_entities,
+        supports_feedback="feedback" in served_entities,
+    )
+
+class EndpointMetadataCache:
+    """
+    Process-wide cache of endpoint descriptors keyed by endpoint name.
+
+    Entries expire after `ttl_seconds`. Concurrent misses for the same endpoint
+    wait for a single lookup instead of each calling the control plane. A
+    failed lookup is cached for `failure_ttl_seconds` and its error raised again.
+    """
+
+    def __init__(
+        self,
+        ttl_seconds: float = ENDPOINT_METADATA_TTL_SECONDS,
+        failure_ttl_seconds: float = ENDPOINT_METADATA_FAILURE_TTL_SECONDS,
+        clock=time.monotonic,
+    ):
+        self.ttl_seconds = ttl_seconds
+        self.failure_ttl_seconds = failure_ttl_seconds
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._entries = {}
+        self._load_locks = {}
+        self.hits = 0
+        self.misses = 0
+
+    def _lookup(self, endpoint_name: str):
+        """The cached (descriptor, error) of an endpoint, or None if there is none or it expired."""
+        entry = self._entries.get(endpoint_name)
+        if entry is not None and entry[0] > self._clock():
+            return entry[1:]
+        return None
+
+    def get(self, endpoint_name: str) -> EndpointDescriptor:
+        with self._lock:
+            cached = self._lookup(endpoint_name)
+            if cached is not None:
+                self.hits += 1
+            else:
+                self.misses += 1
+                load_lock = self._load_locks.setdefault(endpoint_name, threading.Lock())
+
+        if cached is None:
+            with load_lock:
+                # another thread may have loaded the entry while we were waiting
+                with self._lock:
+                    cached = self._lookup(endpoint_name)
+                if cached is None:
+                    logger.debug(f"Fetching metadata for serving endpoint {endpoint_name}")
+                    try:
+                        cached = (_fetch_endpoint_descriptor(endpoint_name), None)
+                        ttl_seconds = self.ttl_seconds
+                    except Exception as e:
+                        cached = (None, e)
+                        ttl_seconds = self.failure_ttl_seconds
+                    with self._lock:
+                        self._entries[endpoint_name] = (self._clock() + ttl_seconds, *cached)
+        descriptor, error = cached
+        if error is not None:
+            raise error
+        return descriptor
+
+    def invalidate(self, endpoint_name: Optional[str] = None):
+        """Drop one endpoint from the cache, or all endpoints if no name is given."""
+        with self._lock:
+            if endpoint_name is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(endpoint_name, None)
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "size": len(self._entries),
+            }
+
+_endpoint_metadata_cache = EndpointMetadataCache()
+
+def get_endpoint_descriptor(endpoint_name: str) -> EndpointDescriptor:
+    """Return the (cached) metadata of a serving endpoint."""
+    return _endpoint_metadata_cache.get(endpoint_name)
+
+def invalidate_endpoint_metadata(endpoint_name: Optional[str] = None):
+    """Force the next query to re-read endpoint metadata, e.g. after the endpoint was updated."""
+    _endpoint_metadata_cache.invalidate(endpoint_name)
+
+def endpoint_metadata_cache_stats() -> dict:
+    """Hit/miss counters of the endpoint metadata cache."""
+    return _endpoint_metadata_cache.stats()
+
+# Set WARM_UP to "false" to skip the background warm-up, e.g. when profiling imports
+WARM_UP = os.getenv("WARM_UP", "true").lower() == "true"
+
+# Set once the background warm-up has finished, whether or not it succeeded
+_warm_up_done = threading.Event()
+_warm_up_thread = None
+
+def _warm_up(endpoint_names):
+    try:
+        get_workspace_client()
+        get_deploy_client()
+        for endpoint_name in endpoint_names:
+            try:
+                get_endpoint_descriptor(endpoint_name)
+            except Exception as e:
+                logger.warning(f"Warm-up lookup of serving endpoint {endpoint_name} failed: {e}")
+    except Exception as e:
+        logger.warning(f"Warm-up failed: {e}")
+    finally:
+        _warm_up_done.set()
+
+def start_warm_up(*endpoint_names):
+    """
+    Build the shared clients and look up the endpoints' metadata in a daemon
+    thread, so the app starts serving without waiting for the control plane.
+    Requests that arrive earlier do the same work themselves, once.
+    """
+    global _warm_up_thread
+    if not WARM_UP:
+        _warm_up_done.set()
+        return None
+    if _warm_up_thread is None:
+        _warm_up_thread = threading.Thread(
+            target=_warm_up, args=([name for name in endpoint_names if name],), name="warm-up", daemon=True
+        )
+        _warm_up_thread.start()
+    return _warm_up_thread
+
+def wait_until_ready(timeout=None) -> bool:
+    """Block until the background warm-up has finished; False if `timeout` expired first."""
+    return _warm_up_thread is None or _warm_up_done.wait(timeout)
+
+# Optional cache of complete answers; disabled unless RESPONSE_CACHE_MAX_ENTRIES is set
+_response_cache = ResponseCache(
+    max_entries=int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "0")),
+    max_bytes=int(os.getenv("RESPONSE_CACHE_MAX_BYTES", str(32 * 1024 * 1024))),
+    ttl_seconds=float(os.getenv("RESPONSE_CACHE_TTL_SECONDS", "600")),
+)
+
+def response_cache_stats() -> dict:
+    """Hit/miss, eviction and size counters of the response cache."""
+    return _response_cache.stats()
+
+def clear_response_cache():
+    _response_cache.invalidate()
+
+def _cached_response(endpoint_name, messages, use_cache):
+    """
+    Look up a conversation in the response cache. Returns the cache key (None
+    when caching is off for this call) and the cached messages and request ID
+    """
+    if not (use_cache and _response_cache.enabled):
+        return None, None
+    cache_key = response_cache_key(endpoint_name, messages)
+    cached = _response_cache.get(cache_key)
+    if cached is None:
+        return cache_key, None
+    # entries are stored as JSON so callers can't mutate the cached copy
+    result_messages, request_id = json.loads(cached)
+    return cache_key, (result_messages, request_id)
+
+def _cache_response(cache_key, result):
+    if cache_key is not None:
+        _response_cache.put(cache_key, json.dumps(result))
+
+# Conversations longer than this many (estimated) tokens are compacted before being sent; 0 disables it
+HISTORY_TOKEN_BUDGET = int(os.getenv("HISTORY_TOKEN_BUDGET", "16000"))
+
+_history_compactor = HistoryCompactor(HISTORY_TOKEN_BUDGET)
+
+def compact_history(messages):
+    """Fit a conversation into HISTORY_TOKEN_BUDGET, keeping system prompts and the latest turns."""
+    return _history_compactor.compact(messages)
+
+# Identical requests that are in flight at the same time share a single upstream call
+COALESCE_REQUESTS = os.getenv("COALESCE_REQUESTS", "true").lower() == "true"
+
+_single_flight = SingleFlight()
+
+def single_flight_stats() -> dict:
+    """How many requests went upstream and how many were coalesced onto them."""
+    return _single_flight.stats()
+
+def _request_key(endpoint_name, messages, return_traces):
+    return f"{response_cache_key(endpoint_name, messages)}:{int(bool(return_traces))}"
+
+# At most ADMISSION_MAX_CONCURRENCY requests run at once; each user may send USER_REQUESTS_PER_MINUTE
+# on average, USER_BURST at once, and waits at most ADMISSION_MAX_WAIT_SECONDS for a free slot
+ADMISSION_MAX_CONCURRENCY = int(os.getenv("ADMISSION_MAX_CONCURRENCY", "16"))
+USER_REQUESTS_PER_MINUTE = float(os.getenv("USER_REQUESTS_PER_MINUTE", "20"))
+USER_BURST = int(os.getenv("USER_BURST", "5"))
+ADMISSION_MAX_WAIT_SECONDS = float(os.getenv("ADMISSION_MAX_WAIT_SECONDS", "10"))
+
+_admission_controller = AdmissionController(
+    max_concurrency=ADMISSION_MAX_CONCURRENCY,
+    user_rate_per_second=USER_REQUESTS_PER_MINUTE / 60,
+    user_burst=USER_BURST,
+    max_wait_seconds=ADMISSION_MAX_WAIT_SECONDS,
+    max_queue_size=int(os.getenv("ADMISSION_MAX_QUEUE_SIZE", "100")),
+)
+
+@contextmanager
+def admit_request(user: str):
+    """
+    Hold one of the app's request slots for `user` while the block runs.
+    Raises `AdmissionRejected` at once if the user is over their rate limit or
+    the queue is full, and after ADMISSION_MAX_WAIT_SECONDS if no slot freed up.
+    """
+    try:
+        waited = _admission_controller.acquire(user)
+    except AdmissionRejected as e:
+        _metrics.increment("admission_rejected_total", reason=e.reason)
+        raise
+    _metrics.observe("admission_wait_seconds", waited)
+    try:
+        yield
+    finally:
+        _admission_controller.release()
+
+def admission_stats() -> dict:
+    return _admission_controller.stats()
+
+# When TRACE_STORE_PATH is set, requests to endpoints that return traces ask for one at
+# TRACE_SAMPLE_RATE and append it to that file. Failed requests and requests slower than
+# TRACE_SLOW_SECONDS are recorded too, by request ID. Without it, no request asks for a trace
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", "0.1"))
+TRACE_SLOW_SECONDS = float(os.getenv("TRACE_SLOW_SECONDS", "10"))
+TRACE_STORE_PATH = os.getenv("TRACE_STORE_PATH")
+
+_trace_sampler = TraceSampler(rate=TRACE_SAMPLE_RATE, slow_seconds=TRACE_SLOW_SECONDS)
+_trace_store = TraceStore(TRACE_STORE_PATH) if TRACE_STORE_PATH else None
+
+def trace_store_stats() -> dict:
+    return _trace_store.stats() if _trace_store is not None else {}
+
+def flush_traces(timeout=None) -> bool:
+    """Wait until all captured traces have been written."""
+    return _trace_store.flush(timeout) if _trace_store is not None else True
+
+def _sample_trace(return_traces) -> bool:
+    """Whether the next request should ask the endpoint for its trace (and request ID)."""
+    return bool(return_traces) and _trace_store is not None and _trace_sampler.sample()
+
+def _store_trace(endpoint_name, request_id, reason, trace=None, latency=None, error=None):
+    if _trace_store is None:
+        return
+    _trace_store.submit({
+        "timestamp": time.time(),
+        "endpoint": endpoint_name,
+        "request_id": request_id,
+        "reason": reason,
+        "latency_seconds": latency,
+        "error": f"{type(error).__name__}: {error}" if error is not None else None,
+        "trace": trace,
+    })
+
+def _capture_trace(endpoint_name, output):
+    """Move the trace out of a response or stream chunk into the trace store. Returns the request ID, if any."""
+    databricks_output = output.get("databricks_output") if isinstance(output, dict) else None
+    if not databricks_output:
+        return None
+    trace = databricks_output.pop("trace", None)
+    request_id = databricks_output.get("databricks_request_id")
+    if trace is not None:
+        _store_trace(endpoint_name, request_id, "sampled", trace=trace)
+    return request_id
+
+def _record_tail_trace(endpoint_name, sampled, start_time, request_id=None, error=None):
+    """Record a request that finished without a stored trace if it failed or was slow."""
+    if _trace_store is None or (sampled and error is None):
+        return
+    latency = time.perf_counter() - start_time
+    reason = _trace_sampler.tail_reason(latency, error)
+    if reason is not None:
+        _store_trace(endpoint_name, request_id, reason, latency=latency, error=error)
+
+def _traced_stream(endpoint_name, sampled, chunks):
+    """Pass `chunks` through, moving traces into the trace store and recording failed or slow streams."""
+    start_time = time.perf_counter()
+    request_id = None
+    try:
+        for chunk in chunks:
+            request_id = _capture_trace(endpoint_name, chunk) or request_id
+            yield chunk
+    except Exception as e:
+        _record_tail_trace(endpoint_name, sampled, start_time, request_id, e)
+        raise
+    _record_tail_trace(endpoint_name, sampled, start_time, request_id)
+
+async def _atraced_stream(endpoint_name, sampled, chunks):
+    """Async version of `_traced_stream`."""
+    start_time = time.perf_counter()
+    request_id = None
+    try:
+        async for chunk in chunks:
+            request_id = _capture_trace(endpoint_name, chunk) or request_id
+            yield chunk
+    except Exception as e:
+        _record_tail_trace(endpoint_name, sampled, start_time, request_id, e)
+        raise
+    _record_tail_trace(endpoint_name, sampled, start_time, request_id)
+
+# Circuit breaker settings of the routers built by `endpoint_router`
+ROUTER_FAILURE_THRESHOLD = int(os.getenv("ROUTER_FAILURE_THRESHOLD", "5"))
+ROUTER_RESET_TIMEOUT_SECONDS = float(os.getenv("ROUTER_RESET_TIMEOUT_SECONDS", "30"))
+
+def endpoint_router(*specs):
+    """
+    Return the endpoint name if `specs` name a single endpoint, or an
+    `EndpointRouter` over every endpoint in the comma-separated `name` or
+    `name:weight` specs otherwise. The query functions accept either.
+    """
+    spec = ",".join(spec for spec in specs if spec)
+    router = EndpointRouter.from_spec(
+        spec,
+        failure_threshold=ROUTER_FAILURE_THRESHOLD,
+        reset_timeout_seconds=ROUTER_RESET_TIMEOUT_SECONDS,
+    )
+    if len(router.endpoint_names) == 1:
+        return router.endpoint_names[0]
+    return router
+
 def _get_endpoint_task_type(endpoint_name: str) -> str:
     """Get the task type of a serving endpoint."""
+    start_time = time.perf_counter()
     try:
-        w = WorkspaceClient()
-        ep = w.serving_endpoints.get(endpoint_name)
-        return ep.task if ep.task else "chat/completions"
-    except Exception:
+        return get_endpoint_descriptor(endpoint_name).task_type
+    except Exception as e:
+        _record_error(endpoint_name, "metadata", e)
         return "chat/completions"
+    finally:
+        _metrics.observe("endpoint_metadata_lookup_seconds", time.perf_counter() - start_time, endpoint=endpoint_name)
 
-def _convert_to_responses_format(messages):
-    """Convert chat messages to ResponsesAgent API format."""
-    input_messages = []
-    for msg in messages:
-        if msg["role"] == "user":
-            input_messages.append({"role": "user", "content": msg["content"]})
-        elif msg["role"] == "assistant":
-            # Handle assistant messages with tool calls
-            if msg.get("tool_calls"):
-                # Add function calls
-                for tool_call in msg["tool_calls"]:
-                    input_messages.append({
-                        "type": "function_call",
-                        "id": tool_call["id"],
-                        "call_id": tool_call["id"],
-                        "name": tool_call["function"]["name"],
-                        "arguments": tool_call["function"]["arguments"]
-                    })
-                # Add assistant message if it has content
-                if msg.get("content"):
-                    input_messages.append({
-                        "type": "message",
-                        "id": msg.get("id", str(uuid.uuid4())),
-                        "content": [{"type": "output_text", "text": msg["content"]}],
-                        "role": "assistant"
-                    })
-            else:
-                # Regular assistant message
+def _message_id(msg, seen):
+    """
+    Deterministic ID for a message without one, derived from its content, so
+    a message keeps its ID when history compaction moves it. `seen` counts the
+    IDs handed out so far, to tell identical messages apart.
+    """
+    digest = hashlib.sha1(f"{msg['role']}:{msg.get('content')}".encode("utf-8")).hexdigest()
+    occurrence = seen.get(digest, 0)
+    seen[digest] = occurrence + 1
+    return f"msg_{digest[:24]}" if not occurrence else f"msg_{digest[:24]}_{occurrence}"
+
+def _convert_message(msg, input_messages, seen):
+    """Append the ResponsesAgent input items of one chat message to `input_messages`."""
+    if msg["role"] in ("user", "system"):
+        input_messages.append({"role": msg["role"], "content": msg["content"]})
+    elif msg["role"] == "assistant":
+        # Handle assistant messages with tool calls
+        if msg.get("tool_calls"):
+            # Add function calls
+            for tool_call in msg["tool_calls"]:
+                input_messages.append({
+                    "type": "function_call",
+                    "id": tool_call["id"],
+                    "call_id": tool_call["id"],
+                    "name": tool_call["function"]["name"],
+                    "arguments": tool_call["function"]["arguments"]
+                })
+            # Add assistant message if it has content
+            if msg.get("content"):
                 input_messages.append({
                     "type": "message",
-                    "id": msg.get("id", str(uuid.uuid4())),
+                    "id": msg.get("id") or _message_id(msg, seen),
                     "content": [{"type": "output_text", "text": msg["content"]}],
                     "role": "assistant"
                 })
-        elif msg["role"] == "tool":
+        else:
+            # Regular assistant message
             input_messages.append({
-                "type": "function_call_output",
-                "call_id": msg.get("tool_call_id"),
-                "output": msg["content"]
+                "type": "message",
+                "id": msg.get("id") or _message_id(msg, seen),
+                "content": [{"type": "output_text", "text": msg["content"]}],
+                "role": "assistant"
             })
+    elif msg["role"] == "tool":
+        input_messages.append({
+            "type": "function_call_output",
+            "call_id": msg.get("tool_call_id"),
+            "output": msg["content"]
+        })
+
+def _convert_to_responses_format(messages):
+    """Convert chat messages to ResponsesAgent API format."""
+    input_messages = []
+    seen = {}
+    for msg in messages:
+        _convert_message(msg, input_messages, seen)
     return input_messages
 
+def _fingerprint(msg):
+    tool_calls = tuple(
+        (tool_call.get("id"), tool_call["function"]["name"], tool_call["function"]["arguments"])
+        for tool_call in msg.get("tool_calls") or ()
+    )
+    return (msg.get("role"), msg.get("content"), msg.get("id"), msg.get("tool_call_id"), tool_calls)
+
+class ResponsesInputConverter:
+    """
+    Converts the growing history of one chat session to ResponsesAgent input.
+
+    The converted prefix is kept between turns and only messages appended since
+    the previous call are converted. Checking that the prefix still matches
+    costs the same however long the history is: the new history must be at
+    least as long, and its first and last converted messages must be unchanged.
+    Gradio drops everything after an edited or retried turn, so those change
+    the last converted message and trigger a full conversion. So does
+    compacted history, whose size is bounded by HISTORY_TOKEN_BUDGET.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._input_messages = []
+        self._count = 0
+        self._ends = None
+        self._seen = {}
+
+    def convert(self, messages):
+        """Return the ResponsesAgent input for `messages`. The returned list must not be modified."""
+        with self._lock:
+            count = self._count
+            if count and (
+                count > len(messages)
+                or (_fingerprint(messages[0]), _fingerprint(messages[count - 1])) != self._ends
+            ):
+                self._input_messages = []
+                self._seen = {}
+                count = 0
+            for msg in messages[count:]:
+                _convert_message(msg, self._input_messages, self._seen)
+            self._count = len(messages)
+            if messages:
+                self._ends = (_fingerprint(messages[0]), _fingerprint(messages[-1]))
+            return self._input_messages
+
+# Number of chat sessions whose converted history is kept in memory
+MAX_CONVERTER_SESSIONS = int(os.getenv("MAX_CONVERTER_SESSIONS", "1000"))
+
+_converters = OrderedDict()
+_converters_lock = threading.Lock()
+
+def _session_converter(session_id) -> ResponsesInputConverter:
+    with _converters_lock:
+        converter = _converters.get(session_id)
+        if converter is None:
+            converter = _converters[session_id] = ResponsesInputConverter()
+            if len(_converters) > MAX_CONVERTER_SESSIONS:
+                _converters.popitem(last=False)
+        else:
+            _converters.move_to_end(session_id)
+        return converter
+
+def end_session(session_id):
+    """Release the state kept for a chat session."""
+    with _converters_lock:
+        _converters.pop(session_id, None)
+
 def _throw_unexpected_endpoint_format():
     raise Exception("This app can only run against ChatModel, ChatAgent, or ResponsesAgent endpoints")
 
-def query_endpoint_stream(endpoint_name: str, messages: list[dict[str, str]], return_traces: bool):
+class EndpointRequestError(Exception):
+    """A serving endpoint answered an invocation with an HTTP error status."""
+
+    def __init__(self, endpoint_name: str, status_code: int, message: str, retry_after: Optional[float] = None):
+        super().__init__(f"Endpoint {endpoint_name} returned HTTP {status_code}: {message}")
+        self.endpoint_name = endpoint_name
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+def _chat_inputs(messages, return_traces, stream=False):
+    """Build the request payload for chat/completions and ChatAgent endpoints."""
+    inputs = {"messages": messages}
+    if stream:
+        inputs["stream"] = True
+    if return_traces:
+        inputs["databricks_options"] = {"return_trace": True}
+    return inputs
+
+def _responses_inputs(messages, return_traces, stream=False, session_id=None):
+    """Build the request payload for agent/v1/responses endpoints."""
+    if session_id is None:
+        input_messages = _convert_to_responses_format(messages)
+    else:
+        input_messages = _session_converter(session_id).convert(messages)
+    inputs = {
+        "input": input_messages,
+        "context": {}
+    }
+    if stream:
+        inputs["stream"] = True
+    if return_traces:
+        inputs["databricks_options"] = {"return_trace": True}
+    return inputs
+
+def _check_chat_chunk(chunk):
+    if "choices" in chunk or "delta" in chunk:
+        return chunk
+    _throw_unexpected_endpoint_format()
+
+def _parse_chat_response(res):
+    """Extract the messages and request ID from a chat/completions or ChatAgent response."""
+    request_id = res.get("databricks_output", {}).get("databricks_request_id")
+    if "messages" in res:
+        return res["messages"], request_id
+    elif "choices" in res:
+        return [res["choices"][0]["message"]], request_id
+    _throw_unexpected_endpoint_format()
+
+def _parse_responses_response(response):
+    """Convert the output items of a ResponsesAgent response to chat messages."""
+    assembler = ResponsesStreamAssembler()
+    assembler.feed_response(response)
+    return assembler.result()
+
+def query_endpoint_stream(endpoint_name: str, messages: list[dict[str, str]], return_traces: bool, session_id=None):
+    if isinstance(endpoint_name, EndpointRouter):
+        return endpoint_name.stream(lambda name: query_endpoint_stream(name, messages, return_traces, session_id))
+    start_time = time.perf_counter()
+    messages = compact_history(messages)
     task_type = _get_endpoint_task_type(endpoint_name)
+    return_traces = _sample_trace(return_traces)
     
     if task_type == "agent/v1/responses":
-        return _query_responses_endpoint_stream(endpoint_name, messages, return_traces)
+        factory = lambda: _traced_stream(
+            endpoint_name, return_traces,
+            _query_responses_endpoint_stream(endpoint_name, messages, return_traces, session_id)
+        )
+    else:
+        factory = lambda: _traced_stream(
+            endpoint_name, return_traces, _query_chat_endpoint_stream(endpoint_name, messages, return_traces)
+        )
+
+    if not COALESCE_REQUESTS:
+        chunks = factory()
     else:
-        return _query_chat_endpoint_stream(endpoint_name, messages, return_traces)
+        # concurrent identical requests fan out from one upstream stream
+        chunks = _single_flight.stream(_request_key(endpoint_name, messages, return_traces), factory)
+    return _instrumented_stream(endpoint_name, "stream", start_time, messages, chunks)
 
 def _query_chat_endpoint_stream(endpoint_name: str, messages: list[dict[str, str]], return_traces: bool):
     """Invoke an endpoint that implements either chat completions or ChatAgent and stream the response"""
-    client = get_deploy_client("databricks")
-
-    # Prepare input payload
-    inputs = {
-        "messages": messages,
-    }
-    if return_traces:
-        inputs["databricks_options"] = {"return_trace": True}
+    client = get_deploy_client()
+    inputs = _chat_inputs(messages, return_traces)
 
     for chunk in client.predict_stream(endpoint=endpoint_name, inputs=inputs):
-        if "choices" in chunk:
-            yield chunk
-        elif "delta" in chunk:
-            yield chunk
-        else:
-            _throw_unexpected_endpoint_format()
+        yield _check_chat_chunk(chunk)
 
-def _query_responses_endpoint_stream(endpoint_name: str, messages: list[dict[str, str]], return_traces: bool):
+def _query_responses_endpoint_stream(endpoint_name: str, messages: list[dict[str, str]], return_traces: bool, session_id=None):
     """Stream responses from agent/v1/responses endpoints using MLflow deployments client."""
-    client = get_deploy_client("databricks")
-    
-    input_messages = _convert_to_responses_format(messages)
-    
-    # Prepare input payload for ResponsesAgent
-    inputs = {
-        "input": input_messages,
-        "context": {},
-        "stream": True
-    }
-    if return_traces:
-        inputs["databricks_options"] = {"return_trace": True}
+    client = get_deploy_client()
+    inputs = _responses_inputs(messages, return_traces, stream=True, session_id=session_id)
 
     for event_data in client.predict_stream(endpoint=endpoint_name, inputs=inputs):
-        # Just yield the raw event data, let app.py handle the parsing
+        # Yield the raw event data; use responses_events.iter_responses_events to parse it
         yield event_data
 
-def query_endpoint(endpoint_name, messages, return_traces):
+def _assistant_text(messages):
+    return "\n\n".join(msg["content"] for msg in messages if msg["role"] == "assistant" and msg.get("content"))
+
+def query_endpoint_text_stream(endpoint_name: str, messages: list[dict[str, str]], return_traces: bool, use_cache=True, session_id=None):
     """
-    Query an endpoint, returning the string message content and request
-    ID for feedback
+    Stream the assistant's answer as text fragments, for chat/completions,
+    ChatAgent and ResponsesAgent endpoints alike. A cached answer is returned
+    as a single fragment.
     """
+    if isinstance(endpoint_name, EndpointRouter):
+        yield from endpoint_name.stream(
+            lambda name: query_endpoint_text_stream(name, messages, return_traces, use_cache, session_id)
+        )
+        return
+    messages = compact_history(messages)
+    cache_key, cached = _cached_response(endpoint_name, messages, use_cache)
+    if cached is not None:
+        yield _assistant_text(cached[0])
+        return
+
     task_type = _get_endpoint_task_type(endpoint_name)
-    
+    chunks = query_endpoint_stream(endpoint_name, messages, return_traces, session_id)
+
     if task_type == "agent/v1/responses":
-        return _query_responses_endpoint(endpoint_name, messages, return_traces)
+        assembler = ResponsesStreamAssembler()
+        last_item_id = None
+        for event in iter_responses_events(chunks, assembler):
+            if event.kind != TEXT_DELTA:
+                continue
+            if last_item_id is not None and event.item_id != last_item_id:
+                # separate the text of consecutive assistant messages
+                yield "\n\n"
+            last_item_id = event.item_id
+            yield event.delta
+        _cache_response(cache_key, assembler.result())
     else:
-        return _query_chat_endpoint(endpoint_name, messages, return_traces)
+        parts = []
+        request_id = None
+        for chunk in chunks:
+            request_id = chunk.get("databricks_output", {}).get("databricks_request_id", request_id)
+            if "choices" in chunk:
+                text = (chunk["choices"][0].get("delta") or {}).get("content") or "" if chunk["choices"] else ""
+            else:
+                # ChatAgent chunks carry a single message delta
+                text = chunk["delta"].get("content") or ""
+            parts.append(text)
+            yield text
+        _cache_response(cache_key, ([{"role": "assistant", "content": "".join(parts)}], request_id))
+
+# Resumable streams are buffered while they are generated; one that nobody reads is cancelled
+# after STREAM_BUFFER_GRACE_SECONDS
+_stream_buffer = StreamBuffer(
+    max_chunks=int(os.getenv("STREAM_BUFFER_MAX_CHUNKS", "4096")),
+    grace_seconds=float(os.getenv("STREAM_BUFFER_GRACE_SECONDS", "15")),
+)
+
+def stream_request_id(session_id, messages) -> str:
+    """
+    ID of one turn of a chat session: the session and the number of the turn's
+    user message. `session_id` must survive a reconnect, e.g. an ID kept in
+    `gr.BrowserState`; Gradio's `session_hash` changes when the page reloads.
+    """
+    turn = sum(1 for msg in messages if msg["role"] == "user")
+    # an edited conversation is a different turn, even at the same position
+    return f"{session_id}:{turn}:{response_cache_key('', messages)[:16]}"
+
+def query_endpoint_resumable_stream(request_id, endpoint_name, messages, return_traces, offset=0, session_id=None):
+    """
+    `query_endpoint_text_stream`, buffered server-side under `request_id`
+    (see `stream_request_id`). Calling it again with the same ID while the
+    answer is still being generated, e.g. after the browser reconnected,
+    replays the text fragments from `offset` and follows the live answer
+    instead of asking the endpoint again; once the answer is complete, it
+    asks the endpoint again. See `stream_buffer.StreamBuffer`.
+    """
+    return _stream_buffer.stream(
+        request_id,
+        lambda: query_endpoint_text_stream(endpoint_name, messages, return_traces, session_id=session_id),
+        offset,
+    )
+
+def stream_buffer_stats() -> dict:
+    return _stream_buffer.stats()
+
+def query_endpoint(endpoint_name, messages, return_traces, use_cache=True, session_id=None):
+    """
+    Query an endpoint, returning the string message content and request
+    ID for feedback. Pass `use_cache=False` to bypass the response cache,
+    and the chat session's ID to convert its history incrementally.
+    `endpoint_name` can also be an `EndpointRouter`, see `endpoint_router`.
+    With `return_traces` and a trace store (see TRACE_STORE_PATH), a sample
+    of the requests ask for the agent trace, which is written to the trace
+    store instead of being returned; only those return a request ID.
+    """
+    if isinstance(endpoint_name, EndpointRouter):
+        return endpoint_name.call(lambda name: query_endpoint(name, messages, return_traces, use_cache, session_id))
+    start_time = time.perf_counter()
+    messages = compact_history(messages)
+    cache_key, cached = _cached_response(endpoint_name, messages, use_cache)
+    if cached is not None:
+        return cached
+
+    # only a sample of the requests ask for the agent trace, see TRACE_SAMPLE_RATE
+    return_traces = _sample_trace(return_traces)
+
+    def query():
+        task_type = _get_endpoint_task_type(endpoint_name)
+        query_start = time.perf_counter()
+        
+        try:
+            if task_type == "agent/v1/responses":
+                result = _query_responses_endpoint(endpoint_name, messages, return_traces, session_id)
+            else:
+                result = _query_chat_endpoint(endpoint_name, messages, return_traces)
+        except Exception as e:
+            _record_tail_trace(endpoint_name, return_traces, query_start, error=e)
+            raise
+        _record_tail_trace(endpoint_name, return_traces, query_start, result[1])
+        _cache_response(cache_key, result)
+        return result
+
+    try:
+        if not COALESCE_REQUESTS:
+            result = query()
+        else:
+            result = _single_flight.do(_request_key(endpoint_name, messages, return_traces), query)
+    except Exception as e:
+        _record_error(endpoint_name, "query", e)
+        raise
+    _record_request(endpoint_name, "query", start_time, messages, result[0])
+    return result
 
 def _query_chat_endpoint(endpoint_name, messages, return_traces):
     """Calls a model serving endpoint with chat/completions format."""
-    inputs = {'messages': messages}
-    if return_traces:
-        inputs['databricks_options'] = {'return_trace': True}
-    
-    res = get_deploy_client('databricks').predict(
+    res = get_deploy_client().predict(
         endpoint=endpoint_name,
-        inputs=inputs,
+        inputs=_chat_inputs(messages, return_traces),
     )
-    request_id = res.get("databricks_output", {}).get("databricks_request_id")
-    if "messages" in res:
-        return res["messages"], request_id
-    elif "choices" in res:
-        return [res["choices"][0]["message"]], request_id
-    _throw_unexpected_endpoint_format()
+    _capture_trace(endpoint_name, res)
+    return _parse_chat_response(res)
 
-def _query_responses_endpoint(endpoint_name, messages, return_traces):
+def _query_responses_endpoint(endpoint_name, messages, return_traces, session_id=None):
     """Query agent/v1/responses endpoints using MLflow deployments client."""
-    client = get_deploy_client("databricks")
-    
-    input_messages = _convert_to_responses_format(messages)
-    
-    # Prepare input payload for ResponsesAgent
-    inputs = {
-        "input": input_messages,
-        "context": {}
-    }
-    if return_traces:
-        inputs["databricks_options"] = {"return_trace": True}
-    
-    # Make the prediction call
-    response = client.predict(endpoint=endpoint_name, inputs=inputs)
-    
-    # Extract messages from the response
-    result_messages = []
-    request_id = response.get("databricks_output", {}).get("databricks_request_id")
-    
-    # Process the output items from ResponsesAgent response
-    output_items = response.get("output", [])
-    
-    for item in output_items:
-        item_type = item.get("type")
-        
-        if item_type == "message":
-            # Extract text content from message
-            text_content = ""
-            content_parts = item.get("content", [])
-            
-            for content_part in content_parts:
-                if content_part.get("type") == "output_text":
-                    text_content += content_part.get("text", "")
-            
-            if text_content:
-                result_messages.append({
-                    "role": "assistant",
-                    "content": text_content
-                })
-                
-        elif item_type == "function_call":
-            # Handle function calls
-            call_id = item.get("call_id")
-            function_name = item.get("name")
-            arguments = item.get("arguments", "")
-            
-            tool_calls = [{
-                "id": call_id,
-                "type": "function", 
-                "function": {
-                    "name": function_name,
-                    "arguments": arguments
-                }
-            }]
-            result_messages.append({
-                "role": "assistant",
-                "content": "",
-                "tool_calls": tool_calls
-            })
-            
-        elif item_type == "function_call_output":
-            # Handle function call output/result
-            call_id = item.get("call_id")
-            output_content = item.get("output", "")
-            
-            result_messages.append({
-                "role": "tool",
-                "content": output_content,
-                "tool_call_id": call_id
-            })
-    
-    return result_messages or [{"role": "assistant", "content": "No response found"}], request_id
+    response = get_deploy_client().predict(
+        endpoint=endpoint_name,
+        inputs=_responses_inputs(messages, return_traces, session_id=session_id),
+    )
+    _capture_trace(endpoint_name, response)
+    return _parse_responses_response(response)
 
-def submit_feedback(endpoint, request_id, rating):
-    """Submit feedback to the agent."""
+# Async API: the same queries as above, sent through a pooled async HTTP client so
+# that async Gradio handlers don't hold a worker thread while the model generates.
+
+def _invocations_request(endpoint_name):
+    """
+    Return the invocations URL of an endpoint and the auth headers to call it
+    with. Blocking: building the client or refreshing an expired token goes to
+    the network, so async callers run it in a thread.
+    """
+    config = get_workspace_client().config
+    url = f"{config.host.rstrip('/')}/serving-endpoints/{endpoint_name}/invocations"
+    # tokens are cached by the SDK config, so this only hits the network when one expires
+    return url, config.authenticate()
+
+def _raise_for_status(endpoint_name, response):
+    if response.status_code < 400:
+        return
+    retry_after = response.headers.get("Retry-After")
+    try:
+        retry_after = float(retry_after) if retry_after is not None else None
+    except ValueError:
+        retry_after = None
+    raise EndpointRequestError(endpoint_name, response.status_code, response.text, retry_after)
+
+async def _apost_invocations(endpoint_name, inputs):
+    url, headers = await asyncio.to_thread(_invocations_request, endpoint_name)
+    response = await get_async_http_client().post(url, json=inputs, headers=headers)
+    _raise_for_status(endpoint_name, response)
+    return response.json()
+
+async def _astream_invocations(endpoint_name, inputs):
+    """Yield the JSON payloads of the server-sent events returned by a streaming invocation."""
+    url, headers = await asyncio.to_thread(_invocations_request, endpoint_name)
+    async with get_async_http_client().stream("POST", url, json=inputs, headers=headers) as response:
+        if response.status_code >= 400:
+            await response.aread()
+            _raise_for_status(endpoint_name, response)
+        async for line in response.aiter_lines():
+            if not line.startswith("data:"):
+                continue
+            data = line[len("data:"):].strip()
+            if data == "[DONE]":
+                break
+            if data:
+                yield json.loads(data)
+
+async def aquery_endpoint(endpoint_name, messages, return_traces, use_cache=True, session_id=None):
+    """Async version of `query_endpoint`, returning the messages and request ID for feedback."""
+    if isinstance(endpoint_name, EndpointRouter):
+        return await endpoint_name.acall(
+            lambda name: aquery_endpoint(name, messages, return_traces, use_cache, session_id)
+        )
+    start_time = time.perf_counter()
+    messages = compact_history(messages)
+    cache_key, cached = _cached_response(endpoint_name, messages, use_cache)
+    if cached is not None:
+        return cached
+
+    return_traces = _sample_trace(return_traces)
+
+    async def query():
+        task_type = await asyncio.to_thread(_get_endpoint_task_type, endpoint_name)
+        query_start = time.perf_counter()
+
+        try:
+            if task_type == "agent/v1/responses":
+                inputs = _responses_inputs(messages, return_traces, session_id=session_id)
+                response = await _apost_invocations(endpoint_name, inputs)
+                _capture_trace(endpoint_name, response)
+                result = _parse_responses_response(response)
+            else:
+                res = await _apost_invocations(endpoint_name, _chat_inputs(messages, return_traces))
+                _capture_trace(endpoint_name, res)
+                result = _parse_chat_response(res)
+        except Exception as e:
+            _record_tail_trace(endpoint_name, return_traces, query_start, error=e)
+            raise
+        _record_tail_trace(endpoint_name, return_traces, query_start, result[1])
+        _cache_response(cache_key, result)
+        return result
+
+    try:
+        if not COALESCE_REQUESTS:
+            result = await query()
+        else:
+            result = await _single_flight.do_async(_request_key(endpoint_name, messages, return_traces), query)
+    except Exception as e:
+        _record_error(endpoint_name, "async_query", e)
+        raise
+    _record_request(endpoint_name, "async_query", start_time, messages, result[0])
+    return result
+
+async def _acheck_chat_chunks(chunks):
+    async for chunk in chunks:
+        yield _check_chat_chunk(chunk)
+
+async def aquery_endpoint_stream(endpoint_name: str, messages: list[dict[str, str]], return_traces: bool, session_id=None):
+    """Async version of `query_endpoint_stream`, yielding the raw chunks or ResponsesAgent events."""
+    if isinstance(endpoint_name, EndpointRouter):
+        async for chunk in endpoint_name.astream(
+            lambda name: aquery_endpoint_stream(name, messages, return_traces, session_id)
+        ):
+            yield chunk
+        return
+    start_time = time.perf_counter()
+    messages = compact_history(messages)
+    task_type = await asyncio.to_thread(_get_endpoint_task_type, endpoint_name)
+    return_traces = _sample_trace(return_traces)
+
+    if task_type == "agent/v1/responses":
+        inputs = _responses_inputs(messages, return_traces, stream=True, session_id=session_id)
+        factory = lambda: _atraced_stream(endpoint_name, return_traces, _astream_invocations(endpoint_name, inputs))
+    else:
+        inputs = _chat_inputs(messages, return_traces, stream=True)
+        factory = lambda: _atraced_stream(
+            endpoint_name, return_traces, _acheck_chat_chunks(_astream_invocations(endpoint_name, inputs))
+        )
+
+    if COALESCE_REQUESTS:
+        chunks = _single_flight.astream(_request_key(endpoint_name, messages, return_traces), factory)
+    else:
+        chunks = factory()
+    async for chunk in _ainstrumented_stream(endpoint_name, "async_stream", start_time, messages, chunks):
+        yield chunk
+
+# Bulk inference: at most BATCH_MAX_CONCURRENCY conversations of a batch are in flight at once, and
+# rate-limited (429) or failing (5xx) requests are retried up to BATCH_MAX_RETRIES times
+BATCH_MAX_CONCURRENCY = int(os.getenv("BATCH_MAX_CONCURRENCY", "8"))
+BATCH_MAX_RETRIES = int(os.getenv("BATCH_MAX_RETRIES", "5"))
+BATCH_MAX_BACKOFF_SECONDS = float(os.getenv("BATCH_MAX_BACKOFF_SECONDS", "30"))
+
+class BatchItemResult(NamedTuple):
+    """The answer to one conversation of a batch, or the error that ended it."""
+    messages: Optional[list]
+    request_id: Optional[str]
+    error: Optional[Exception]
+    attempts: int
+    latency_seconds: float
+
+class BatchResult(NamedTuple):
+    """Per-conversation results in input order, and the throughput of the whole batch."""
+    items: list
+    succeeded: int
+    failed: int
+    retries: int
+    duration_seconds: float
+    conversations_per_second: float
+
+def _batch_retryable(error) -> bool:
+    status_code = getattr(error, "status_code", None)
+    return status_code is not None and (status_code == 429 or status_code >= 500)
+
+async def aquery_endpoint_batch(
+    endpoint_name,
+    conversations,
+    return_traces=False,
+    use_cache=True,
+    max_concurrency=None,
+    max_retries=None,
+) -> BatchResult:
+    """
+    Answer many independent conversations, at most `max_concurrency` at a
+    time. When the endpoint answers 429, every request of the batch pauses
+    for its Retry-After (or an exponential backoff) before retrying, so the
+    batch slows down to the endpoint's rate limit instead of hammering it.
+    A conversation that still fails is reported in its item; it doesn't
+    fail the batch.
+    """
+    max_concurrency = max_concurrency or BATCH_MAX_CONCURRENCY
+    max_retries = BATCH_MAX_RETRIES if max_retries is None else max_retries
+    loop = asyncio.get_running_loop()
+    semaphore = asyncio.Semaphore(max_concurrency)
+    resume_at = 0.0
+    retries = 0
+
+    async def run(messages):
+        nonlocal resume_at, retries
+        start_time = time.perf_counter()
+        async with semaphore:
+            for attempt in range(max_retries + 1):
+                if resume_at > loop.time():
+                    await asyncio.sleep(resume_at - loop.time())
+                try:
+                    result_messages, request_id = await aquery_endpoint(endpoint_name, messages, return_traces, use_cache)
+                    return BatchItemResult(result_messages, request_id, None, attempt + 1, time.perf_counter() - start_time)
+                except Exception as e:
+                    if attempt == max_retries or not _batch_retryable(e):
+                        return BatchItemResult(None, None, e, attempt + 1, time.perf_counter() - start_time)
+                    delay = min(BATCH_MAX_BACKOFF_SECONDS, 0.5 * 2 ** attempt) * random.uniform(0.5, 1.0)
+                    if e.status_code == 429:
+                        # the rate limit applies to the whole batch, so everyone waits
+                        resume_at = max(resume_at, loop.time() + (e.retry_after or delay))
+                    else:
+                        await asyncio.sleep(delay)
+                    retries += 1
+
+    start_time = time.perf_counter()
+    items = await asyncio.gather(*(run(messages) for messages in conversations))
+    duration = time.perf_counter() - start_time
+    succeeded = sum(1 for item in items if item.error is None)
+    logger.info(
+        f"Batch of {len(items)} conversations to {endpoint_name} finished in {duration:.2f}s: "
+        f"{succeeded} succeeded, {len(items) - succeeded} failed, {retries} retries"
+    )
+    return BatchResult(
+        items=list(items),
+        succeeded=succeeded,
+        failed=len(items) - succeeded,
+        retries=retries,
+        duration_seconds=duration,
+        conversations_per_second=succeeded / duration if duration else 0.0,
+    )
+
+def query_endpoint_batch(endpoint_name, conversations, return_traces=False, use_cache=True, max_concurrency=None, max_retries=None) -> BatchResult:
+    """Blocking version of `aquery_endpoint_batch`, for jobs and notebooks."""
+    async def batch():
+        try:
+            return await aquery_endpoint_batch(
+                endpoint_name, conversations, return_traces, use_cache, max_concurrency, max_retries
+            )
+        finally:
+            # the event loop is discarded once the batch is done; don't leave its HTTP client open
+            await aclose_async_http_client()
+
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(batch())
+    # notebooks already run an event loop in this thread
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        return executor.submit(asyncio.run, batch()).result()
+
+def _feedback_record(request_id, rating):
+    """Build one `dataframe_records` entry of a feedback request."""
     rating_string = "positive" if rating == 1 else "negative"
     text_assessments = [] if rating is None else [{
         "ratings": {
@@ -225,28 +1080,63 @@ def submit_feedback(endpoint, request_id, rating):
         "free_text_comment": None
     }]
 
-    proxy_payload = {
-        "dataframe_records": [
-            {
-                "source": json.dumps({
-                    "id": "e2e-chatbot-app",  # Or extract from auth
-                    "type": "human"
-                }),
-                "request_id": request_id,
-                "text_assessments": json.dumps(text_assessments),
-                "retrieval_assessments": json.dumps([]),
-            }
-        ]
+    return {
+        "source": json.dumps({
+            "id": "e2e-chatbot-app",  # Or extract from auth
+            "type": "human"
+        }),
+        "request_id": request_id,
+        "text_assessments": json.dumps(text_assessments),
+        "retrieval_assessments": json.dumps([]),
     }
-    w = WorkspaceClient()
-    return w.api_client.do(
-        method='POST',
-        path=f"/serving-endpoints/{endpoint}/served-models/feedback/invocations",
-        body=proxy_payload,
-    )
 
+def _post_feedback(endpoint, records):
+    """Send any number of feedback records to an endpoint in a single request."""
+    start_time = time.perf_counter()
+    try:
+        response = get_workspace_client().api_client.do(
+            method='POST',
+            path=f"/serving-endpoints/{endpoint}/served-models/feedback/invocations",
+            body={"dataframe_records": records},
+        )
+    except Exception as e:
+        _record_error(endpoint, "feedback", e)
+        raise
+    labels = {"endpoint": endpoint, "operation": "feedback"}
+    _metrics.observe("endpoint_request_seconds", time.perf_counter() - start_time, **labels)
+    _metrics.observe("endpoint_request_bytes", _payload_bytes(records), **labels)
+    return response
+
+def submit_feedback(endpoint, request_id, rating):
+    """Submit feedback to the agent."""
+    return _post_feedback(endpoint, [_feedback_record(request_id, rating)])
+
+# Feedback from the UI goes through a background queue and is posted in batches
+_feedback_queue = FeedbackQueue(
+    _post_feedback,
+    max_batch_size=int(os.getenv("FEEDBACK_BATCH_SIZE", "50")),
+    flush_interval_seconds=float(os.getenv("FEEDBACK_FLUSH_INTERVAL_SECONDS", "2")),
+)
+
+def enqueue_feedback(endpoint, request_id, rating) -> bool:
+    """
+    Queue feedback for batched submission in the background and return
+    immediately. Returns False if the queue is full and the rating was dropped.
+    """
+    return _feedback_queue.submit(endpoint, _feedback_record(request_id, rating))
+
+def flush_feedback(timeout=None) -> bool:
+    """Wait until all queued feedback has been sent."""
+    return _feedback_queue.flush(timeout)
+
+def feedback_queue_stats() -> dict:
+    return _feedback_queue.stats()
 
 def endpoint_supports_feedback(endpoint_name):
-    w = WorkspaceClient()
-    endpoint = w.serving_endpoints.get(endpoint_name)
-    return "feedback" in [entity.name for entity in endpoint.config.served_entities]
+    """Whether the endpoint serves a feedback entity; False if its metadata can't be read."""
+    try:
+        return get_endpoint_descriptor(endpoint_name).supports_feedback
+    except Exception as e:
+        _record_error(endpoint_name, "metadata", e)
+        return False
+
@@ -0,0 +1,113 @@
+"""
+Bounded in-memory cache of endpoint responses.
+
+Entries are keyed by a canonical hash of the endpoint name and the normalized
+conversation, expire after a TTL, and are evicted least-recently-used first once
+either the entry count or the approximate memory bound is exceeded.
+"""
+from collections import OrderedDict
+from typing import Optional
+import hashlib
+import json
+import threading
+import time
+
+def _normalize_message(msg):
+    """Keep only the fields that change the model's answer."""
+    content = msg.get("content")
+    normalized = {
+        "role": msg.get("role"),
+        "content": " ".join(content.split()) if isinstance(content, str) else content,
+    }
+    if msg.get("tool_calls"):
+        normalized["tool_calls"] = [
+            {"name": call["function"]["name"], "arguments": call["function"]["arguments"]}
+            for call in msg["tool_calls"]
+        ]
+    if msg.get("tool_call_id"):
+        normalized["tool_call_id"] = msg["tool_call_id"]
+    return normalized
+
+def response_cache_key(endpoint_name: str, messages: list) -> str:
+    """Canonical hash of an endpoint name and a conversation."""
+    canonical = json.dumps(
+        [endpoint_name, [_normalize_message(msg) for msg in messages]],
+        sort_keys=True,
+        separators=(",", ":"),
+        ensure_ascii=False,
+    )
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+class ResponseCache:
+    """Thread-safe LRU cache with a TTL, an entry limit and an approximate byte limit."""
+
+    def __init__(self, max_entries: int, max_bytes: int, ttl_seconds: float, clock=time.monotonic):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self._clock = clock
+        self._lock = threading.Lock()
+        # key -> (expires_at, size, value), least recently used first
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_entries > 0
+
+    def get(self, key: str):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            if entry[0] <= self._clock():
+                self._remove(key)
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[2]
+
+    def put(self, key: str, value):
+        size = len(value) if isinstance(value, (str, bytes)) else len(json.dumps(value, default=str))
+        if not self.enabled or size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (self._clock() + self.ttl_seconds, size, value)
+            self._bytes += size
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def invalidate(self, key: Optional[str] = None):
+        """Drop one entry, or every entry if no key is given."""
+        with self._lock:
+            if key is None:
+                self._entries.clear()
+                self._bytes = 0
+            elif key in self._entries:
+                self._remove(key)
+
+    def _remove(self, key):
+        self._bytes -= self._entries.pop(key)[1]
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+            }
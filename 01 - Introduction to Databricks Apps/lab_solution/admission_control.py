@@ -0,0 +1,191 @@
+"""
+Admission control for LLM requests.
+
+Every request needs one of `max_concurrency` slots. Each user also has a
+token bucket that refills at `user_rate_per_second` up to `user_burst`
+requests, so one user can't take every slot. When all slots are taken,
+requests wait in a queue that is fair between users: a freed slot goes to
+the next user in round-robin order, not to whoever has queued the most.
+A request over its user's rate, or that finds the queue full, is rejected
+with `AdmissionRejected` right away; a queued request is rejected once it has
+waited `max_wait_seconds` without a slot. Either way the app can tell the user
+to retry instead of leaving them waiting until a timeout.
+"""
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+import threading
+import time
+
+# Identity headers set by the Databricks Apps proxy, most specific first
+USER_HEADERS = ("x-forwarded-email", "x-forwarded-preferred-username", "x-forwarded-user")
+
+def forwarded_user(headers, default: str = "anonymous") -> str:
+    """The user a request was made by, according to the headers the Databricks Apps proxy forwards."""
+    for header in USER_HEADERS:
+        value = headers.get(header) if headers else None
+        if value:
+            return value
+    return default
+
+class AdmissionRejected(Exception):
+    """A request was not admitted; `reason` is "rate_limited", "queue_full" or "timeout"."""
+
+    def __init__(self, reason: str, retry_after: float):
+        super().__init__(f"Request not admitted ({reason}), retry after {retry_after:.1f}s")
+        self.reason = reason
+        self.retry_after = retry_after
+
+class TokenBucket:
+    """Allows `burst` requests at once and `rate` requests per second on average."""
+
+    def __init__(self, rate: float, burst: float, clock=time.monotonic):
+        self.rate = rate
+        self.burst = burst
+        self._clock = clock
+        self.tokens = burst
+        self.updated = clock()
+
+    def _refill(self):
+        now = self._clock()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def try_take(self) -> bool:
+        self._refill()
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+    def refund(self):
+        """Give back a token taken for a request that was not admitted after all."""
+        self._refill()
+        self.tokens = min(self.burst, self.tokens + 1)
+
+    def retry_after(self) -> float:
+        """Seconds until the next token is available."""
+        self._refill()
+        return max(0.0, (1 - self.tokens) / self.rate) if self.rate > 0 else float("inf")
+
+    def full(self) -> bool:
+        self._refill()
+        return self.tokens >= self.burst
+
+class _Waiter:
+    __slots__ = ("user", "event", "granted")
+
+    def __init__(self, user):
+        self.user = user
+        self.event = threading.Event()
+        self.granted = False
+
+class AdmissionController:
+    """Limits concurrent requests globally and per user, queueing fairly between users."""
+
+    def __init__(
+        self,
+        max_concurrency: int = 16,
+        user_rate_per_second: float = 1.0,
+        user_burst: float = 5,
+        max_wait_seconds: float = 10.0,
+        max_queue_size: int = 100,
+        clock=time.monotonic,
+    ):
+        self.max_concurrency = max_concurrency
+        self.user_rate_per_second = user_rate_per_second
+        self.user_burst = user_burst
+        self.max_wait_seconds = max_wait_seconds
+        self.max_queue_size = max_queue_size
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._buckets = {}
+        # user -> waiters of that user, oldest first; users in the order they are served next
+        self._queues = OrderedDict()
+        self._queued = 0
+        self.in_flight = 0
+        self.admitted = 0
+        self.queued_total = 0
+        self.rejected = {"rate_limited": 0, "queue_full": 0, "timeout": 0}
+
+    def _bucket(self, user) -> TokenBucket:
+        bucket = self._buckets.get(user)
+        if bucket is None:
+            # buckets that refilled completely hold no state worth keeping
+            if len(self._buckets) > 10000:
+                self._buckets = {name: b for name, b in self._buckets.items() if not b.full()}
+            bucket = self._buckets[user] = TokenBucket(self.user_rate_per_second, self.user_burst, self._clock)
+        return bucket
+
+    def _reject(self, reason, retry_after):
+        self.rejected[reason] += 1
+        raise AdmissionRejected(reason, retry_after)
+
+    def acquire(self, user: str) -> float:
+        """Take a slot for `user`, waiting in the fair queue if needed. Returns the seconds waited."""
+        with self._lock:
+            bucket = self._bucket(user)
+            if not bucket.try_take():
+                self._reject("rate_limited", bucket.retry_after())
+            if self.in_flight < self.max_concurrency and not self._queued:
+                self.in_flight += 1
+                self.admitted += 1
+                return 0.0
+            if self._queued >= self.max_queue_size:
+                # only admitted requests count against the user's rate
+                bucket.refund()
+                self._reject("queue_full", self.max_wait_seconds)
+            waiter = _Waiter(user)
+            self._queues.setdefault(user, deque()).append(waiter)
+            self._queued += 1
+            self.queued_total += 1
+
+        start_time = self._clock()
+        waiter.event.wait(self.max_wait_seconds)
+        with self._lock:
+            if waiter.granted:
+                self.admitted += 1
+                return self._clock() - start_time
+            queue = self._queues.get(user)
+            if queue is not None:
+                queue.remove(waiter)
+                if not queue:
+                    del self._queues[user]
+            self._queued -= 1
+            self._bucket(user).refund()
+            self._reject("timeout", self.max_wait_seconds)
+
+    def release(self):
+        """Give a slot back, handing it straight to the next queued user if there is one."""
+        with self._lock:
+            if not self._queues:
+                self.in_flight -= 1
+                return
+            user, queue = next(iter(self._queues.items()))
+            waiter = queue.popleft()
+            if queue:
+                self._queues.move_to_end(user)
+            else:
+                del self._queues[user]
+            self._queued -= 1
+            waiter.granted = True
+            waiter.event.set()
+
+    @contextmanager
+    def admit(self, user: str):
+        """Hold a slot for `user` while the block runs; raises `AdmissionRejected` if none is given."""
+        waited = self.acquire(user)
+        try:
+            yield waited
+        finally:
+            self.release()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "in_flight": self.in_flight,
+                "queued": self._queued,
+                "queued_users": len(self._queues),
+                "admitted": self.admitted,
+                "queued_total": self.queued_total,
+                "rejected": dict(self.rejected),
+            }
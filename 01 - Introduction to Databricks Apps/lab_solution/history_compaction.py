@@ -0,0 +1,191 @@
+"""
+Token-budget-aware compaction of chat history.
+
+Token counts are estimated locally from the text length, which is close enough
+to real tokenizers for budgeting and costs next to nothing. When a conversation
+exceeds its budget, system messages and the most recent turns are kept, overly
+long older messages are truncated, and everything before the kept window is
+collapsed into one summary message. System messages that would leave no room
+for the latest message are shortened, down to half of the budget. Summaries are cached, so retries and
+repeated calls for the same history don't summarize it again.
+"""
+from collections import OrderedDict
+from response_cache import response_cache_key
+import threading
+
+# Average number of characters per token for English text
+CHARS_PER_TOKEN = 4
+# Role markers and separators the chat template adds to every message
+MESSAGE_OVERHEAD_TOKENS = 4
+# Start of the message that replaces the collapsed turns
+SUMMARY_HEADER = "Summary of the earlier part of this conversation:\n"
+
+def estimate_tokens(text) -> int:
+    """Fast approximation of the number of tokens in `text`."""
+    if not text:
+        return 0
+    if not isinstance(text, str):
+        text = str(text)
+    # short words are about a token each, long ones are split into several
+    return max(len(text) // CHARS_PER_TOKEN, len(text.split()))
+
+def message_tokens(msg) -> int:
+    tokens = MESSAGE_OVERHEAD_TOKENS + estimate_tokens(msg.get("content"))
+    for tool_call in msg.get("tool_calls") or ():
+        tokens += estimate_tokens(tool_call["function"]["name"]) + estimate_tokens(tool_call["function"]["arguments"])
+    return tokens
+
+def truncate_text(text: str, max_tokens: int) -> str:
+    """Shorten `text` to about `max_tokens`, keeping its beginning and end."""
+    max_chars = max_tokens * CHARS_PER_TOKEN
+    if not isinstance(text, str) or len(text) <= max_chars:
+        return text
+    # leave room for the " [...] " marker
+    max_chars = max(0, max_chars - 7)
+    head = max_chars * 2 // 3
+    tail = max_chars - head
+    return f"{text[:head]} [...] {text[len(text) - tail:]}"
+
+def extractive_summary(messages, max_tokens: int) -> str:
+    """Summarize messages locally by keeping the start of each user and assistant message."""
+    lines = [
+        (msg["role"].capitalize(), " ".join(str(msg["content"]).split()))
+        for msg in messages
+        if msg.get("role") in ("user", "assistant") and msg.get("content")
+    ]
+    if not lines:
+        return ""
+    max_chars = max_tokens * CHARS_PER_TOKEN
+    line_chars = max(80, max_chars // len(lines))
+    summary_lines = []
+    used = 0
+    # the most recent exchanges are the most relevant, so fill the budget from the end
+    for role, text in reversed(lines):
+        line = f"- {role}: {text[:line_chars]}{'...' if len(text) > line_chars else ''}"
+        if used + len(line) > max_chars:
+            break
+        summary_lines.append(line)
+        used += len(line) + 1
+    return "\n".join(reversed(summary_lines))
+
+class HistoryCompactor:
+    """
+    Keeps chat histories under `token_budget` estimated tokens.
+
+    `summarizer(messages, max_tokens)` turns the collapsed turns into text; it
+    defaults to `extractive_summary` and can be swapped for an LLM call.
+    """
+
+    def __init__(
+        self,
+        token_budget: int,
+        max_message_tokens: int = None,
+        summary_tokens: int = None,
+        summarizer=extractive_summary,
+        max_cached_summaries: int = 256,
+    ):
+        self.token_budget = token_budget
+        self.max_message_tokens = max_message_tokens or max(1, token_budget // 4)
+        self.summary_tokens = summary_tokens or max(1, token_budget // 8)
+        self.summarizer = summarizer
+        self.max_cached_summaries = max_cached_summaries
+        self._summaries = OrderedDict()
+        self._lock = threading.Lock()
+        self.compactions = 0
+        self.summary_cache_hits = 0
+        self.summary_cache_misses = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.token_budget > 0
+
+    def compact(self, messages: list) -> list:
+        """Return `messages` unchanged if it fits the budget, or a compacted copy otherwise."""
+        if not self.enabled or sum(message_tokens(msg) for msg in messages) <= self.token_budget:
+            return messages
+
+        system_messages = [msg for msg in messages if msg.get("role") == "system"]
+        conversation = [msg for msg in messages if msg.get("role") != "system"]
+        if system_messages and conversation:
+            # shorten long system prompts rather than the latest message
+            room = (
+                self.token_budget
+                - self.summary_tokens
+                - MESSAGE_OVERHEAD_TOKENS
+                - message_tokens(conversation[-1])
+            )
+            system_messages = self._fit(system_messages, max(room, self.token_budget // 2))
+        available = (
+            self.token_budget
+            - sum(message_tokens(msg) for msg in system_messages)
+            - self.summary_tokens
+            - MESSAGE_OVERHEAD_TOKENS
+        )
+
+        # walk back from the latest message and keep as many recent turns as fit
+        kept = []
+        used = 0
+        for index in range(len(conversation) - 1, -1, -1):
+            limit = self.max_message_tokens if kept else max(1, available - MESSAGE_OVERHEAD_TOKENS)
+            msg = self._truncate(conversation[index], limit)
+            tokens = message_tokens(msg)
+            if kept and used + tokens > available:
+                break
+            kept.append(msg)
+            used += tokens
+        kept.reverse()
+
+        # don't start the window in the middle of a turn, e.g. on a tool result
+        while len(kept) > 1 and kept[0].get("role") != "user":
+            kept.pop(0)
+        dropped = conversation[:len(conversation) - len(kept)]
+
+        with self._lock:
+            self.compactions += 1
+        compacted = list(system_messages)
+        if dropped:
+            summary = self._summary(dropped)
+            if summary:
+                compacted.append({
+                    "role": "system",
+                    "content": f"{SUMMARY_HEADER}{summary}"
+                })
+        compacted.extend(kept)
+        return compacted
+
+    def _fit(self, messages, max_tokens):
+        """Truncate `messages` to an equal share each of `max_tokens`, if they don't fit as they are."""
+        if sum(message_tokens(msg) for msg in messages) <= max_tokens:
+            return messages
+        share = max(1, max_tokens // len(messages) - MESSAGE_OVERHEAD_TOKENS)
+        return [self._truncate(msg, share) for msg in messages]
+
+    def _truncate(self, msg, max_tokens):
+        if estimate_tokens(msg.get("content")) <= max_tokens:
+            return msg
+        return {**msg, "content": truncate_text(msg["content"], max_tokens)}
+
+    def _summary(self, dropped):
+        key = response_cache_key("history-summary", dropped)
+        with self._lock:
+            summary = self._summaries.get(key)
+            if summary is not None:
+                self._summaries.move_to_end(key)
+                self.summary_cache_hits += 1
+                return summary
+            self.summary_cache_misses += 1
+        # the header counts against the summary's budget too
+        summary = self.summarizer(dropped, max(1, self.summary_tokens - estimate_tokens(SUMMARY_HEADER)))
+        with self._lock:
+            self._summaries[key] = summary
+            if len(self._summaries) > self.max_cached_summaries:
+                self._summaries.popitem(last=False)
+        return summary
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "compactions": self.compactions,
+                "summary_cache_hits": self.summary_cache_hits,
+                "summary_cache_misses": self.summary_cache_misses,
+            }
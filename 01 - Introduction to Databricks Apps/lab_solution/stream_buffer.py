@@ -0,0 +1,156 @@
+"""
+Resumable streams, buffered server-side by request ID.
+
+If a browser drops its websocket mid-answer, the generator feeding it is
+closed and the answer is lost, so the user asks again and the endpoint
+generates it twice. `StreamBuffer` keeps every stream under a request ID
+chosen by the caller, one per conversation turn: the upstream iterator is
+pumped by a daemon thread into a bounded ring of the latest `max_chunks`
+chunks, and a client that comes back with the same request ID while the
+answer is still being generated replays the buffered chunks from the offset
+it asks for, then follows the live stream, without a new upstream call.
+
+Only live streams are reattached to: once a stream has ended, the same
+request ID starts a new upstream call, so asking again gets a new answer.
+A stream nobody is reading any more is cancelled once `grace_seconds` have
+passed without a subscriber.
+"""
+from collections import OrderedDict, deque
+from itertools import islice
+import threading
+import time
+
+class StreamExpired(Exception):
+    """The requested offset of a stream is no longer buffered, or the stream is unknown."""
+
+class BufferedStream:
+    """An upstream iterator, pumped by a daemon thread into a ring buffer that subscribers read from any offset."""
+
+    def __init__(self, max_chunks: int = 4096, grace_seconds: float = 15.0, clock=time.monotonic):
+        self.grace_seconds = grace_seconds
+        self._clock = clock
+        self._chunks = deque(maxlen=max_chunks)
+        # offset of the oldest chunk still in the ring
+        self.first_offset = 0
+        self.finished = False
+        self.cancelled = False
+        self.error = None
+        self._subscribers = 0
+        self._abandoned_at = None
+        self._cond = threading.Condition()
+
+    @property
+    def end_offset(self) -> int:
+        return self.first_offset + len(self._chunks)
+
+    def start(self, upstream):
+        # until the first client subscribes, the stream counts as abandoned
+        self._abandoned_at = self._clock()
+        threading.Thread(target=self._pump, args=(upstream,), name="stream-buffer", daemon=True).start()
+
+    def _abandoned(self) -> bool:
+        return (
+            self._subscribers == 0
+            and self._abandoned_at is not None
+            and self._clock() - self._abandoned_at >= self.grace_seconds
+        )
+
+    def _pump(self, upstream):
+        error = None
+        try:
+            for chunk in upstream:
+                with self._cond:
+                    if len(self._chunks) == self._chunks.maxlen:
+                        self.first_offset += 1
+                    self._chunks.append(chunk)
+                    self._cond.notify_all()
+                    if self._abandoned():
+                        self.cancelled = True
+                        break
+        except Exception as e:
+            error = e
+        finally:
+            if self.cancelled and hasattr(upstream, "close"):
+                upstream.close()
+            with self._cond:
+                self.finished = True
+                self.error = error
+                self._cond.notify_all()
+
+    def subscribe(self, offset: int = 0):
+        """Yield the chunks from `offset` on, following the stream until it ends."""
+        with self._cond:
+            if offset < self.first_offset:
+                raise StreamExpired(f"Offset {offset} was dropped, the oldest buffered offset is {self.first_offset}")
+            self._subscribers += 1
+            self._abandoned_at = None
+        index = offset
+        try:
+            while True:
+                with self._cond:
+                    while index >= self.end_offset and not self.finished:
+                        self._cond.wait()
+                    if index < self.first_offset:
+                        raise StreamExpired(f"The reader fell behind the buffer at offset {index}")
+                    batch = list(islice(self._chunks, index - self.first_offset, None))
+                    if not batch:
+                        if self.error is not None:
+                            raise self.error
+                        return
+                index += len(batch)
+                yield from batch
+        finally:
+            with self._cond:
+                self._subscribers -= 1
+                if self._subscribers == 0:
+                    self._abandoned_at = self._clock()
+
+class StreamBuffer:
+    """Live buffered streams by request ID; see the module docstring."""
+
+    def __init__(self, max_chunks: int = 4096, grace_seconds: float = 15.0, clock=time.monotonic):
+        self.max_chunks = max_chunks
+        self.grace_seconds = grace_seconds
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._streams = OrderedDict()
+        self.started = 0
+        self.resumed = 0
+
+    def _purge(self):
+        # subscribers still reading a finished stream hold on to it themselves
+        for request_id, stream in list(self._streams.items()):
+            if stream.finished:
+                del self._streams[request_id]
+
+    def stream(self, request_id: str, factory, offset: int = 0):
+        """
+        Subscribe to the live stream of `request_id` from `offset`, calling
+        `factory()` for a new upstream iterator if there is none. Raises
+        `StreamExpired` when a resume (`offset` > 0) can't be served from the
+        buffer.
+        """
+        with self._lock:
+            self._purge()
+            stream = self._streams.get(request_id)
+            reusable = stream is not None and not stream.finished and offset >= stream.first_offset
+            if reusable:
+                self.resumed += 1
+            elif offset:
+                raise StreamExpired(f"Stream {request_id} can't be resumed from offset {offset}")
+            else:
+                stream = BufferedStream(self.max_chunks, self.grace_seconds, self._clock)
+                self._streams[request_id] = stream
+                self._streams.move_to_end(request_id)
+                stream.start(factory())
+                self.started += 1
+            return stream.subscribe(offset)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "streams": len(self._streams),
+                "in_flight": sum(1 for stream in self._streams.values() if not stream.finished),
+                "started": self.started,
+                "resumed": self.resumed,
+            }
@@ -84,19 +84,21 @@
 # MAGIC %md
 # MAGIC ### Source code
 # MAGIC
-# MAGIC Open the *data_app.py* file. The code is generously commented, but we'll walk through it now, section by section. We won't get into too much detail on how Gradio works, since this topic is covered in great detail by the [Gradio documentation](https://www.gradio.app/docs). But we'll provide a quick overview here.
+# MAGIC Open the *data_app.py* file. The code is generously commented, but we'll walk through it now, section by section. The folder also contains *sql_utils.py*, a small helper module that *data_app.py* imports; Databricks Apps deploys every file in the source code folder, so the app can import it like any other module. We won't get into too much detail on how Gradio works, since this topic is covered in great detail by the [Gradio documentation](https://www.gradio.app/docs). But we'll provide a quick overview here.
 # MAGIC ___
 # MAGIC ```
 # MAGIC from databricks.sdk import WorkspaceClient
 # MAGIC from databricks.sdk.service.sql import StatementParameterListItem, StatementState
+# MAGIC from sql_utils import caller_identity, iter_result_rows, read_rows, result_cache, statement_cache_key
 # MAGIC import gradio as gr
 # MAGIC import logging
 # MAGIC import os
 # MAGIC import sys
-# MAGIC from typing import Dict, List
+# MAGIC from typing import Dict, Iterator, List, Tuple
 # MAGIC ```
 # MAGIC These lines import the various modules that we'll use through the code:
 # MAGIC - Various objects from the Databricks SDK, primarily for interacting with the SQL warehouse
+# MAGIC - helpers from *sql_utils.py* that read query results and cache them, which we'll cover along with `sql_query()`
 # MAGIC - core Gradio functionality, making it accessible through the shorter alias, `gr` (his is a widely adopted convention for better readability of code)
 # MAGIC - logging for emitting messages from the app, to facilitate troubleshooting and gaining insight into app behaviour
 # MAGIC - miscellaneous utility modules
@@ -118,11 +120,16 @@
 # MAGIC     query: str,
 # MAGIC     catalog: str=None,
 # MAGIC     schema: str=None,
-# MAGIC     parameters: List[Dict]=None
+# MAGIC     parameters: List[Dict]=None,
+# MAGIC     cache_ttl_seconds: float=None
 # MAGIC ) -> Dict...
 # MAGIC ```
 # MAGIC The `sql_query()` helper function runs the specified query on the SQL warehouse through the SDK connection established on startup (`wclient`).
 # MAGIC
+# MAGIC The warehouse returns large results in several chunks. `sql_query()` reads them through `sql_query_rows()`, which returns the column names and an iterator over the rows that fetches the chunks as they are read, a few of them in parallel (`iter_result_rows()` in *sql_utils.py*). `sql_query()` loads every row by default. Set the `SQL_MAX_RESULT_ROWS` environment variable to keep at most that many rows, so a large result can't exhaust the app's memory; when a result is cut off, the app shows a warning. Call `sql_query_rows()` directly to process every row of a result without holding all of them at once.
+# MAGIC
+# MAGIC Results are kept in an in-memory cache (`result_cache`, from *sql_utils.py*) for `cache_ttl_seconds`, so previewing the same table again doesn't cost another round trip to the warehouse. The cache is keyed by the query, catalog, schema, parameters and the identity the query runs as, and its size is bounded by the `SQL_CACHE_MAX_BYTES` environment variable. Pass `cache_ttl_seconds=0` to always run the query.
+# MAGIC
 # MAGIC NOTE: it's possible to execute SQL queries using the [Databricks SQL connector](https://docs.databricks.com/aws/en/dev-tools/python-sql-connector), which some of the templates and documentation examples do. That library provides slightly different functionality though, and the SDK fits this use case better.
 # MAGIC ___
 # MAGIC ```
@@ -84,43 +84,71 @@
 
 # MAGIC %md
 # MAGIC
-# MAGIC If desired, use the following code snippet to get started integrating the SQL warehouse usage into your app:
+# MAGIC If desired, use the following code snippet to get started integrating the SQL warehouse usage into your app. It runs queries with `aexecute_statement()` from [sql_utils.py]($./lab_solution/sql_utils.py), which polls the statement from the event loop instead of holding a worker thread while the warehouse runs it; copy that file next to your *app.py*. The workspace client is created once and shared by every query through `WorkspaceClientHolder` from *client_registry.py*.
 # MAGIC
 # MAGIC ```
+# MAGIC from client_registry import WorkspaceClientHolder
+# MAGIC from sql_utils import StatementFailed, aexecute_statement
+# MAGIC
 # MAGIC # ensure environment variable is set correctly
 # MAGIC assert os.getenv('DATABRICKS_WAREHOUSE_ID'), "DATABRICKS_WAREHOUSE_ID must be set in app.yaml."
 # MAGIC
-# MAGIC # general function to run SQL queries on a warehouse specified by DATABRICKS_WAREHOUSE_ID
-# MAGIC def sql_query(query: str, request: gr.Request):
+# MAGIC # Queries still running after this many seconds are cancelled on the warehouse
+# MAGIC SQL_QUERY_TIMEOUT_SECONDS = float(os.getenv('SQL_QUERY_TIMEOUT_SECONDS', '300'))
 # MAGIC
-# MAGIC     # initialize a connection to the workspace using app service principal credentials
-# MAGIC     # (assumes DATABRICKS_CLIENT_ID, DATABRICKS_CLIENT_SECRET and DATABRICKS_HOST are set)
-# MAGIC     wclient = WorkspaceClient(auth_type='oauth-m2m')
+# MAGIC # one connection to the workspace for every query, using app service principal credentials
+# MAGIC # (assumes DATABRICKS_CLIENT_ID, DATABRICKS_CLIENT_SECRET and DATABRICKS_HOST are set)
+# MAGIC sql_client = WorkspaceClientHolder(auth_type='oauth-m2m')
 # MAGIC
-# MAGIC     logger.info(f"processing query {query} as {wclient.current_user.me().display_name}")
+# MAGIC # queries in flight per Gradio session, cancelled when the user closes the tab
+# MAGIC session_queries = {}
 # MAGIC
-# MAGIC     response = wclient.statement_execution.execute_statement(
-# MAGIC         statement=query,
-# MAGIC         warehouse_id=os.getenv('DATABRICKS_WAREHOUSE_ID'),
-# MAGIC         wait_timeout='50s'
-# MAGIC     )
+# MAGIC async def cancel_session_queries(request: gr.Request):
+# MAGIC     for task in session_queries.pop(request.session_hash, set()):
+# MAGIC         task.cancel()
+# MAGIC
+# MAGIC # general function to run SQL queries on a warehouse specified by DATABRICKS_WAREHOUSE_ID
+# MAGIC async def sql_query(query: str, request: gr.Request, timeout_seconds: float = SQL_QUERY_TIMEOUT_SECONDS):
+# MAGIC
+# MAGIC     # only the first query builds the client and looks up the service principal
+# MAGIC     wclient = await asyncio.to_thread(sql_client.client)
+# MAGIC     identity = await asyncio.to_thread(sql_client.identity)
+# MAGIC     logger.info(f"processing query {query} as {identity.display_name}")
 # MAGIC
-# MAGIC     if response.status.state != StatementState.SUCCEEDED:
+# MAGIC     task = asyncio.ensure_future(
+# MAGIC         aexecute_statement(wclient, query, os.getenv('DATABRICKS_WAREHOUSE_ID'), timeout_seconds)
+# MAGIC     )
+# MAGIC     session_queries.setdefault(request.session_hash, set()).add(task)
+# MAGIC     try:
+# MAGIC         response = await task
+# MAGIC     except StatementFailed as e:
 # MAGIC         # raise Gradio error if query did not succeed
-# MAGIC         error_string = ' '. join(response.status.error.message.splitlines())
-# MAGIC         logger.error(f"query failed: {error_string}")
-# MAGIC         raise gr.Error(error_string, duration=10)
-# MAGIC     else:
-# MAGIC         logger.info(f"query returned {response.result.row_count} records")
-# MAGIC
-# MAGIC         if response.result.row_count > 0:
-# MAGIC             return pd.DataFrame(
-# MAGIC                 response.result.data_array,
-# MAGIC                 columns = [ c.name for c in response.manifest.schema.columns]
-# MAGIC             )
-# MAGIC
-# MAGIC         return pd.DataFrame()
+# MAGIC         logger.error(f"query failed: {e}")
+# MAGIC         raise gr.Error(str(e), duration=10)
+# MAGIC     except asyncio.CancelledError:
+# MAGIC         if asyncio.current_task().cancelling():
+# MAGIC             raise
+# MAGIC         # only the query was cancelled, by cancel_session_queries
+# MAGIC         raise gr.Error("The query was cancelled.", duration=10)
+# MAGIC     finally:
+# MAGIC         queries = session_queries.get(request.session_hash)
+# MAGIC         if queries is not None:
+# MAGIC             queries.discard(task)
+# MAGIC             if not queries:
+# MAGIC                 del session_queries[request.session_hash]
+# MAGIC
+# MAGIC     logger.info(f"query returned {response.result.row_count} records")
+# MAGIC
+# MAGIC     if response.result.row_count > 0:
+# MAGIC         return pd.DataFrame(
+# MAGIC             response.result.data_array,
+# MAGIC             columns = [ c.name for c in response.manifest.schema.columns]
+# MAGIC         )
+# MAGIC
+# MAGIC     return pd.DataFrame()
 # MAGIC ```
+# MAGIC
+# MAGIC Call `sql_query()` from an `async` event handler that takes the `gr.Request`, and register `demo.unload(cancel_session_queries)` inside your `gr.Blocks`, so closing the tab cancels the user's queries on the warehouse.
 
 # COMMAND ----------
 
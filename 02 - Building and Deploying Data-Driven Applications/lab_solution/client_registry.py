@@ -0,0 +1,174 @@
+"""
+Process-wide registry of the clients used to talk to the Databricks workspace.
+
+Building a WorkspaceClient or an MLflow deployments client resolves credentials
+and starts a new HTTP connection pool. The clients here are created once per
+process, on first use, and shared by every thread, so requests reuse pooled
+keep-alive connections instead of doing a new TLS handshake each time. The async
+HTTP client is shared the same way, once per event loop.
+
+Apps that query the workspace on every request can share a client through a
+`WorkspaceClientHolder` instead, which also keeps its OAuth token fresh from a
+daemon thread, so no request waits for a token exchange, and looks up the
+principal the client authenticates as only once.
+
+mlflow, the Databricks SDK and httpx take seconds to import, so they are only
+imported when the first client is built, not when this module is loaded.
+"""
+from typing import TYPE_CHECKING
+import asyncio
+import logging
+import os
+import threading
+import weakref
+
+if TYPE_CHECKING:
+    from databricks.sdk import WorkspaceClient
+    import httpx
+
+logger = logging.getLogger(__name__)
+
+# Maximum number of pooled HTTP connections kept open to the workspace
+HTTP_POOL_SIZE = int(os.getenv("MODEL_SERVING_HTTP_POOL_SIZE", "32"))
+# The async client multiplexes many in-flight chats, so it gets a much larger pool
+ASYNC_HTTP_MAX_CONNECTIONS = int(os.getenv("MODEL_SERVING_ASYNC_MAX_CONNECTIONS", "256"))
+# How long an idle async connection stays open for reuse
+HTTP_KEEPALIVE_SECONDS = float(os.getenv("MODEL_SERVING_HTTP_KEEPALIVE_SECONDS", "60"))
+# Agents can take minutes to answer, so only the connect phase gets a short timeout
+HTTP_TIMEOUT_SECONDS = float(os.getenv("MODEL_SERVING_HTTP_TIMEOUT_SECONDS", "300"))
+# Seconds between checks of a shared client's OAuth token; 0 leaves refreshing it to the requests
+TOKEN_REFRESH_INTERVAL_SECONDS = float(os.getenv("DATABRICKS_TOKEN_REFRESH_INTERVAL_SECONDS", "60"))
+
+class WorkspaceClientHolder:
+    """
+    A WorkspaceClient shared by the process, built on first use with the given
+    config attributes (e.g. `auth_type`). Every `refresh_interval_seconds` a
+    daemon thread asks for the client's auth headers: the SDK hands out the
+    cached token, and once it is close to expiring refreshes it in the
+    background, so requests keep using a valid token instead of waiting for
+    the exchange. The principal the client authenticates as is cached too.
+    """
+
+    def __init__(self, refresh_interval_seconds: float = TOKEN_REFRESH_INTERVAL_SECONDS, **config_attributes):
+        self.refresh_interval_seconds = refresh_interval_seconds
+        self._config_attributes = config_attributes
+        self._lock = threading.Lock()
+        self._client = None
+        self._identity = None
+        self._stop = None
+        self.refresh_failures = 0
+
+    def client(self) -> "WorkspaceClient":
+        """Return the shared client, building it on first use."""
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    from databricks.sdk import WorkspaceClient
+                    from databricks.sdk.core import Config
+                    config = Config(
+                        max_connection_pools=HTTP_POOL_SIZE,
+                        max_connections_per_pool=HTTP_POOL_SIZE,
+                        # a stale token keeps being used while its replacement is fetched
+                        disable_async_token_refresh=False,
+                        **self._config_attributes,
+                    )
+                    self._client = WorkspaceClient(config=config)
+                    if self.refresh_interval_seconds > 0:
+                        self._stop = threading.Event()
+                        threading.Thread(
+                            target=self._keep_token_fresh, args=(self._client, self._stop),
+                            name="token-refresh", daemon=True,
+                        ).start()
+        return self._client
+
+    def _keep_token_fresh(self, client, stop):
+        while not stop.wait(self.refresh_interval_seconds):
+            try:
+                client.config.authenticate()
+            except Exception as e:
+                self.refresh_failures += 1
+                logger.warning(f"Refreshing the workspace token failed: {e}")
+
+    def identity(self):
+        """The user or service principal the client authenticates as (`current_user.me()`), looked up once."""
+        if self._identity is None:
+            identity = self.client().current_user.me()
+            with self._lock:
+                self._identity = identity
+        return self._identity
+
+    def reset(self):
+        """Drop the client and identity so the next call builds a new client (e.g. after rotating credentials)."""
+        with self._lock:
+            if self._stop is not None:
+                self._stop.set()
+            self._client = None
+            self._identity = None
+            self._stop = None
+
+_lock = threading.Lock()
+_deploy_client = None
+_workspace_client = None
+# httpx.AsyncClient can only be used on the event loop it was first used on
+_async_http_clients = weakref.WeakKeyDictionary()
+
+def get_deploy_client():
+    """Return the shared MLflow deployments client for Databricks model serving."""
+    global _deploy_client
+    if _deploy_client is None:
+        with _lock:
+            if _deploy_client is None:
+                # MLflow keeps one requests session per process; size its pool before first use
+                os.environ.setdefault("MLFLOW_HTTP_POOL_CONNECTIONS", str(HTTP_POOL_SIZE))
+                os.environ.setdefault("MLFLOW_HTTP_POOL_MAXSIZE", str(HTTP_POOL_SIZE))
+                from mlflow.deployments import get_deploy_client as mlflow_get_deploy_client
+                _deploy_client = mlflow_get_deploy_client("databricks")
+    return _deploy_client
+
+def get_workspace_client() -> "WorkspaceClient":
+    """Return the shared WorkspaceClient, authenticated with the default credential chain."""
+    global _workspace_client
+    if _workspace_client is None:
+        with _lock:
+            if _workspace_client is None:
+                from databricks.sdk import WorkspaceClient
+                from databricks.sdk.core import Config
+                config = Config(
+                    max_connection_pools=HTTP_POOL_SIZE,
+                    max_connections_per_pool=HTTP_POOL_SIZE,
+                )
+                _workspace_client = WorkspaceClient(config=config)
+    return _workspace_client
+
+def get_async_http_client() -> "httpx.AsyncClient":
+    """Return the pooled async HTTP client of the running event loop."""
+    import httpx
+    loop = asyncio.get_running_loop()
+    with _lock:
+        client = _async_http_clients.get(loop)
+        if client is None or client.is_closed:
+            client = httpx.AsyncClient(
+                limits=httpx.Limits(
+                    max_connections=ASYNC_HTTP_MAX_CONNECTIONS,
+                    max_keepalive_connections=ASYNC_HTTP_MAX_CONNECTIONS,
+                    keepalive_expiry=HTTP_KEEPALIVE_SECONDS,
+                ),
+                timeout=httpx.Timeout(HTTP_TIMEOUT_SECONDS, connect=10.0),
+            )
+            _async_http_clients[loop] = client
+    return client
+
+async def aclose_async_http_client():
+    """Close the async HTTP client of the running event loop, if one was created."""
+    with _lock:
+        client = _async_http_clients.pop(asyncio.get_running_loop(), None)
+    if client is not None:
+        await client.aclose()
+
+def reset_clients():
+    """Drop the shared clients so the next call builds new ones (e.g. after rotating credentials)."""
+    global _deploy_client, _workspace_client
+    with _lock:
+        _deploy_client = None
+        _workspace_client = None
+        _async_http_clients.clear()
@@ -0,0 +1,303 @@
+"""
+Latency-aware routing across several serving endpoints.
+
+The router tracks a moving average of each endpoint's latency, its error rate
+over the last requests and its in-flight requests, and sends every request to
+the endpoint with the lowest expected latency, divided by its weight. Failed
+requests fail over to the next best endpoint. A per-endpoint circuit breaker
+stops routing to an endpoint after repeated failures until a probe request
+succeeds again.
+"""
+from collections import deque
+from typing import Optional
+import threading
+import time
+
+class NoHealthyEndpointError(Exception):
+    """Every endpoint of a router is unavailable (its circuit breaker is open)."""
+
+def is_endpoint_failure(error: Exception) -> bool:
+    """Whether an error says something about the endpoint's health, rather than about the request."""
+    status_code = getattr(error, "status_code", None)
+    if status_code is None:
+        # HTTP errors raised by the MLflow deployments client carry the response
+        status_code = getattr(getattr(error, "response", None), "status_code", None)
+    # client errors mean the endpoint is up and answering, except for a missing endpoint, timeouts and throttling
+    return not (status_code is not None and 400 <= status_code < 500 and status_code not in (404, 408, 429))
+
+class CircuitBreaker:
+    """Opens after `failure_threshold` consecutive failures and lets one probe through after `reset_timeout_seconds`."""
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout_seconds: float = 30.0, clock=time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout_seconds = reset_timeout_seconds
+        self._clock = clock
+        self.state = self.CLOSED
+        self.consecutive_failures = 0
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+
+    def available(self) -> bool:
+        """Whether a request could be sent now, without reserving the probe."""
+        if self.state == self.CLOSED:
+            return True
+        if self.state == self.OPEN:
+            return self._clock() >= self._opened_at + self.reset_timeout_seconds
+        return not self._probe_in_flight
+
+    def acquire(self):
+        """Reserve a request slot; in the half-open state only a single probe is let through."""
+        if self.state == self.OPEN:
+            self.state = self.HALF_OPEN
+        if self.state == self.HALF_OPEN:
+            self._probe_in_flight = True
+
+    def record_success(self):
+        self.state = self.CLOSED
+        self.consecutive_failures = 0
+        self._probe_in_flight = False
+
+    def record_failure(self):
+        self.consecutive_failures += 1
+        if self.state == self.HALF_OPEN or self.consecutive_failures >= self.failure_threshold:
+            self.state = self.OPEN
+            self._opened_at = self._clock()
+        self._probe_in_flight = False
+
+    def release(self):
+        """Give back a slot whose request was abandoned before it said anything about the endpoint."""
+        self._probe_in_flight = False
+
+class _EndpointState:
+    def __init__(self, name, weight, position, window_size, breaker):
+        self.name = name
+        self.weight = weight
+        self.position = position
+        self.breaker = breaker
+        self.latency = None
+        self.outcomes = deque(maxlen=window_size)
+        self.in_flight = 0
+
+    def error_rate(self) -> float:
+        return self.outcomes.count(False) / len(self.outcomes) if self.outcomes else 0.0
+
+    def score(self, error_penalty, default_latency) -> float:
+        # endpoints without a successful request yet are assumed to be as fast as the average one
+        latency = default_latency if self.latency is None else self.latency
+        return latency * (1 + self.in_flight) * (1 + error_penalty * self.error_rate()) / self.weight
+
+class EndpointRouter:
+    """Routes requests to the healthiest of several serving endpoints, with failover."""
+
+    def __init__(
+        self,
+        endpoints,
+        failure_threshold: int = 5,
+        reset_timeout_seconds: float = 30.0,
+        window_size: int = 50,
+        latency_smoothing: float = 0.2,
+        error_penalty: float = 4.0,
+        max_attempts: Optional[int] = None,
+        clock=time.monotonic,
+    ):
+        """`endpoints` is an ordered list of endpoint names or (name, weight) pairs; order breaks ties."""
+        self._lock = threading.Lock()
+        self._clock = clock
+        self.latency_smoothing = latency_smoothing
+        self.error_penalty = error_penalty
+        self._endpoints = []
+        for position, endpoint in enumerate(endpoints):
+            name, weight = (endpoint, 1.0) if isinstance(endpoint, str) else endpoint
+            self._endpoints.append(_EndpointState(
+                name, float(weight), position, window_size,
+                CircuitBreaker(failure_threshold, reset_timeout_seconds, clock),
+            ))
+        if not self._endpoints:
+            raise ValueError("An endpoint router needs at least one endpoint")
+        self.max_attempts = max_attempts or len(self._endpoints)
+
+    @classmethod
+    def from_spec(cls, spec: str, **kwargs) -> "EndpointRouter":
+        """Build a router from a comma-separated list of `name` or `name:weight` entries."""
+        endpoints = []
+        for entry in spec.split(","):
+            entry = entry.strip()
+            if not entry:
+                continue
+            name, _, weight = entry.partition(":")
+            endpoints.append((name.strip(), float(weight) if weight else 1.0))
+        return cls(endpoints, **kwargs)
+
+    @property
+    def endpoint_names(self) -> list:
+        return [endpoint.name for endpoint in self._endpoints]
+
+    def __str__(self):
+        return ",".join(self.endpoint_names)
+
+    def _choose(self, exclude) -> Optional[_EndpointState]:
+        with self._lock:
+            candidates = [
+                endpoint for endpoint in self._endpoints
+                if endpoint.name not in exclude and endpoint.breaker.available()
+            ]
+            if not candidates:
+                return None
+            measured = [endpoint.latency for endpoint in self._endpoints if endpoint.latency is not None]
+            # only relative scores matter, so any latency will do before the first measurement
+            default_latency = sum(measured) / len(measured) if measured else 1.0
+            best = min(candidates, key=lambda endpoint: (
+                endpoint.score(self.error_penalty, default_latency), endpoint.position
+            ))
+            best.breaker.acquire()
+            best.in_flight += 1
+            return best
+
+    def _record(self, endpoint, start_time, error=None):
+        with self._lock:
+            endpoint.in_flight -= 1
+            if error is not None and is_endpoint_failure(error):
+                endpoint.outcomes.append(False)
+                endpoint.breaker.record_failure()
+                return
+            latency = self._clock() - start_time
+            if endpoint.latency is None:
+                endpoint.latency = latency
+            else:
+                endpoint.latency += self.latency_smoothing * (latency - endpoint.latency)
+            endpoint.outcomes.append(True)
+            endpoint.breaker.record_success()
+
+    def _release(self, endpoint):
+        """Undo `_choose` for a request that was cancelled, without recording an outcome."""
+        with self._lock:
+            endpoint.in_flight -= 1
+            endpoint.breaker.release()
+
+    def _next_endpoint(self, tried, last_error):
+        if len(tried) >= self.max_attempts:
+            raise last_error
+        endpoint = self._choose(tried)
+        if endpoint is None:
+            if last_error is not None:
+                raise last_error
+            raise NoHealthyEndpointError(f"No healthy endpoint among {self}")
+        tried.add(endpoint.name)
+        return endpoint
+
+    def call(self, fn):
+        """Call `fn(endpoint_name)` on the best endpoint, failing over to the next one on endpoint errors."""
+        tried = set()
+        last_error = None
+        while True:
+            endpoint = self._next_endpoint(tried, last_error)
+            start_time = self._clock()
+            try:
+                result = fn(endpoint.name)
+            except BaseException as e:
+                if not isinstance(e, Exception):
+                    self._release(endpoint)
+                    raise
+                self._record(endpoint, start_time, e)
+                if not is_endpoint_failure(e):
+                    raise
+                last_error = e
+                continue
+            self._record(endpoint, start_time)
+            return result
+
+    async def acall(self, fn):
+        """Async version of `call`; `fn` is a coroutine function."""
+        tried = set()
+        last_error = None
+        while True:
+            endpoint = self._next_endpoint(tried, last_error)
+            start_time = self._clock()
+            try:
+                result = await fn(endpoint.name)
+            except BaseException as e:
+                if not isinstance(e, Exception):
+                    # cancelled or interrupted: the endpoint didn't fail, but its slot must be given back
+                    self._release(endpoint)
+                    raise
+                self._record(endpoint, start_time, e)
+                if not is_endpoint_failure(e):
+                    raise
+                last_error = e
+                continue
+            self._record(endpoint, start_time)
+            return result
+
+    def stream(self, fn):
+        """
+        Iterate `fn(endpoint_name)` on the best endpoint. Failover only happens
+        before the first chunk; latency is measured to the first chunk.
+        """
+        tried = set()
+        last_error = None
+        while True:
+            endpoint = self._next_endpoint(tried, last_error)
+            start_time = self._clock()
+            try:
+                chunks = iter(fn(endpoint.name))
+                first_chunk = next(chunks)
+            except StopIteration:
+                self._record(endpoint, start_time)
+                return
+            except BaseException as e:
+                if not isinstance(e, Exception):
+                    self._release(endpoint)
+                    raise
+                self._record(endpoint, start_time, e)
+                if not is_endpoint_failure(e):
+                    raise
+                last_error = e
+                continue
+            self._record(endpoint, start_time)
+            yield first_chunk
+            yield from chunks
+            return
+
+    async def astream(self, fn):
+        """Async version of `stream`; `fn` returns an async iterator."""
+        tried = set()
+        last_error = None
+        while True:
+            endpoint = self._next_endpoint(tried, last_error)
+            start_time = self._clock()
+            try:
+                chunks = fn(endpoint.name).__aiter__()
+                first_chunk = await chunks.__anext__()
+            except StopAsyncIteration:
+                self._record(endpoint, start_time)
+                return
+            except BaseException as e:
+                if not isinstance(e, Exception):
+                    self._release(endpoint)
+                    raise
+                self._record(endpoint, start_time, e)
+                if not is_endpoint_failure(e):
+                    raise
+                last_error = e
+                continue
+            self._record(endpoint, start_time)
+            yield first_chunk
+            async for chunk in chunks:
+                yield chunk
+            return
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                endpoint.name: {
+                    "weight": endpoint.weight,
+                    "latency_seconds": endpoint.latency,
+                    "error_rate": endpoint.error_rate(),
+                    "in_flight": endpoint.in_flight,
+                    "circuit": endpoint.breaker.state,
+                }
+                for endpoint in self._endpoints
+            }
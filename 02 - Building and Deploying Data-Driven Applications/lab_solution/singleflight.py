@@ -0,0 +1,283 @@
+"""
+Single-flight coalescing of identical in-flight requests.
+
+When several callers ask for the same key at the same time, only the first one
+(the leader) calls upstream; the others wait for it and share its result.
+Streams are shared the same way: one upstream iterator is read on behalf of
+every subscriber, and each subscriber replays its chunks from the beginning,
+so a subscriber that joins late still receives the whole answer. There is no
+background thread: whichever subscriber runs out of chunks reads the next one
+from the upstream. Once every caller of a call or stream has gone away, its
+upstream request is closed or cancelled.
+
+The leader gets the upstream's objects; followers get their own deep copies,
+so nobody mutates what the others receive.
+"""
+import asyncio
+import copy
+import threading
+
+class _Call:
+    __slots__ = ("done", "result", "error")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+class _SharedStream:
+    """An upstream iterator whose chunks are replayed to every subscriber, read by the subscribers themselves."""
+
+    def __init__(self, upstream, on_finish):
+        self._upstream = upstream
+        self._iterator = iter(upstream)
+        self._on_finish = on_finish
+        self._chunks = []
+        self._finished = False
+        self._error = None
+        # whether a subscriber is reading the next chunk from the upstream right now
+        self._reading = False
+        self._cond = threading.Condition()
+        # subscribers handed out by `SingleFlight.stream` that haven't started reading yet count too
+        self._subscribers = 0
+        self.cancelled = False
+
+    def join(self):
+        with self._cond:
+            self._subscribers += 1
+
+    def _read(self):
+        """Read the next chunk into the buffer; only the subscriber that set `_reading` calls this."""
+        error = None
+        try:
+            chunk = next(self._iterator)
+            done = False
+        except StopIteration:
+            done = True
+        except Exception as e:
+            done, error = True, e
+        with self._cond:
+            if done:
+                self._finished = True
+                self._error = error
+            else:
+                self._chunks.append(chunk)
+            self._reading = False
+            self._cond.notify_all()
+        if done:
+            # new callers from now on start a fresh upstream request
+            self._on_finish(self)
+
+    def subscribe(self, copy_chunks: bool = False):
+        """Yield every chunk from the first; call `join` first."""
+        index = 0
+        try:
+            while True:
+                with self._cond:
+                    while index >= len(self._chunks) and not self._finished and self._reading:
+                        self._cond.wait()
+                    batch = self._chunks[index:]
+                    if not batch:
+                        if self._finished:
+                            if self._error is not None:
+                                raise self._error
+                            return
+                        self._reading = True
+                if not batch:
+                    self._read()
+                    continue
+                index += len(batch)
+                for chunk in batch:
+                    yield copy.deepcopy(chunk) if copy_chunks else chunk
+        finally:
+            with self._cond:
+                self._subscribers -= 1
+                # everyone stopped reading; don't keep the upstream request open
+                cancel = not self._subscribers and not self._finished
+                if cancel:
+                    self.cancelled = True
+                    self._finished = True
+            if cancel:
+                if hasattr(self._upstream, "close"):
+                    self._upstream.close()
+                self._on_finish(self)
+
+class _AsyncCall:
+    __slots__ = ("task", "waiters")
+
+    def __init__(self, task):
+        self.task = task
+        self.waiters = 0
+
+class _AsyncSharedStream:
+    """
+    Event-loop counterpart of `_SharedStream`. Each read from the upstream
+    runs in a task of its own that subscribers wait on, so a cancelled
+    subscriber doesn't cancel the read the others are waiting for.
+    """
+
+    def __init__(self, upstream, on_finish):
+        self._upstream = upstream
+        self._iterator = upstream.__aiter__()
+        self._on_finish = on_finish
+        self._chunks = []
+        self._finished = False
+        self._error = None
+        self._read_task = None
+        self._close_task = None
+        self._subscribers = 0
+        self.cancelled = False
+
+    def join(self):
+        self._subscribers += 1
+
+    async def _read(self):
+        try:
+            self._chunks.append(await self._iterator.__anext__())
+        except StopAsyncIteration:
+            self._finish()
+        except Exception as e:
+            self._error = e
+            self._finish()
+
+    def _finish(self):
+        if not self._finished:
+            self._finished = True
+            # new callers from now on start a fresh upstream request
+            self._on_finish(self)
+
+    async def _close(self):
+        if self._read_task is not None and not self._read_task.done():
+            self._read_task.cancel()
+            await asyncio.gather(self._read_task, return_exceptions=True)
+        if hasattr(self._upstream, "aclose"):
+            await self._upstream.aclose()
+
+    async def subscribe(self, copy_chunks: bool = False):
+        """Yield every chunk from the first; call `join` first."""
+        index = 0
+        try:
+            while True:
+                if index < len(self._chunks):
+                    chunk = self._chunks[index]
+                    index += 1
+                    yield copy.deepcopy(chunk) if copy_chunks else chunk
+                elif self._finished:
+                    if self._error is not None:
+                        raise self._error
+                    return
+                else:
+                    if self._read_task is None or self._read_task.done():
+                        self._read_task = asyncio.ensure_future(self._read())
+                    await asyncio.shield(self._read_task)
+        finally:
+            self._subscribers -= 1
+            if not self._subscribers and not self._finished:
+                # everyone went away; stop the upstream request
+                self.cancelled = True
+                self._finish()
+                self._close_task = asyncio.ensure_future(self._close())
+
+class SingleFlight:
+    """Coalesces concurrent calls and streams that share a key into a single upstream call."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self._streams = {}
+        self._tasks = {}
+        self._async_streams = {}
+        self.leaders = 0
+        self.coalesced = 0
+
+    def _count(self, leader: bool):
+        if leader:
+            self.leaders += 1
+        else:
+            self.coalesced += 1
+
+    def do(self, key, fn):
+        """Call `fn()` unless a call with the same key is in flight, in which case wait for its result."""
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+            self._count(leader)
+
+        if leader:
+            try:
+                call.result = fn()
+            except Exception as e:
+                call.error = e
+            finally:
+                with self._lock:
+                    del self._calls[key]
+                call.done.set()
+        else:
+            call.done.wait()
+
+        if call.error is not None:
+            raise call.error
+        # followers get their own copy so nobody mutates the leader's result
+        return call.result if leader else copy.deepcopy(call.result)
+
+    def stream(self, key, factory):
+        """Subscribe to the in-flight stream for `key`, starting `factory()` if there is none."""
+        with self._lock:
+            shared = self._streams.get(key)
+            leader = shared is None or shared.cancelled
+            if leader:
+                shared = self._streams[key] = _SharedStream(
+                    factory(), lambda shared: self._forget(self._streams, key, shared)
+                )
+            shared.join()
+            self._count(leader)
+        return shared.subscribe(copy_chunks=not leader)
+
+    async def do_async(self, key, fn):
+        """Async version of `do`; `fn` is a coroutine function, cancelled once every caller is cancelled."""
+        task_key = (asyncio.get_running_loop(), key)
+        with self._lock:
+            call = self._tasks.get(task_key)
+            leader = call is None
+            if leader:
+                call = self._tasks[task_key] = _AsyncCall(asyncio.ensure_future(fn()))
+                call.task.add_done_callback(lambda _: self._forget(self._tasks, task_key, call))
+            call.waiters += 1
+            self._count(leader)
+        try:
+            # shielded, so a cancelled caller doesn't cancel the call the others are waiting on
+            result = await asyncio.shield(call.task)
+        finally:
+            call.waiters -= 1
+            if not call.waiters and not call.task.done():
+                call.task.cancel()
+        return result if leader else copy.deepcopy(result)
+
+    def astream(self, key, factory):
+        """Async version of `stream`; `factory()` returns an async iterator."""
+        stream_key = (asyncio.get_running_loop(), key)
+        with self._lock:
+            shared = self._async_streams.get(stream_key)
+            leader = shared is None or shared.cancelled
+            if leader:
+                shared = self._async_streams[stream_key] = _AsyncSharedStream(
+                    factory(), lambda shared: self._forget(self._async_streams, stream_key, shared)
+                )
+            shared.join()
+            self._count(leader)
+        return shared.subscribe(copy_chunks=not leader)
+
+    def _forget(self, registry, key, value):
+        with self._lock:
+            if registry.get(key) is value:
+                del registry[key]
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "leaders": self.leaders,
+                "coalesced": self.coalesced,
+                "in_flight": len(self._calls) + len(self._streams) + len(self._tasks) + len(self._async_streams),
+            }
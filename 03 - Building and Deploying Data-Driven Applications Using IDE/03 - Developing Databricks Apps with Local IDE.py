@@ -163,12 +163,14 @@ DA.display_credentials()
 # MAGIC work/
 # MAGIC ├── app/
 # MAGIC │   ├── app.py
+# MAGIC │   ├── sql_utils.py
 # MAGIC │   └── app.yaml
 # MAGIC └── app.json
 # MAGIC ```
 # MAGIC Where:
 # MAGIC - *app/* is a project folder containing the files needed to run and deploy the app
 # MAGIC - *app.py* contains the app source
+# MAGIC - *sql_utils.py* is a helper module for the app that reads and caches query results
 # MAGIC - *app.yaml* contains metadata that describes how to deploy the app
 # MAGIC - *app.json*, outside the project folder, will be used as input to the Databricks CLI when creating the Databricks App
 
@@ -182,7 +184,7 @@ DA.display_credentials()
 # MAGIC 1. Notice the **New File** and **New Folder** buttons that appear in the **Explorer** view when it is selected. If a folder is already selected, these also allow you to nest new folders and files. Without any existing folders selected, click the **New File** button to create a new file named *app.json*.<br>
 # MAGIC    ![](../images/03 - Building and Deploying Data-Driven Applications Using IDE/create_files_folders.png)
 # MAGIC 1. Use the **New Folder** button to create a new folder named *app*.
-# MAGIC 1. With the new folder selected, create new files for the app source and metadata: *app.py* and *app.yaml*.
+# MAGIC 1. With the new folder selected, create new files for the app source and metadata: *app.py*, *sql_utils.py* and *app.yaml*.
 
 # COMMAND ----------
 
@@ -196,11 +198,13 @@ DA.display_credentials()
 # MAGIC %md
 # MAGIC #### App Source Code
 # MAGIC
-# MAGIC Let's populate *app.py*. This simple example will be implemented in this single source file, although more complicated projects will likely span multiple files and potentially even be divided into folders and modules.
+# MAGIC Let's populate *app.py*. This simple example is implemented in *app.py* and a small helper module, *sql_utils.py*, that reads and caches query results; more complicated projects will likely span many more files and potentially even be divided into folders and packages.
 # MAGIC
 # MAGIC The source code implements the same data-driven application that we covered in [Build a Data-Driven App demo]($../02 - Building and Deploying Data-Driven Applications/02 - Build a Data-Driven App), so please refer to that demo for a more thorough explanation of the source.
 # MAGIC
 # MAGIC Follow this link to [app.py]($./app_code/app.py) (opens in a new tab). Copy the contents and paste them into the *app.py* file in your IDE project.
+# MAGIC
+# MAGIC Then follow this link to [sql_utils.py]($./app_code/sql_utils.py) (opens in a new tab), and copy its contents into the *sql_utils.py* file in your IDE project.
 
 # COMMAND ----------
 
@@ -1,14 +1,22 @@
-from databricks.sdk import WorkspaceClient
-from databricks.sdk.service.sql import StatementState
 import gradio as gr
 import logging
+from admission_control import AdmissionRejected, forwarded_user
+from client_registry import WorkspaceClientHolder
 from model_serving_utils import (
+    admit_request,
+    endpoint_router,
     endpoint_supports_feedback, 
+    start_warm_up,
     query_endpoint, 
     query_endpoint_stream, 
+    query_endpoint_text_stream,
     _get_endpoint_task_type,
 )
+from stream_coalescing import coalesce_deltas
+import asyncio
+import math
 import os
+import time
 import pandas as pd
 
 # Set up logging
@@ -24,32 +32,79 @@ assert SERVING_ENDPOINT,\
      "'serving_endpoint' with CAN_QUERY permissions, as described in "
      "https://docs.databricks.com/aws/en/generative-ai/agent-framework/chat-app#deploy-the-databricks-app")
 
-ENDPOINT_SUPPORTS_FEEDBACK = endpoint_supports_feedback(SERVING_ENDPOINT)
+# Look up the endpoint in the background, so the app starts serving right away
+start_warm_up(SERVING_ENDPOINT)
+
+# Optional comma-separated endpoints (name or name:weight) to route to and fail over to
+# when the main endpoint is slow or failing
+ENDPOINT = endpoint_router(SERVING_ENDPOINT, os.getenv('FALLBACK_SERVING_ENDPOINTS'))
+
+# Stream the answer token by token; set STREAM_RESPONSES to "false" to wait for the full response
+STREAM_RESPONSES = os.getenv('STREAM_RESPONSES', 'true').lower() == 'true'
+# Tokens streamed within this many seconds are sent to the browser as one update; 0 sends every token
+STREAM_UPDATE_INTERVAL_SECONDS = float(os.getenv('STREAM_UPDATE_INTERVAL_SECONDS', '0.05'))
 
 # ensure environment variable is set correctly
 assert os.getenv('DATABRICKS_WAREHOUSE_ID'), "DATABRICKS_WAREHOUSE_ID must be set in app.yaml."
 
-# general function to run SQL queries on a warehouse specified by DATABRICKS_WAREHOUSE_ID
-def sql_query(query: str, request: gr.Request):
+# JSON_ARRAY returns every value as a string inline. ARROW_STREAM fetches results as typed Arrow columns
+# from presigned cloud storage links (see sql_utils.py), which the workspace's network policy must allow
+SQL_RESULT_FORMAT = os.getenv('SQL_RESULT_FORMAT', 'JSON_ARRAY').upper()
+# Queries still running after this many seconds are cancelled on the warehouse
+SQL_QUERY_TIMEOUT_SECONDS = float(os.getenv('SQL_QUERY_TIMEOUT_SECONDS', '300'))
 
-    # initialize a connection to the workspace using app service principal credentials
-    # (assumes DATABRICKS_CLIENT_ID, DATABRICKS_CLIENT_SECRET and DATABRICKS_HOST are set)
-    wclient = WorkspaceClient(auth_type='oauth-m2m')
+# one connection to the workspace for every query, using app service principal credentials
+# (assumes DATABRICKS_CLIENT_ID, DATABRICKS_CLIENT_SECRET and DATABRICKS_HOST are set)
+sql_client = WorkspaceClientHolder(auth_type='oauth-m2m')
 
-    logger.info(f"processing query {query} as {wclient.current_user.me().display_name}")
+# queries in flight per Gradio session, cancelled when the user closes the tab
+session_queries = {}
 
-    response = wclient.statement_execution.execute_statement(
-        statement=query,
-        warehouse_id=os.getenv('DATABRICKS_WAREHOUSE_ID'),
-        wait_timeout='50s'
-    )
+async def cancel_session_queries(request: gr.Request):
+    for task in session_queries.pop(request.session_hash, set()):
+        task.cancel()
 
-    if response.status.state != StatementState.SUCCEEDED:
+# general function to run SQL queries on a warehouse specified by DATABRICKS_WAREHOUSE_ID
+# the statement is polled from the event loop (see sql_utils.py), so a slow query doesn't hold a worker thread
+async def sql_query(query: str, request: gr.Request, timeout_seconds: float = SQL_QUERY_TIMEOUT_SECONDS):
+    # imported on first use, to keep the app's startup fast
+    from sql_utils import StatementFailed, aexecute_arrow_dataframe, aexecute_statement
+
+    # only the first query builds the client and looks up the service principal
+    wclient = await asyncio.to_thread(sql_client.client)
+    identity = await asyncio.to_thread(sql_client.identity)
+    logger.info(f"processing query {query} as {identity.display_name}")
+
+    if SQL_RESULT_FORMAT == 'ARROW_STREAM':
+        execution = aexecute_arrow_dataframe(wclient, query, os.getenv('DATABRICKS_WAREHOUSE_ID'), timeout_seconds)
+    else:
+        execution = aexecute_statement(wclient, query, os.getenv('DATABRICKS_WAREHOUSE_ID'), timeout_seconds)
+    task = asyncio.ensure_future(execution)
+    session_queries.setdefault(request.session_hash, set()).add(task)
+    try:
+        result = await task
+    except StatementFailed as e:
         # raise Gradio error if query did not succeed
-        error_string = ' '. join(response.status.error.message.splitlines())
-        logger.error(f"query failed: {error_string}")
-        raise gr.Error(error_string, duration=10)
+        logger.error(f"query failed: {e}")
+        raise gr.Error(str(e), duration=10)
+    except asyncio.CancelledError:
+        if asyncio.current_task().cancelling():
+            raise
+        # only the query was cancelled, by cancel_session_queries
+        logger.info(f"query cancelled, session {request.session_hash} ended")
+        raise gr.Error("The query was cancelled.", duration=10)
+    finally:
+        queries = session_queries.get(request.session_hash)
+        if queries is not None:
+            queries.discard(task)
+            if not queries:
+                del session_queries[request.session_hash]
+
+    if SQL_RESULT_FORMAT == 'ARROW_STREAM':
+        logger.info(f"query returned {len(result)} records")
+        return result
     else:
+        response = result
         logger.info(f"query returned {response.result.row_count} records")
 
         if response.result.row_count > 0:
@@ -60,9 +115,9 @@ def sql_query(query: str, request: gr.Request):
 
         return pd.DataFrame()
 
-def fetch_sales_data(request: gr.Request):
+async def fetch_sales_data(request: gr.Request):
 
-    return sql_query(
+    return await sql_query(
         """
         SELECT country as `Country`,sum(quantity) AS `Total Sales`
           FROM cookies.sales.transactions t
@@ -74,44 +129,82 @@ def fetch_sales_data(request: gr.Request):
         request
     )
     
-def query_llm(message, history):
+def query_llm(message, history, request: gr.Request):
     """
     Query the LLM with the given message and chat history.
     `message`: str - the latest user input.
     `history`: list of dicts - OpenAI-style messages.
+    `request`: the Gradio request, whose session identifies the conversation.
     """
     if not message.strip():
-        return "ERROR: The question should not be empty"
+        yield "ERROR: The question should not be empty"
+        return
 
     # Convert from Gradio-style history to OpenAI-style messages
     message_history = []
-    for user_msg, assistant_msg in history:
-        message_history.append({"role": "user", "content": user_msg})
-        message_history.append({"role": "assistant", "content": assistant_msg})
+    for turn in history:
+        if isinstance(turn, dict):
+            # type="messages" chat interfaces pass OpenAI-style messages already
+            message_history.append({"role": turn["role"], "content": turn["content"]})
+        else:
+            user_msg, assistant_msg = turn
+            message_history.append({"role": "user", "content": user_msg})
+            message_history.append({"role": "assistant", "content": assistant_msg})
 
     # Add the latest user message
     message_history.append({"role": "user", "content": message})
 
+    # requests are limited per user, as forwarded by the Databricks Apps proxy
+    user = forwarded_user(getattr(request, 'headers', None), default=request.session_hash)
     try:
-        logger.info(f"Sending request to model endpoint: {SERVING_ENDPOINT}")
-        messages, request_id = query_endpoint(
-            endpoint_name=SERVING_ENDPOINT,
-            messages=message_history,
-            return_traces=ENDPOINT_SUPPORTS_FEEDBACK
-        )
-        return messages[-1]
+        with admit_request(user):
+            # cached after the first lookup
+            return_traces = endpoint_supports_feedback(SERVING_ENDPOINT)
+            logger.info(f"Sending request to model endpoint: {ENDPOINT}")
+            if not STREAM_RESPONSES:
+                messages, request_id = query_endpoint(
+                    endpoint_name=ENDPOINT,
+                    messages=message_history,
+                    return_traces=return_traces,
+                    session_id=request.session_hash
+                )
+                yield messages[-1]
+                return
+
+            start_time = time.perf_counter()
+            response = ""
+            for text in coalesce_deltas(query_endpoint_text_stream(
+                endpoint_name=ENDPOINT,
+                messages=message_history,
+                return_traces=return_traces,
+                session_id=request.session_hash
+            ), STREAM_UPDATE_INTERVAL_SECONDS):
+                if not text:
+                    continue
+                if not response:
+                    logger.info(f"Time to first token: {time.perf_counter() - start_time:.3f}s")
+                response += text
+                yield response
+            logger.info(f"Response streamed in {time.perf_counter() - start_time:.3f}s")
+    except AdmissionRejected as e:
+        logger.warning(f"Request from {user} not admitted: {e}")
+        if math.isfinite(e.retry_after):
+            yield f"The assistant is busy, please try again in {int(e.retry_after) + 1} seconds."
+        else:
+            # a user rate of 0 never refills
+            yield "The assistant is busy, please try again later."
     except Exception as e:
         logger.error(f"Error querying model: {str(e)}", exc_info=True)
-        return f"Error: {str(e)}"
+        yield f"Error: {str(e)}"
 
 with gr.Blocks(
     title="BrixoCookies - Marketing Agent Dashboard",
     fill_height=True
 ) as demo:
 
-    def refresh_all_data(request: gr.Request):
+    async def refresh_all_data(request: gr.Request):
         try:
-            return (fetch_sales_data(request))
+            return (await fetch_sales_data(request))
         except Exception as e:
             logger.error(f"Error in refresh_all_data: {e}")
             return (pd.DataFrame())
@@ -148,6 +241,8 @@ with gr.Blocks(
             sales_data
         ]
     )
+    # stop the warehouse working on queries of a closed tab
+    demo.unload(cancel_session_queries)
 
 if __name__ == "__main__":
     demo.launch()
\ No newline at end of file
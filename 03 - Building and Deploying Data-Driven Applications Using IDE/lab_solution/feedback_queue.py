@@ -0,0 +1,148 @@
+"""
+Background, batched submission of agent feedback.
+
+Ratings are buffered in memory and a daemon thread posts them in batches, one
+request per endpoint per batch. A batch is sent once it reaches
+`max_batch_size` records or its oldest record has waited `flush_interval_seconds`.
+Failed sends are retried with exponential backoff, and the queue is drained
+when the process exits.
+"""
+import atexit
+import logging
+import random
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+class FeedbackQueue:
+    """Buffers feedback records and sends them in batches through `send_batch(endpoint, records)`."""
+
+    def __init__(
+        self,
+        send_batch,
+        max_batch_size: int = 50,
+        flush_interval_seconds: float = 2.0,
+        max_retries: int = 5,
+        backoff_seconds: float = 0.5,
+        max_backoff_seconds: float = 30.0,
+        max_queue_size: int = 10000,
+    ):
+        self._send_batch = send_batch
+        self.max_batch_size = max_batch_size
+        self.flush_interval_seconds = flush_interval_seconds
+        self.max_retries = max_retries
+        self.backoff_seconds = backoff_seconds
+        self.max_backoff_seconds = max_backoff_seconds
+        self.max_queue_size = max_queue_size
+        self._cond = threading.Condition()
+        # (enqueued_at, endpoint, record), oldest first
+        self._pending = []
+        self._in_flight = 0
+        self._flush_requested = False
+        self._closed = False
+        self._thread = None
+        self.sent = 0
+        self.failed = 0
+        self.dropped = 0
+        self.batches = 0
+
+    def submit(self, endpoint: str, record: dict) -> bool:
+        """Queue a record without blocking. Returns False if the queue is full and the record was dropped."""
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("The feedback queue has been closed")
+            if len(self._pending) >= self.max_queue_size:
+                self.dropped += 1
+                logger.warning(f"Feedback queue is full, dropping feedback for endpoint {endpoint}")
+                return False
+            self._pending.append((time.monotonic(), endpoint, record))
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="feedback-queue", daemon=True)
+                self._thread.start()
+                atexit.register(self.close)
+            if len(self._pending) >= self.max_batch_size:
+                self._cond.notify_all()
+        return True
+
+    def flush(self, timeout: float = None) -> bool:
+        """Send everything queued so far; returns False if that didn't finish within `timeout`."""
+        with self._cond:
+            self._flush_requested = True
+            self._cond.notify_all()
+            return self._cond.wait_for(lambda: not self._pending and not self._in_flight, timeout)
+
+    def close(self, timeout: float = 10.0):
+        """Stop accepting records and drain the queue."""
+        with self._cond:
+            if self._closed:
+                return
+            self._closed = True
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            if self._thread.is_alive():
+                logger.warning(f"Feedback queue did not drain within {timeout}s, {len(self._pending)} records lost")
+
+    def _batch_due(self):
+        if not self._pending:
+            return False
+        if self._closed or self._flush_requested or len(self._pending) >= self.max_batch_size:
+            return True
+        return time.monotonic() - self._pending[0][0] >= self.flush_interval_seconds
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._batch_due():
+                    if self._closed:
+                        return
+                    if self._flush_requested and not self._in_flight:
+                        self._flush_requested = False
+                        self._cond.notify_all()
+                    wait = None
+                    if self._pending:
+                        wait = self._pending[0][0] + self.flush_interval_seconds - time.monotonic()
+                    self._cond.wait(wait)
+                batch = self._pending[:self.max_batch_size]
+                del self._pending[:self.max_batch_size]
+                self._in_flight += len(batch)
+
+            by_endpoint = {}
+            for _, endpoint, record in batch:
+                by_endpoint.setdefault(endpoint, []).append(record)
+            for endpoint, records in by_endpoint.items():
+                self._send_with_retry(endpoint, records)
+
+            with self._cond:
+                self._in_flight -= len(batch)
+                self._cond.notify_all()
+
+    def _send_with_retry(self, endpoint, records):
+        for attempt in range(self.max_retries + 1):
+            try:
+                self._send_batch(endpoint, records)
+                with self._cond:
+                    self.sent += len(records)
+                    self.batches += 1
+                return
+            except Exception as e:
+                if attempt == self.max_retries:
+                    with self._cond:
+                        self.failed += len(records)
+                    logger.error(f"Giving up on {len(records)} feedback records for endpoint {endpoint}: {e}")
+                    return
+                delay = min(self.max_backoff_seconds, self.backoff_seconds * 2 ** attempt)
+                delay *= random.uniform(0.5, 1.0)
+                logger.warning(f"Sending feedback to endpoint {endpoint} failed ({e}), retrying in {delay:.1f}s")
+                time.sleep(delay)
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {
+                "pending": len(self._pending) + self._in_flight,
+                "sent": self.sent,
+                "failed": self.failed,
+                "dropped": self.dropped,
+                "batches": self.batches,
+            }
@@ -0,0 +1,231 @@
+"""
+In-process metrics for the hot path of endpoint calls.
+
+Histograms use fixed, exponentially spaced buckets, so recording a value is a
+binary search and an increment, and memory doesn't grow with traffic.
+Quantiles (p50/p95/p99) are interpolated from the buckets. Metrics are read
+out through exporters: `PrometheusExporter` renders the Prometheus text format
+and `JsonLinesExporter` appends one JSON line per metric series.
+"""
+from bisect import bisect_left
+import json
+import logging
+import math
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+def exponential_buckets(start: float, factor: float, count: int) -> tuple:
+    return tuple(start * factor ** i for i in range(count))
+
+# 1ms to ~10min, 4 buckets per doubling
+LATENCY_BUCKETS = exponential_buckets(0.001, 2 ** 0.25, 78)
+# 1 to ~16k chunks
+COUNT_BUCKETS = exponential_buckets(1, 2 ** 0.5, 29)
+# 64B to ~64MiB
+SIZE_BUCKETS = exponential_buckets(64, 2 ** 0.5, 41)
+
+class Histogram:
+    """Counts of observations per bucket, plus their count, sum, min and max."""
+
+    def __init__(self, buckets):
+        self.buckets = tuple(buckets)
+        # the last count is the +Inf bucket
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+
+    def quantile(self, q: float) -> float:
+        """Estimate the `q` quantile by interpolating linearly inside its bucket."""
+        if not self.count:
+            return math.nan
+        rank = q * self.count
+        cumulative = 0
+        for index, bucket_count in enumerate(self.counts):
+            if cumulative + bucket_count >= rank and bucket_count:
+                lower = self.buckets[index - 1] if index > 0 else self.min
+                upper = self.buckets[index] if index < len(self.buckets) else self.max
+                lower, upper = max(lower, self.min), min(upper, self.max)
+                return lower + (upper - lower) * (rank - cumulative) / bucket_count
+            cumulative += bucket_count
+        return self.max
+
+    def summary(self) -> dict:
+        return {
+            "count": self.count,
+            "sum": self.sum,
+            "min": self.min if self.count else None,
+            "max": self.max if self.count else None,
+            "p50": self.quantile(0.5) if self.count else None,
+            "p95": self.quantile(0.95) if self.count else None,
+            "p99": self.quantile(0.99) if self.count else None,
+        }
+
+class MetricsRegistry:
+    """Thread-safe collection of labelled histograms and counters."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # name -> (help text, buckets)
+        self._histogram_types = {}
+        # (name, sorted label items) -> Histogram / count
+        self._histograms = {}
+        self._counters = {}
+        self._exporters = []
+        self._export_thread = None
+
+    def define_histogram(self, name: str, help_text: str, buckets=LATENCY_BUCKETS):
+        self._histogram_types[name] = (help_text, tuple(buckets))
+
+    def observe(self, name: str, value: float, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                buckets = self._histogram_types.get(name, ("", LATENCY_BUCKETS))[1]
+                histogram = self._histograms[key] = Histogram(buckets)
+            histogram.observe(value)
+
+    def increment(self, name: str, amount: float = 1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def histogram(self, name: str, **labels):
+        """Copy of one histogram series, or None if nothing was recorded for it."""
+        with self._lock:
+            histogram = self._histograms.get((name, tuple(sorted(labels.items()))))
+            return self._copy(histogram) if histogram is not None else None
+
+    def collect(self):
+        """Consistent copies of every histogram and counter, keyed by (name, label items)."""
+        with self._lock:
+            histograms = {key: self._copy(histogram) for key, histogram in self._histograms.items()}
+            return histograms, dict(self._counters)
+
+    def help_text(self, name: str) -> str:
+        return self._histogram_types.get(name, ("", None))[0]
+
+    @staticmethod
+    def _copy(histogram):
+        copy = Histogram(histogram.buckets)
+        copy.counts = list(histogram.counts)
+        copy.count, copy.sum, copy.min, copy.max = histogram.count, histogram.sum, histogram.min, histogram.max
+        return copy
+
+    def reset(self):
+        with self._lock:
+            self._histograms.clear()
+            self._counters.clear()
+
+    def add_exporter(self, exporter):
+        """Register an object with an `export(registry)` method, called by `export()`."""
+        self._exporters.append(exporter)
+
+    def export(self):
+        for exporter in list(self._exporters):
+            try:
+                exporter.export(self)
+            except Exception as e:
+                logger.warning(f"Exporting metrics with {type(exporter).__name__} failed: {e}")
+
+    def start_periodic_export(self, interval_seconds: float):
+        """Call `export()` every `interval_seconds` from a daemon thread."""
+        if self._export_thread is not None:
+            return
+
+        def run():
+            while True:
+                time.sleep(interval_seconds)
+                self.export()
+
+        self._export_thread = threading.Thread(target=run, name="metrics-export", daemon=True)
+        self._export_thread.start()
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _format_labels(labels) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in labels) + "}"
+
+class PrometheusExporter:
+    """
+    Renders the Prometheus text exposition format; use `histogram_quantile`
+    on the `_bucket` series for p50/p95/p99. If `path` is given, `export`
+    writes the text there, e.g. for the node exporter's textfile collector.
+    """
+
+    def __init__(self, path: str = None):
+        self.path = path
+
+    def render(self, registry: MetricsRegistry) -> str:
+        histograms, counters = registry.collect()
+        lines = []
+        for name in sorted({name for name, _ in histograms}):
+            help_text = registry.help_text(name)
+            if help_text:
+                lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} histogram")
+            for (series_name, labels), histogram in sorted(histograms.items()):
+                if series_name != name:
+                    continue
+                cumulative = 0
+                for bound, bucket_count in zip(histogram.buckets, histogram.counts):
+                    cumulative += bucket_count
+                    lines.append(f"{name}_bucket{_format_labels(labels + (('le', f'{bound:.6g}'),))} {cumulative}")
+                lines.append(f"{name}_bucket{_format_labels(labels + (('le', '+Inf'),))} {histogram.count}")
+                lines.append(f"{name}_sum{_format_labels(labels)} {histogram.sum:.6g}")
+                lines.append(f"{name}_count{_format_labels(labels)} {histogram.count}")
+        for name in sorted({name for name, _ in counters}):
+            lines.append(f"# TYPE {name} counter")
+            for (series_name, labels), value in sorted(counters.items()):
+                if series_name == name:
+                    lines.append(f"{name}{_format_labels(labels)} {value:g}")
+        return "\n".join(lines) + "\n"
+
+    def export(self, registry: MetricsRegistry):
+        text = self.render(registry)
+        if self.path:
+            # write and rename, so scrapers never read a half-written file
+            with open(f"{self.path}.tmp", "w") as f:
+                f.write(text)
+            os.replace(f"{self.path}.tmp", self.path)
+        return text
+
+class JsonLinesExporter:
+    """Appends one JSON line per metric series, with its count, sum and p50/p95/p99, to `path`."""
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def lines(self, registry: MetricsRegistry) -> list:
+        histograms, counters = registry.collect()
+        timestamp = time.time()
+        lines = []
+        for (name, labels), histogram in sorted(histograms.items()):
+            record = {"timestamp": timestamp, "metric": name, "type": "histogram", "labels": dict(labels)}
+            record.update(histogram.summary())
+            lines.append(json.dumps(record))
+        for (name, labels), value in sorted(counters.items()):
+            lines.append(json.dumps({
+                "timestamp": timestamp, "metric": name, "type": "counter", "labels": dict(labels), "value": value,
+            }))
+        return lines
+
+    def export(self, registry: MetricsRegistry):
+        lines = self.lines(registry)
+        with open(self.path, "a") as f:
+            f.writelines(line + "\n" for line in lines)
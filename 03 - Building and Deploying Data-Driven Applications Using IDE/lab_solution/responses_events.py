@@ -0,0 +1,169 @@
+"""
+Incremental parsing of ResponsesAgent (agent/v1/responses) output.
+
+`ResponsesStreamAssembler` turns the raw events streamed by an endpoint into
+typed `StreamEvent`s while keeping enough running state to produce the final
+chat messages when the stream ends. Text and argument deltas are buffered as
+lists of fragments and joined once per item, so long answers aren't copied on
+every delta. Non-streaming responses are fed through the same assembler.
+"""
+from typing import NamedTuple, Optional
+
+# Kinds of typed events
+TEXT_DELTA = "text_delta"
+FUNCTION_CALL_START = "function_call_start"
+FUNCTION_CALL_ARGUMENTS_DELTA = "function_call_arguments_delta"
+FUNCTION_CALL_END = "function_call_end"
+FUNCTION_CALL_OUTPUT = "function_call_output"
+DONE = "done"
+
+class StreamEvent(NamedTuple):
+    """A typed event of a ResponsesAgent stream."""
+    kind: str
+    item_id: Optional[str] = None
+    call_id: Optional[str] = None
+    name: Optional[str] = None
+    delta: str = ""
+    # the completed output item, for FUNCTION_CALL_END and FUNCTION_CALL_OUTPUT
+    item: Optional[dict] = None
+
+def _output_text(item):
+    return "".join(
+        part.get("text", "") for part in item.get("content", []) if part.get("type") == "output_text"
+    )
+
+class ResponsesStreamAssembler:
+    """Running state of one ResponsesAgent response."""
+
+    def __init__(self):
+        self.result_messages = []
+        self.request_id = None
+        self._text_parts = {}
+        self._argument_parts = {}
+        self._started_calls = set()
+        self._done = False
+
+    def feed(self, event_data: dict) -> list:
+        """Consume one raw stream event and return the typed events it produces."""
+        if "databricks_output" in event_data:
+            self.request_id = event_data["databricks_output"].get("databricks_request_id", self.request_id)
+
+        event_type = event_data.get("type")
+        if event_type == "response.output_text.delta":
+            item_id = event_data.get("item_id")
+            delta = event_data.get("delta", "")
+            self._text_parts.setdefault(item_id, []).append(delta)
+            return [StreamEvent(TEXT_DELTA, item_id=item_id, delta=delta)]
+        elif event_type == "response.output_item.added":
+            item = event_data.get("item", {})
+            if item.get("type") == "function_call":
+                return self._start_call(item)
+        elif event_type == "response.function_call_arguments.delta":
+            item_id = event_data.get("item_id")
+            delta = event_data.get("delta", "")
+            self._argument_parts.setdefault(item_id, []).append(delta)
+            return [StreamEvent(FUNCTION_CALL_ARGUMENTS_DELTA, item_id=item_id, delta=delta)]
+        elif event_type == "response.output_item.done":
+            return self._complete_item(event_data.get("item", {}))
+        elif event_type in ("response.completed", "response.done"):
+            return self.finish()
+        return []
+
+    def feed_response(self, response: dict) -> list:
+        """Consume a complete, non-streamed response."""
+        self.request_id = response.get("databricks_output", {}).get("databricks_request_id")
+        events = []
+        for item in response.get("output", []):
+            events.extend(self._complete_item(item))
+        events.extend(self.finish())
+        return events
+
+    def finish(self) -> list:
+        """Mark the response as complete; returns the DONE event the first time it's called."""
+        if self._done:
+            return []
+        self._done = True
+        # text of messages whose output_item.done event never came
+        for parts in self._text_parts.values():
+            text_content = "".join(parts)
+            if text_content:
+                self.result_messages.append({
+                    "role": "assistant",
+                    "content": text_content
+                })
+        self._text_parts.clear()
+        return [StreamEvent(DONE)]
+
+    def result(self):
+        """Return the assembled chat messages and the request ID for feedback."""
+        return self.result_messages or [{"role": "assistant", "content": "No response found"}], self.request_id
+
+    def _start_call(self, item):
+        item_id = item.get("id")
+        if item_id in self._started_calls:
+            return []
+        self._started_calls.add(item_id)
+        return [StreamEvent(FUNCTION_CALL_START, item_id=item_id, call_id=item.get("call_id"), name=item.get("name"))]
+
+    def _complete_item(self, item):
+        item_type = item.get("type")
+        item_id = item.get("id")
+
+        if item_type == "message":
+            events = []
+            parts = self._text_parts.pop(item_id, None)
+            if parts is None:
+                # the agent didn't stream this message, surface its text as a single delta
+                text_content = _output_text(item)
+                if text_content:
+                    events.append(StreamEvent(TEXT_DELTA, item_id=item_id, delta=text_content))
+            else:
+                text_content = "".join(parts)
+            if text_content:
+                self.result_messages.append({
+                    "role": "assistant",
+                    "content": text_content
+                })
+            return events
+
+        elif item_type == "function_call":
+            events = self._start_call(item)
+            parts = self._argument_parts.pop(item_id, None)
+            arguments = item.get("arguments")
+            if arguments is None:
+                arguments = "".join(parts) if parts else ""
+            elif parts is None and arguments:
+                events.append(StreamEvent(FUNCTION_CALL_ARGUMENTS_DELTA, item_id=item_id, delta=arguments))
+            self.result_messages.append({
+                "role": "assistant",
+                "content": "",
+                "tool_calls": [{
+                    "id": item.get("call_id"),
+                    "type": "function",
+                    "function": {
+                        "name": item.get("name"),
+                        "arguments": arguments
+                    }
+                }]
+            })
+            events.append(StreamEvent(
+                FUNCTION_CALL_END, item_id=item_id, call_id=item.get("call_id"), name=item.get("name"), item=item
+            ))
+            return events
+
+        elif item_type == "function_call_output":
+            self.result_messages.append({
+                "role": "tool",
+                "content": item.get("output", ""),
+                "tool_call_id": item.get("call_id")
+            })
+            return [StreamEvent(FUNCTION_CALL_OUTPUT, call_id=item.get("call_id"), item=item)]
+
+        return []
+
+def iter_responses_events(raw_events, assembler: Optional[ResponsesStreamAssembler] = None):
+    """Yield the typed events of a raw ResponsesAgent stream, ending with DONE."""
+    assembler = assembler or ResponsesStreamAssembler()
+    for event_data in raw_events:
+        yield from assembler.feed(event_data)
+    yield from assembler.finish()
@@ -0,0 +1,253 @@
+"""
+Columnar results for warehouse queries.
+
+With the default JSON_ARRAY format the statement execution API returns every
+value as a string inside nested JSON arrays, so a DataFrame built from it holds
+Python objects of type `object`. With `ARROW_STREAM` and `EXTERNAL_LINKS` the
+warehouse writes each result chunk as an Arrow IPC stream to cloud storage and
+returns presigned links to it. The chunks are downloaded in parallel and
+decoded into one Arrow table with the columns' SQL types, which `to_pandas`
+turns into typed NumPy columns without parsing any value.
+
+`read_arrow_stream` and `arrow_to_dataframe` work on any Arrow IPC stream, e.g.
+a file written locally with `pyarrow.ipc.new_stream`.
+
+`aexecute_statement` runs a statement without holding a thread while the
+warehouse works on it: the statement is submitted with a short wait, then
+polled from the asyncio loop with exponential backoff, so it can run for
+longer than the 50 seconds `execute_statement` can wait. If the caller's
+task is cancelled or its deadline passes, the statement is cancelled on the
+warehouse too.
+"""
+from concurrent.futures import ThreadPoolExecutor
+from typing import TYPE_CHECKING, Optional
+import asyncio
+import logging
+import os
+import threading
+import time
+
+import pyarrow as pa
+
+if TYPE_CHECKING:
+    import pandas as pd
+    from databricks.sdk import WorkspaceClient
+
+logger = logging.getLogger(__name__)
+
+# At most this many result chunks are downloaded from cloud storage at the same time
+ARROW_DOWNLOAD_WORKERS = int(os.getenv("ARROW_DOWNLOAD_WORKERS", "4"))
+
+# Seconds `execute_statement` waits for a result before returning a running statement to poll (0, or 5 to 50)
+SQL_SUBMIT_WAIT_SECONDS = int(os.getenv("SQL_SUBMIT_WAIT_SECONDS", "5"))
+# First and longest pause between two polls of a running statement
+SQL_POLL_INITIAL_SECONDS = float(os.getenv("SQL_POLL_INITIAL_SECONDS", "0.25"))
+SQL_POLL_MAX_SECONDS = float(os.getenv("SQL_POLL_MAX_SECONDS", "5"))
+
+_download_pool = ThreadPoolExecutor(max_workers=ARROW_DOWNLOAD_WORKERS, thread_name_prefix="arrow-download")
+_session = None
+# background cancellations of statements, referenced until they are done
+_cancelling = set()
+_session_lock = threading.Lock()
+
+class StatementFailed(Exception):
+    """A statement did not succeed; the message is the warehouse's error."""
+
+class StatementTimeout(StatementFailed):
+    """A statement was still running at the caller's deadline and was cancelled."""
+
+def _http_session():
+    """A pooled session without Databricks credentials; the presigned links must not get them."""
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                import requests
+                from requests.adapters import HTTPAdapter
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=ARROW_DOWNLOAD_WORKERS, pool_maxsize=ARROW_DOWNLOAD_WORKERS)
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                _session = session
+    return _session
+
+def read_arrow_stream(source) -> pa.Table:
+    """Decode an Arrow IPC stream from bytes, a file path or a binary file object."""
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        source = pa.BufferReader(source)
+    elif isinstance(source, (str, os.PathLike)):
+        source = pa.memory_map(os.fspath(source))
+    with pa.ipc.open_stream(source) as reader:
+        return reader.read_all()
+
+def arrow_to_dataframe(table: pa.Table) -> "pd.DataFrame":
+    """
+    Convert an Arrow table to pandas with NumPy dtypes. Columns without nulls
+    of fixed-width types are handed over without copying their values.
+    """
+    # one block per column, so pandas doesn't consolidate (copy) columns of the same dtype
+    return table.to_pandas(split_blocks=True, self_destruct=True)
+
+def _download_chunk(link) -> pa.Table:
+    response = _http_session().get(link.external_link, headers=link.http_headers or None, timeout=60)
+    response.raise_for_status()
+    return read_arrow_stream(response.content)
+
+def _chunk_links(wclient: "WorkspaceClient", response):
+    """The external links of every chunk of a succeeded statement, in chunk order."""
+    links = list(response.result.external_links or [])
+    next_index = links[-1].next_chunk_index if links else None
+    while next_index is not None:
+        chunk = wclient.statement_execution.get_statement_result_chunk_n(response.statement_id, next_index)
+        links.extend(chunk.external_links or [])
+        next_index = chunk.external_links[-1].next_chunk_index if chunk.external_links else None
+    return links
+
+# Arrow types of the SQL types in a result manifest; complex and other types are read as strings
+_ARROW_TYPES = {
+    "BOOLEAN": pa.bool_(),
+    "BYTE": pa.int8(),
+    "SHORT": pa.int16(),
+    "INT": pa.int32(),
+    "LONG": pa.int64(),
+    "FLOAT": pa.float32(),
+    "DOUBLE": pa.float64(),
+    "DATE": pa.date32(),
+    "TIMESTAMP": pa.timestamp("us", tz="UTC"),
+    "BINARY": pa.binary(),
+    "NULL": pa.null(),
+}
+
+def _arrow_type(column) -> pa.DataType:
+    type_name = column.type_name.value if column.type_name else None
+    if type_name == "DECIMAL":
+        return pa.decimal128(column.type_precision or 38, column.type_scale or 0)
+    return _ARROW_TYPES.get(type_name, pa.string())
+
+def _empty_table(response) -> pa.Table:
+    """An empty result with the column types of the manifest, like the chunks of a non-empty one."""
+    columns = response.manifest.schema.columns if response.manifest and response.manifest.schema else []
+    return pa.schema([(column.name, _arrow_type(column)) for column in columns or []]).empty_table()
+
+def _check_succeeded(response):
+    from databricks.sdk.service.sql import StatementState
+
+    if response.status.state != StatementState.SUCCEEDED:
+        error = response.status.error
+        raise StatementFailed(" ".join(error.message.splitlines()) if error and error.message else str(response.status.state))
+
+def _arrow_table(wclient: "WorkspaceClient", response) -> pa.Table:
+    """The whole result of a succeeded ARROW_STREAM/EXTERNAL_LINKS statement as one table."""
+    if not response.result or not response.result.external_links:
+        return _empty_table(response)
+    links = _chunk_links(wclient, response)
+    tables = list(_download_pool.map(_download_chunk, links))
+    logger.debug(f"decoded {len(links)} Arrow chunks of statement {response.statement_id}")
+    return pa.concat_tables(tables) if len(tables) > 1 else tables[0]
+
+def execute_arrow(wclient: "WorkspaceClient", statement: str, warehouse_id: str, wait_timeout: str = "50s", **kwargs) -> pa.Table:
+    """
+    Run `statement` on the warehouse and return its whole result as one Arrow
+    table. Extra keyword arguments (catalog, schema, parameters, ...) are
+    passed to `execute_statement`. Raises `StatementFailed` if it didn't succeed.
+    """
+    from databricks.sdk.service.sql import Disposition, Format
+
+    response = wclient.statement_execution.execute_statement(
+        statement=statement,
+        warehouse_id=warehouse_id,
+        wait_timeout=wait_timeout,
+        format=Format.ARROW_STREAM,
+        disposition=Disposition.EXTERNAL_LINKS,
+        **kwargs,
+    )
+    _check_succeeded(response)
+    return _arrow_table(wclient, response)
+
+def execute_arrow_dataframe(wclient: "WorkspaceClient", statement: str, warehouse_id: str, **kwargs) -> "pd.DataFrame":
+    """`execute_arrow`, converted to a pandas DataFrame."""
+    return arrow_to_dataframe(execute_arrow(wclient, statement, warehouse_id, **kwargs))
+
+async def _cancel_statement(wclient: "WorkspaceClient", statement_id: str):
+    try:
+        await asyncio.to_thread(wclient.statement_execution.cancel_execution, statement_id)
+        logger.info(f"cancelled statement {statement_id}")
+    except Exception as e:
+        logger.warning(f"Cancelling statement {statement_id} failed: {e}")
+
+def _cancel_when_submitted(wclient: "WorkspaceClient", submit: asyncio.Future):
+    """Cancel the statement `submit` returns, in the background; the caller itself was cancelled."""
+    async def cancel():
+        try:
+            response = await submit
+        except Exception:
+            return
+        await _cancel_statement(wclient, response.statement_id)
+
+    task = asyncio.ensure_future(cancel())
+    _cancelling.add(task)
+    task.add_done_callback(_cancelling.discard)
+
+async def aexecute_statement(
+    wclient: "WorkspaceClient",
+    statement: str,
+    warehouse_id: str,
+    timeout_seconds: Optional[float] = None,
+    **kwargs,
+):
+    """
+    Run `statement` on the warehouse, polling for its result from the asyncio
+    loop, and return the response of the succeeded statement. Extra keyword
+    arguments (format, disposition, catalog, parameters, ...) are passed to
+    `execute_statement`. The statement is cancelled if the calling task is
+    cancelled, and with `StatementTimeout` if it is still running after
+    `timeout_seconds`. Raises `StatementFailed` if it didn't succeed.
+    """
+    from databricks.sdk.service.sql import ExecuteStatementRequestOnWaitTimeout, StatementState
+
+    deadline = None if timeout_seconds is None else time.monotonic() + timeout_seconds
+    # the SDK is blocking, but every call returns within SQL_SUBMIT_WAIT_SECONDS
+    submit = asyncio.ensure_future(asyncio.to_thread(
+        wclient.statement_execution.execute_statement,
+        statement=statement,
+        warehouse_id=warehouse_id,
+        wait_timeout=f"{SQL_SUBMIT_WAIT_SECONDS}s",
+        on_wait_timeout=ExecuteStatementRequestOnWaitTimeout.CONTINUE,
+        **kwargs,
+    ))
+    delay = SQL_POLL_INITIAL_SECONDS
+    try:
+        # shielded, so a cancelled caller still learns the ID of the statement it submitted
+        response = await asyncio.shield(submit)
+        statement_id = response.statement_id
+        while response.status.state in (StatementState.PENDING, StatementState.RUNNING):
+            if deadline is not None and time.monotonic() + delay >= deadline:
+                await asyncio.sleep(max(0.0, deadline - time.monotonic()))
+                await _cancel_statement(wclient, statement_id)
+                raise StatementTimeout(f"Statement {statement_id} didn't finish within {timeout_seconds:g}s")
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, SQL_POLL_MAX_SECONDS)
+            response = await asyncio.to_thread(wclient.statement_execution.get_statement, statement_id)
+    except asyncio.CancelledError:
+        # the caller went away; stop the warehouse from working on a result nobody reads
+        _cancel_when_submitted(wclient, submit)
+        raise
+    _check_succeeded(response)
+    return response
+
+async def aexecute_arrow_dataframe(
+    wclient: "WorkspaceClient", statement: str, warehouse_id: str, timeout_seconds: Optional[float] = None, **kwargs
+) -> "pd.DataFrame":
+    """`execute_arrow_dataframe`, with the statement run by `aexecute_statement`."""
+    from databricks.sdk.service.sql import Disposition, Format
+
+    response = await aexecute_statement(
+        wclient,
+        statement,
+        warehouse_id,
+        timeout_seconds,
+        format=Format.ARROW_STREAM,
+        disposition=Disposition.EXTERNAL_LINKS,
+        **kwargs,
+    )
+    return arrow_to_dataframe(await asyncio.to_thread(_arrow_table, wclient, response))
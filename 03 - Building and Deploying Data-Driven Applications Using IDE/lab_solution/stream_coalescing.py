@@ -0,0 +1,79 @@
+"""
+Coalescing of streamed text deltas into fewer UI updates.
+
+Each update a Gradio generator yields re-renders the message and is sent over
+the websocket, so yielding once per token costs CPU and bandwidth for every
+token of every concurrent chat. `coalesce_deltas` passes the first delta
+through at once, so the time to first token doesn't change, and then joins
+the deltas that arrive within `window_seconds`, or until `max_chars` are
+buffered, into one. The upstream iterator is read by a background thread, so
+buffered text is flushed when the window ends even if the model pauses, and
+whatever is left is flushed when the stream ends.
+"""
+import contextvars
+import queue
+import threading
+import time
+
+_DONE = object()
+
+class _Failed:
+    __slots__ = ("error",)
+
+    def __init__(self, error):
+        self.error = error
+
+def _pump(deltas, chunks, stop):
+    try:
+        for delta in deltas:
+            chunks.put(delta)
+            if stop.is_set():
+                break
+    except Exception as e:
+        chunks.put(_Failed(e))
+    finally:
+        if stop.is_set() and hasattr(deltas, "close"):
+            # the consumer went away; end the upstream request too
+            deltas.close()
+        chunks.put(_DONE)
+
+def coalesce_deltas(deltas, window_seconds: float = 0.05, max_chars: int = 512, clock=time.monotonic):
+    """Yield the text deltas of `deltas` joined into batches, at most one per `window_seconds`."""
+    if window_seconds <= 0:
+        yield from deltas
+        return
+
+    chunks = queue.Queue()
+    stop = threading.Event()
+    # the upstream iterator runs in the caller's context, e.g. for tracing
+    context = contextvars.copy_context()
+    threading.Thread(
+        target=context.run, args=(_pump, deltas, chunks, stop), name="stream-coalescing", daemon=True
+    ).start()
+
+    pending = []
+    pending_chars = 0
+    flush_at = None
+    first = True
+    try:
+        while True:
+            try:
+                item = chunks.get(timeout=None if flush_at is None else max(0.0, flush_at - clock()))
+            except queue.Empty:
+                item = None
+            if item is _DONE or isinstance(item, _Failed):
+                break
+            if item:
+                pending.append(item)
+                pending_chars += len(item)
+                if flush_at is None:
+                    flush_at = clock() + window_seconds
+            if pending and (first or item is None or pending_chars >= max_chars or clock() >= flush_at):
+                yield "".join(pending)
+                pending, pending_chars, flush_at, first = [], 0, None, False
+        if pending:
+            yield "".join(pending)
+        if isinstance(item, _Failed):
+            raise item.error
+    finally:
+        stop.set()
@@ -0,0 +1,110 @@
+"""
+Sampled capture of agent traces.
+
+Agent traces are large, so asking for one on every request inflates every
+response and the time spent parsing it. `TraceSampler` decides up front which
+requests ask for a trace (`rate`), and which requests are recorded anyway
+because they failed or took longer than `slow_seconds`. Those requests didn't
+ask for a trace, so only their request ID, latency and error are recorded;
+the full trace can be looked up by request ID in the endpoint's inference
+table. Records are appended to a JSON lines file by `TraceStore` from a
+daemon thread, off the request path.
+"""
+import atexit
+import json
+import logging
+import queue
+import random
+import threading
+import time
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+class TraceSampler:
+    """Samples `rate` of requests, and always keeps failed requests and requests slower than `slow_seconds`."""
+
+    def __init__(self, rate: float = 0.1, slow_seconds: float = 10.0, always_on_error: bool = True, rng=random.random):
+        self.rate = rate
+        self.slow_seconds = slow_seconds
+        self.always_on_error = always_on_error
+        self._rng = rng
+
+    def sample(self) -> bool:
+        """Whether the next request should ask the endpoint for its trace."""
+        return self.rate >= 1 or (self.rate > 0 and self._rng() < self.rate)
+
+    def tail_reason(self, latency_seconds: float, error=None) -> Optional[str]:
+        """Why a request that wasn't sampled should be recorded anyway, or None."""
+        if error is not None and self.always_on_error:
+            return "error"
+        if self.slow_seconds and latency_seconds >= self.slow_seconds:
+            return "slow"
+        return None
+
+class TraceStore:
+    """Appends trace records as JSON lines to `path`, written by a daemon thread."""
+
+    def __init__(self, path: str, max_queue_size: int = 1000):
+        self.path = path
+        self._queue = queue.Queue(maxsize=max_queue_size)
+        self._lock = threading.Lock()
+        self._thread = None
+        self.written = 0
+        self.dropped = 0
+        self.failed = 0
+
+    def submit(self, record: dict) -> bool:
+        """Queue a record without blocking. Returns False if the queue is full and the record was dropped."""
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="trace-store", daemon=True)
+                self._thread.start()
+                atexit.register(self.flush, 10.0)
+        try:
+            self._queue.put_nowait(record)
+            return True
+        except queue.Full:
+            with self._lock:
+                self.dropped += 1
+            return False
+
+    def _run(self):
+        while True:
+            records = [self._queue.get()]
+            # write whatever else is waiting in the same call
+            while True:
+                try:
+                    records.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                with open(self.path, "a") as f:
+                    f.writelines(json.dumps(record, default=str) + "\n" for record in records)
+                with self._lock:
+                    self.written += len(records)
+            except Exception as e:
+                with self._lock:
+                    self.failed += len(records)
+                logger.warning(f"Writing {len(records)} traces to {self.path} failed: {e}")
+            finally:
+                for _ in records:
+                    self._queue.task_done()
+
+    def flush(self, timeout: float = None) -> bool:
+        """Wait until every queued record has been written; returns False if `timeout` expired first."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self._queue.unfinished_tasks:
+            if deadline is not None and time.monotonic() >= deadline:
+                return False
+            time.sleep(0.01)
+        return True
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "pending": self._queue.qsize(),
+                "written": self.written,
+                "dropped": self.dropped,
+                "failed": self.failed,
+            }
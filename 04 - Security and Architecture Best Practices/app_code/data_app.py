@@ -1,10 +1,11 @@
 from databricks.sdk import WorkspaceClient
 from databricks.sdk.service.sql import StatementParameterListItem, StatementState
+from sql_utils import caller_identity, iter_result_rows, read_rows, result_cache, statement_cache_key
 import gradio as gr
 import logging
 import os
 import sys
-from typing import Dict, List
+from typing import Dict, Iterator, List, Tuple
 
 # ensure environment variable is set correctly
 assert os.getenv('DATABRICKS_WAREHOUSE_ID'), "DATABRICKS_WAREHOUSE_ID must be set in app.yaml."
@@ -23,18 +24,17 @@ if not logger.handlers:
 # (assumes DATABRICKS_CLIENT_ID, DATABRICKS_CLIENT_SECRET and DATABRICKS_HOST are set)
 wclient = WorkspaceClient(auth_type='oauth-m2m')
 
-# general function to run SQL queries on a warehouse specified by DATABRICKS_WAREHOUSE_ID
-# uses the statement execution API to safely handle catalog, schema, and query parameters
-# returns dict with headers and data as per https://www.gradio.app/docs/gradio/dataframe
-def sql_query(
+# runs a query and returns its column names and an iterator over all of its rows, which
+# fetches the result chunk by chunk as it is read, so large results needn't fit in memory
+def sql_query_rows(
     query: str,
     wclient: WorkspaceClient,
     catalog: str=None,
     schema: str=None,
     parameters: List[Dict]=None
-) -> Dict:
+) -> Tuple[List[str], Iterator[List]]:
 
-    logger.info(f"processing query {query} as {wclient.current_user.me().display_name}")
+    logger.info(f"processing query {query} as {caller_identity(wclient).display_name}")
 
     response = wclient.statement_execution.execute_statement(
         statement=query,
@@ -55,19 +55,58 @@ def sql_query(
         error_string = ' '. join(response.status.error.message.splitlines())
         logger.error(f"query failed: {error_string}")
         raise gr.Error(error_string, duration=10)
-    else:
-        logger.info(f"query returned {response.result.row_count} records")
 
-        if response.result.row_count > 0:
-            return {
-                'headers': [ c.name for c in response.manifest.schema.columns],
-                'data': response.result.data_array
-            }
+    total_rows = response.manifest.total_row_count or response.result.row_count or 0
+    logger.info(f"query returned {total_rows} records in {response.manifest.total_chunk_count or 1} chunks")
+    if not total_rows:
+        return [], iter([])
+    return [ c.name for c in response.manifest.schema.columns], iter_result_rows(wclient, response)
+
+# Optional cap on the rows of a result loaded into the app by sql_query, and kept in its cache;
+# 0 (the default) loads every row. Use sql_query_rows to read a large result without holding it
+SQL_MAX_RESULT_ROWS = int(os.getenv('SQL_MAX_RESULT_ROWS', '0'))
+
+def warn_truncated():
+    message = f"Only the first {SQL_MAX_RESULT_ROWS} records of the result are shown."
+    logger.warning(message)
+    gr.Warning(message)
+
+# general function to run SQL queries on a warehouse specified by DATABRICKS_WAREHOUSE_ID
+# uses the statement execution API to safely handle catalog, schema, and query parameters
+# returns dict with headers and data as per https://www.gradio.app/docs/gradio/dataframe,
+# with at most SQL_MAX_RESULT_ROWS rows if set; results are cached for `cache_ttl_seconds` (default SQL_CACHE_TTL_SECONDS); pass 0 to always run the query
+def sql_query(
+    query: str,
+    wclient: WorkspaceClient,
+    catalog: str=None,
+    schema: str=None,
+    parameters: List[Dict]=None,
+    cache_ttl_seconds: float=None
+) -> Dict:
+
+    cache_key = statement_cache_key(caller_identity(wclient).user_name, query, catalog, schema, parameters)
+    if cache_ttl_seconds != 0:
+        cached = result_cache.get(cache_key)
+        if cached is not None:
+            truncated = cached.pop('truncated', False)
+            logger.info(
+                f"query result served from cache ({len(cached['data'])} records, "
+                f"hit rate {result_cache.stats()['hit_rate']:.0%})"
+            )
+            if truncated:
+                warn_truncated()
+            return cached
 
-        return {
-            'headers': [],
-            'data': []
-        }
+    headers, rows = sql_query_rows(query, wclient, catalog, schema, parameters)
+    data, truncated = read_rows(rows, SQL_MAX_RESULT_ROWS)
+    result = {
+        'headers': headers,
+        'data': data
+    }
+    result_cache.put(cache_key, {**result, 'truncated': truncated}, cache_ttl_seconds)
+    if truncated:
+        warn_truncated()
+    return result
 
 # inputs: catalog, schema, table
 # output: table (formatted like a dict as per https://www.gradio.app/docs/gradio/dataframe)
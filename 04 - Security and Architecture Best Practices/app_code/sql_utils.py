@@ -0,0 +1,150 @@
+"""
+Helpers for running queries on a SQL warehouse with the statement execution API.
+
+Large results are split into chunks; `iter_result_rows` yields the rows of
+every chunk in order, fetching the next few chunks in parallel while the
+current one is read, and `read_rows` reads all of them or a bounded number.
+
+Results of recent queries are kept in memory by `StatementResultCache`, so
+previewing the same table again or reloading the page doesn't cost another
+warehouse round trip. Results are only shared between callers that run
+queries as the same identity, which `caller_identity` looks up once per client.
+"""
+from databricks.sdk import WorkspaceClient
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+import hashlib
+import json
+import os
+import threading
+import time
+import weakref
+from typing import Dict, Iterator, List, Optional, Tuple
+
+# Result chunks after the first are fetched from the warehouse concurrently, at most
+# SQL_CHUNK_FETCH_WORKERS at a time; only that many chunks are held ahead of the reader
+SQL_CHUNK_FETCH_WORKERS = int(os.getenv('SQL_CHUNK_FETCH_WORKERS', '4'))
+_chunk_fetch_pool = ThreadPoolExecutor(max_workers=SQL_CHUNK_FETCH_WORKERS, thread_name_prefix='sql-chunks')
+
+def iter_result_rows(wclient: WorkspaceClient, response) -> Iterator[List]:
+    """Yield every row of a succeeded statement, following its result chunks in order."""
+    yield from response.result.data_array or []
+    next_index = response.result.next_chunk_index
+    if next_index is None:
+        return
+    get_chunk = wclient.statement_execution.get_statement_result_chunk_n
+    total_chunks = response.manifest.total_chunk_count
+    if not total_chunks:
+        # without the chunk count, chunks can only be fetched one after the other
+        while next_index is not None:
+            chunk = get_chunk(response.statement_id, next_index)
+            yield from chunk.data_array or []
+            next_index = chunk.next_chunk_index
+        return
+    pending = deque()
+    try:
+        for index in range(next_index, total_chunks):
+            pending.append(_chunk_fetch_pool.submit(get_chunk, response.statement_id, index))
+            if len(pending) >= SQL_CHUNK_FETCH_WORKERS:
+                yield from pending.popleft().result().data_array or []
+        while pending:
+            yield from pending.popleft().result().data_array or []
+    finally:
+        # the reader stopped early; don't fetch chunks nobody will read
+        for future in pending:
+            future.cancel()
+
+def read_rows(rows: Iterator[List], max_rows: int = 0) -> Tuple[List[List], bool]:
+    """Read at most `max_rows` rows, or all with 0; returns them and whether more were left, which are not fetched."""
+    if max_rows <= 0:
+        return list(rows), False
+    data = list(islice(rows, max_rows))
+    truncated = next(rows, None) is not None
+    if hasattr(rows, 'close'):
+        rows.close()
+    return data, truncated
+
+# SQL_CACHE_MAX_BYTES bounds the memory used by cached results; they expire after
+# SQL_CACHE_TTL_SECONDS unless a query sets its own TTL
+SQL_CACHE_MAX_BYTES = int(os.getenv('SQL_CACHE_MAX_BYTES', str(64 * 1024 * 1024)))
+SQL_CACHE_TTL_SECONDS = float(os.getenv('SQL_CACHE_TTL_SECONDS', '300'))
+
+class StatementResultCache:
+    """Thread-safe LRU cache of query results, bounded by their size in bytes, with a TTL per entry."""
+
+    def __init__(self, max_bytes: int, ttl_seconds: float, clock=time.monotonic):
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self._clock = clock
+        self._lock = threading.Lock()
+        # key -> (expires_at, size, result as JSON), least recently used first
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key: str) -> Optional[Dict]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] <= self._clock():
+                self._bytes -= self._entries.pop(key)[1]
+                self.expirations += 1
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+        # stored as JSON so callers can't change the cached copy
+        return json.loads(entry[2])
+
+    def put(self, key: str, result: Dict, ttl_seconds: float = None):
+        ttl_seconds = self.ttl_seconds if ttl_seconds is None else ttl_seconds
+        value = json.dumps(result, default=str)
+        if ttl_seconds <= 0 or len(value) > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._bytes -= self._entries.pop(key)[1]
+            self._entries[key] = (self._clock() + ttl_seconds, len(value), value)
+            self._bytes += len(value)
+            while self._bytes > self.max_bytes:
+                self._bytes -= self._entries.popitem(last=False)[1][1]
+                self.evictions += 1
+
+    def stats(self) -> Dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+            }
+
+result_cache = StatementResultCache(SQL_CACHE_MAX_BYTES, SQL_CACHE_TTL_SECONDS)
+
+# the user or service principal each client runs queries as
+_client_identities = weakref.WeakKeyDictionary()
+
+def caller_identity(client: WorkspaceClient):
+    """The identity a client runs queries as (`current_user.me()`), looked up once per client."""
+    identity = _client_identities.get(client)
+    if identity is None:
+        identity = _client_identities[client] = client.current_user.me()
+    return identity
+
+def statement_cache_key(identity: str, query: str, catalog: str, schema: str, parameters: List[Dict]) -> str:
+    """Hash of a query and who runs it; the parameters' order doesn't matter."""
+    canonical = json.dumps(
+        [identity, query, catalog, schema, sorted((p['key'], p['value']) for p in parameters or [])],
+        separators=(',', ':'),
+        default=str,
+    )
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
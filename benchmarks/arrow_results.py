@@ -0,0 +1,166 @@
+"""
+Compare the JSON_ARRAY and ARROW_STREAM result paths of the dashboard's `sql_query`.
+
+Both paths decode the same sales-like result:
+
+1. JSON_ARRAY: the JSON payload of an inline result, parsed with `json.loads`,
+   turned into a DataFrame and cast to the columns' types, as the dashboard
+   would have to do to plot numbers instead of strings;
+2. ARROW_STREAM: the result written locally as Arrow IPC stream files, one per
+   chunk, served over HTTP and read through `sql_utils.execute_arrow_dataframe`
+   with a stub workspace client that returns their links, so the chunk
+   downloads are part of the timing.
+
+No workspace is needed.
+
+Usage:
+
+    python benchmarks/arrow_results.py --rows 1000000 --chunks 8 --output arrow.json
+"""
+from functools import partial
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from types import SimpleNamespace
+import argparse
+import json
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+DEFAULT_APP_DIR = Path(__file__).resolve().parent.parent / "02 - Building and Deploying Data-Driven Applications" / "lab_solution"
+
+COUNTRIES = ["USA", "Japan", "Australia", "France", "Germany", "Canada", "Brazil", "India"]
+PRODUCTS = ["Golden Gate Ginger", "Outback Oatmeal", "Austin Almond Biscotti", "Tokyo Tidbits", "Pearly Pies"]
+
+def sales_table(rows: int):
+    """A table shaped like the dashboard's sales data."""
+    import pyarrow as pa
+
+    return pa.table({
+        "transactionID": pa.array(range(rows), type=pa.int64()),
+        "country": pa.array([COUNTRIES[i % len(COUNTRIES)] for i in range(rows)]),
+        "product": pa.array([PRODUCTS[i % len(PRODUCTS)] for i in range(rows)]),
+        "quantity": pa.array([i % 50 + 1 for i in range(rows)], type=pa.int32()),
+        "unitPrice": pa.array([(i % 400) / 100 + 1 for i in range(rows)], type=pa.float64()),
+    })
+
+def json_array_payload(table) -> bytes:
+    """The result as the JSON_ARRAY format returns it: every value a string."""
+    rows = [[str(value) for value in row] for row in zip(*(column.to_pylist() for column in table.columns))]
+    return json.dumps({"data_array": rows}).encode()
+
+def write_chunks(table, chunks: int, directory: Path) -> list:
+    """Write `table` as `chunks` Arrow IPC stream files; returns their names."""
+    import pyarrow as pa
+
+    names = []
+    size = -(-table.num_rows // chunks)
+    for index in range(chunks):
+        name = f"chunk-{index}.arrow"
+        with pa.OSFile(str(directory / name), "wb") as sink, pa.ipc.new_stream(sink, table.schema) as writer:
+            writer.write_table(table.slice(index * size, size))
+        names.append(name)
+    return names
+
+class StubStatementExecution:
+    """Answers `execute_statement` with external links to locally served Arrow files, all in the first response."""
+
+    def __init__(self, base_url: str, names: list):
+        self.base_url = base_url
+        self.names = names
+
+    def execute_statement(self, **kwargs):
+        from databricks.sdk.service.sql import StatementState
+
+        links = [
+            SimpleNamespace(
+                external_link=f"{self.base_url}/{name}",
+                http_headers=None,
+                next_chunk_index=index + 1 if index + 1 < len(self.names) else None,
+            )
+            for index, name in enumerate(self.names)
+        ]
+        return SimpleNamespace(
+            statement_id="benchmark",
+            status=SimpleNamespace(state=StatementState.SUCCEEDED, error=None),
+            manifest=None,
+            result=SimpleNamespace(external_links=links),
+        )
+
+def serve(directory: Path):
+    class QuietHandler(SimpleHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), partial(QuietHandler, directory=str(directory)))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def timed(function, repeat: int):
+    timings, result = [], None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings), result
+
+def run(args) -> dict:
+    sys.path.insert(0, str(args.app_dir))
+    import pandas as pd
+    from sql_utils import execute_arrow_dataframe
+
+    table = sales_table(args.rows)
+    payload = json_array_payload(table)
+    dtypes = {field.name: field.type.to_pandas_dtype() for field in table.schema}
+
+    def json_path():
+        data_array = json.loads(payload)["data_array"]
+        return pd.DataFrame(data_array, columns=table.column_names).astype(dtypes)
+
+    with tempfile.TemporaryDirectory() as directory:
+        names = write_chunks(table, args.chunks, Path(directory))
+        server = serve(Path(directory))
+        wclient = SimpleNamespace(statement_execution=StubStatementExecution(
+            f"http://127.0.0.1:{server.server_address[1]}", names
+        ))
+        arrow_seconds, arrow_df = timed(lambda: execute_arrow_dataframe(wclient, "SELECT * FROM sales", "benchmark"), args.repeat)
+        arrow_bytes = sum((Path(directory) / name).stat().st_size for name in names)
+        server.shutdown()
+    json_seconds, json_df = timed(json_path, args.repeat)
+
+    if not json_df.equals(arrow_df):
+        raise RuntimeError("The JSON_ARRAY and ARROW_STREAM results differ")
+    return {
+        "rows": args.rows,
+        "chunks": args.chunks,
+        "json_array": {"seconds": json_seconds, "bytes": len(payload)},
+        "arrow_stream": {"seconds": arrow_seconds, "bytes": arrow_bytes},
+        "speedup": json_seconds / arrow_seconds,
+        "dtypes": {name: str(dtype) for name, dtype in arrow_df.dtypes.items()},
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--app-dir", type=Path, default=DEFAULT_APP_DIR, help="lab directory with sql_utils.py")
+    parser.add_argument("--rows", type=int, default=500000, help="rows in the result")
+    parser.add_argument("--chunks", type=int, default=4, help="Arrow files the result is split into")
+    parser.add_argument("--repeat", type=int, default=5, help="runs per path; the median is reported")
+    parser.add_argument("--output", default=None, help="write the results to this JSON file")
+    args = parser.parse_args()
+
+    results = run(args)
+    print(f"{results['rows']} rows")
+    print(f"  JSON_ARRAY:   {results['json_array']['seconds']:.3f}s ({results['json_array']['bytes'] / 1e6:.1f} MB)")
+    print(
+        f"  ARROW_STREAM: {results['arrow_stream']['seconds']:.3f}s ({results['arrow_stream']['bytes'] / 1e6:.1f} MB"
+        f" in {results['chunks']} chunks)"
+    )
+    print(f"  speedup: {results['speedup']:.1f}x")
+    print("  dtypes: " + ", ".join(f"{name} {dtype}" for name, dtype in results["dtypes"].items()))
+    if args.output:
+        Path(args.output).write_text(json.dumps(results, indent=2))
+
+if __name__ == "__main__":
+    main()
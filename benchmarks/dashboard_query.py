@@ -0,0 +1,104 @@
+"""
+Measure the latency of the dashboard's `fetch_sales_data` and the workspace API calls behind it.
+
+Imports a lab dashboard app in a fresh interpreter and runs `fetch_sales_data`
+`--queries` times on one event loop, like Gradio does, against an in-process
+`MockServingEndpoint` that answers OAuth, SCIM and SQL statement requests
+after `--api-latency` seconds. Reports the latency of the first query and of
+the later ones, and the API calls each of them made.
+
+Usage:
+
+    python benchmarks/dashboard_query.py --api-latency 0.05 --queries 20 --output dashboard.json
+"""
+from pathlib import Path
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+from mock_serving_endpoint import MockServingEndpoint
+
+DEFAULT_APP_DIR = Path(__file__).resolve().parent.parent / "02 - Building and Deploying Data-Driven Applications" / "lab_solution"
+
+QUERIES_SCRIPT = """
+import asyncio, json, time, types, urllib.request
+import app
+
+def api_calls():
+    with urllib.request.urlopen(MOCK_URL + "/stats") as response:
+        stats = json.load(response)
+    return {key.split(":", 1)[1]: count for key, count in stats.items() if key.startswith("workspace:")}
+
+async def main():
+    request = types.SimpleNamespace(session_hash="benchmark", headers={})
+    latencies, calls = [], []
+    for _ in range(QUERIES):
+        before = api_calls()
+        start = time.perf_counter()
+        df = await app.fetch_sales_data(request)
+        latencies.append(time.perf_counter() - start)
+        after = api_calls()
+        calls.append({kind: count - before.get(kind, 0) for kind, count in after.items() if count != before.get(kind, 0)})
+    return {"latencies": latencies, "calls": calls, "rows": len(df)}
+
+print(json.dumps(asyncio.run(main())))
+"""
+
+def run(args, env) -> dict:
+    script = f"MOCK_URL = {env['DATABRICKS_HOST']!r}\nQUERIES = {args.queries}\n{QUERIES_SCRIPT}"
+    result = subprocess.run(
+        [sys.executable, "-c", script], cwd=args.app_dir, env=env, capture_output=True, text=True, timeout=args.timeout,
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"Running the queries failed:\n{result.stderr[-2000:]}")
+    queries = json.loads(result.stdout.strip().splitlines()[-1])
+    later = queries["latencies"][1:] or queries["latencies"]
+    return {
+        "app_dir": str(args.app_dir),
+        "api_latency_seconds": args.api_latency,
+        "rows": queries["rows"],
+        "first_query_seconds": queries["latencies"][0],
+        "first_query_calls": queries["calls"][0],
+        "median_seconds": statistics.median(later),
+        "max_seconds": max(later),
+        "later_query_calls": queries["calls"][-1],
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--app-dir", type=Path, default=DEFAULT_APP_DIR, help="lab directory with the dashboard app.py")
+    parser.add_argument("--queries", type=int, default=20, help="number of fetch_sales_data calls")
+    parser.add_argument("--api-latency", type=float, default=0.05, help="round trip of each workspace API call")
+    parser.add_argument("--timeout", type=float, default=300)
+    parser.add_argument("--output", default=None, help="write the results to this JSON file")
+    args = parser.parse_args()
+
+    mock = MockServingEndpoint(api_latency=args.api_latency).start()
+    env = {key: value for key, value in os.environ.items() if not key.startswith("DATABRICKS_")}
+    env.update(
+        DATABRICKS_HOST=mock.url,
+        DATABRICKS_CLIENT_ID="benchmark",
+        DATABRICKS_CLIENT_SECRET="benchmark",
+        DATABRICKS_WAREHOUSE_ID="benchmark",
+        SERVING_ENDPOINT="mock",
+        WARM_UP="false",
+        MLFLOW_DISABLE_AGENT_HINT="1",
+    )
+    results = run(args, env)
+    mock.stop()
+
+    calls = lambda counts: ", ".join(f"{count} {kind}" for kind, count in sorted(counts.items())) or "none"
+    print(f"fetch_sales_data with {args.api_latency * 1000:.0f} ms per workspace API call ({results['rows']} rows)")
+    print(f"  first query: {results['first_query_seconds'] * 1000:.1f} ms ({calls(results['first_query_calls'])})")
+    print(
+        f"  later queries: median {results['median_seconds'] * 1000:.1f} ms, max {results['max_seconds'] * 1000:.1f} ms"
+        f" ({calls(results['later_query_calls'])})"
+    )
+    if args.output:
+        Path(args.output).write_text(json.dumps(results, indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,489 @@
+"""
+Local stand-in for a Databricks model serving endpoint, for offline benchmarks.
+
+Implements the part of the workspace API that `model_serving_utils` and the
+dashboard's `sql_query` use:
+
+- GET  /api/2.0/serving-endpoints/<name>                        endpoint metadata
+- POST /serving-endpoints/<name>/invocations                    predict and streaming,
+       for chat/completions (`messages`) and agent/v1/responses (`input`) payloads
+- POST /serving-endpoints/<name>/served-models/feedback/invocations   feedback
+- GET  /.well-known/databricks-config                           host metadata for the SDK
+- GET  /oidc/.well-known/oauth-authorization-server,
+  POST /oidc/v1/token                                           OAuth machine-to-machine tokens
+- GET  /api/2.0/preview/scim/v2/Me                              the calling principal
+- POST /api/2.0/sql/statements, GET /api/2.0/sql/statements/<id>
+       a fixed sales-by-country result, inline as JSON_ARRAY or as an
+       ARROW_STREAM external link to GET /sql-results/<id>.arrow
+- GET  /stats                                                   request counters
+
+Latency, token rate, injected errors, the cold start of a scaled-to-zero
+endpoint and the round trip of the other workspace API calls are
+configurable. Only the standard library is used, and pyarrow for ARROW_STREAM
+results.
+
+Usage:
+
+    python benchmarks/mock_serving_endpoint.py --port 8080 --task agent/v1/responses
+
+    DATABRICKS_HOST=http://127.0.0.1:8080 DATABRICKS_TOKEN=dummy SERVING_ENDPOINT=mock \\
+        python app.py
+
+The MLflow deployments client retries 429 and 5xx responses for up to 10
+minutes; set MLFLOW_DEPLOYMENT_PREDICT_TOTAL_TIMEOUT when injecting errors.
+"""
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import argparse
+import json
+import random
+import sys
+import threading
+import time
+import uuid
+
+WORDS = (
+    "cookies chocolate chip oatmeal raisin sugar snickerdoodle sales store Seattle customers "
+    "week best seller franchise marketing campaign review fresh baked order favorite flavor "
+    "the a our your and with for this every new today"
+).split()
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # clients drop idle keep-alive connections all the time, that's not worth a traceback
+        if not isinstance(sys.exc_info()[1], (BrokenPipeError, ConnectionResetError)):
+            super().handle_error(request, client_address)
+
+class MockServingEndpoint:
+    """A threaded HTTP server that mimics serving endpoints; use `start()` to run it in the background."""
+
+    def __init__(
+        self,
+        host: str = "127.0.0.1",
+        port: int = 0,
+        task: str = "llm/v1/chat",
+        endpoint_tasks: dict = None,
+        latency: float = 0.05,
+        tokens_per_second: float = 50.0,
+        response_tokens: int = 40,
+        error_rate: float = 0.0,
+        error_status: int = 503,
+        retry_after: float = 1.0,
+        cold_start: float = 0.0,
+        idle_timeout: float = None,
+        tool_calls: bool = True,
+        api_latency: float = 0.0,
+        seed: int = None,
+    ):
+        """
+        `latency` is the delay before the first token and `tokens_per_second`
+        the generation speed after it. A fraction `error_rate` of invocations
+        fails with `error_status`. The first request to an endpoint, and the
+        first one after `idle_timeout` seconds without requests, waits
+        `cold_start` seconds. Responses agents call a tool before answering
+        unless `tool_calls` is False. OAuth, SCIM and SQL statement requests
+        take `api_latency` seconds.
+        """
+        self.task = task
+        self.endpoint_tasks = dict(endpoint_tasks or {})
+        self.latency = latency
+        self.tokens_per_second = tokens_per_second
+        self.response_tokens = response_tokens
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.retry_after = retry_after
+        self.cold_start = cold_start
+        self.idle_timeout = idle_timeout
+        self.tool_calls = tool_calls
+        self.api_latency = api_latency
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._last_request = {}
+        self._warm_at = {}
+        self._counts = {}
+        self.server = _Server((host, port), _handler(self))
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> "MockServingEndpoint":
+        self._thread = threading.Thread(target=self.server.serve_forever, name="mock-serving-endpoint", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def task_of(self, endpoint: str) -> str:
+        return self.endpoint_tasks.get(endpoint, self.task)
+
+    def count(self, endpoint: str, kind: str):
+        with self._lock:
+            key = f"{endpoint}:{kind}"
+            self._counts[key] = self._counts.get(key, 0) + 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            return dict(self._counts)
+
+    def reset_stats(self):
+        with self._lock:
+            self._counts.clear()
+
+    def should_fail(self) -> bool:
+        with self._lock:
+            return self._random.random() < self.error_rate
+
+    def wait_until_warm(self, endpoint: str):
+        """Sleep through the cold start of an idle endpoint; concurrent requests share it."""
+        with self._lock:
+            now = time.monotonic()
+            last_request = self._last_request.get(endpoint)
+            idle = last_request is None or (self.idle_timeout is not None and now - last_request > self.idle_timeout)
+            if idle and self.cold_start > 0 and self._warm_at.get(endpoint, 0) <= now:
+                self._warm_at[endpoint] = now + self.cold_start
+                self._counts[f"{endpoint}:cold_start"] = self._counts.get(f"{endpoint}:cold_start", 0) + 1
+            wait = self._warm_at.get(endpoint, 0) - now
+            self._last_request[endpoint] = now + max(wait, 0)
+        if wait > 0:
+            time.sleep(wait)
+
+    def answer_tokens(self, prompt: str) -> list:
+        """A deterministic answer for a prompt, as a list of tokens."""
+        rng = random.Random(prompt)
+        return [rng.choice(WORDS) + " " for _ in range(self.response_tokens)]
+
+    def token_delay(self) -> float:
+        return 1.0 / self.tokens_per_second if self.tokens_per_second > 0 else 0.0
+
+    def api_call(self, kind: str):
+        """Count a workspace API call and wait out its round trip."""
+        self.count("workspace", kind)
+        if self.api_latency > 0:
+            time.sleep(self.api_latency)
+
+# the result of every SQL statement
+SALES_COLUMNS = [("Country", "STRING"), ("Total Sales", "LONG")]
+SALES_ROWS = [["Australia", 4120], ["Canada", 3310], ["France", 2875], ["Japan", 5092], ["USA", 9874]]
+
+def _sales_arrow_stream() -> bytes:
+    import pyarrow as pa
+
+    table = pa.table({
+        "Country": pa.array([row[0] for row in SALES_ROWS]),
+        "Total Sales": pa.array([row[1] for row in SALES_ROWS], type=pa.int64()),
+    })
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
+
+def _statement(mock, statement_id, result_format):
+    manifest = {
+        "format": result_format,
+        "schema": {
+            "column_count": len(SALES_COLUMNS),
+            "columns": [
+                {"name": name, "type_name": type_name, "position": position}
+                for position, (name, type_name) in enumerate(SALES_COLUMNS)
+            ],
+        },
+        "total_chunk_count": 1,
+        "total_row_count": len(SALES_ROWS),
+    }
+    if result_format == "ARROW_STREAM":
+        result = {"external_links": [{
+            "chunk_index": 0,
+            "row_offset": 0,
+            "row_count": len(SALES_ROWS),
+            "external_link": f"{mock.url}/sql-results/{statement_id}.arrow",
+        }]}
+    else:
+        result = {"chunk_index": 0, "row_offset": 0, "row_count": len(SALES_ROWS),
+                  "data_array": [[str(value) for value in row] for row in SALES_ROWS]}
+    return {"statement_id": statement_id, "status": {"state": "SUCCEEDED"}, "manifest": manifest, "result": result}
+
+def _last_user_text(body) -> str:
+    for msg in reversed(body.get("messages") or body.get("input") or []):
+        if msg.get("role") == "user":
+            content = msg.get("content")
+            if isinstance(content, list):
+                return " ".join(part.get("text", "") for part in content if isinstance(part, dict))
+            return str(content or "")
+    return ""
+
+def _databricks_output(request_id, body):
+    """The `databricks_output` field of a response; agent endpoints only return it when asked for the trace."""
+    if not (body.get("databricks_options") or {}).get("return_trace"):
+        return {}
+    trace = {"info": {"request_id": request_id, "status": "OK"}, "data": {"spans": []}}
+    return {"databricks_output": {"databricks_request_id": request_id, "trace": trace}}
+
+def _tool_call_items(prompt):
+    call_id = f"call_{uuid.uuid4().hex[:12]}"
+    arguments = json.dumps({"question": prompt[:80]})
+    function_call = {
+        "type": "function_call",
+        "id": f"fc_{uuid.uuid4().hex[:12]}",
+        "call_id": call_id,
+        "name": "get_sales_data",
+        "arguments": arguments,
+    }
+    function_call_output = {
+        "type": "function_call_output",
+        "call_id": call_id,
+        "output": json.dumps({"rows": 3, "total_sales": 1234}),
+    }
+    return function_call, function_call_output
+
+def _message_item(item_id, text):
+    return {
+        "type": "message",
+        "id": item_id,
+        "role": "assistant",
+        "content": [{"type": "output_text", "text": text}],
+    }
+
+def _handler(mock: MockServingEndpoint):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, format, *args):
+            pass
+
+        def _send_json(self, obj, status=200, headers=None):
+            self._send_bytes(json.dumps(obj).encode("utf-8"), "application/json", status, headers)
+
+        def _send_bytes(self, body, content_type, status=200, headers=None):
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _start_events(self):
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+
+        def _send_event(self, data):
+            payload = f"data: {data if isinstance(data, str) else json.dumps(data)}\n\n".encode("utf-8")
+            self.wfile.write(b"%x\r\n%s\r\n" % (len(payload), payload))
+            self.wfile.flush()
+
+        def _end_events(self):
+            self._send_event("[DONE]")
+            self.wfile.write(b"0\r\n\r\n")
+            self.wfile.flush()
+
+        def do_GET(self):
+            parts = self.path.split("?")[0].strip("/").split("/")
+            if parts == ["stats"]:
+                return self._send_json(mock.stats())
+            if parts == [".well-known", "databricks-config"]:
+                # host metadata the SDK looks up when it builds a client
+                return self._send_json({"oidc_endpoint": f"{mock.url}/oidc", "workspace_id": "1234567890"})
+            if parts == ["oidc", ".well-known", "oauth-authorization-server"]:
+                mock.api_call("oidc")
+                return self._send_json({
+                    "authorization_endpoint": f"{mock.url}/oidc/v1/authorize",
+                    "token_endpoint": f"{mock.url}/oidc/v1/token",
+                })
+            if parts == ["api", "2.0", "preview", "scim", "v2", "Me"]:
+                mock.api_call("me")
+                return self._send_json({"id": "1", "userName": "app-sp", "displayName": "app-sp", "active": True})
+            if parts[:4] == ["api", "2.0", "sql", "statements"] and len(parts) == 5:
+                mock.api_call("get_statement")
+                return self._send_json(_statement(mock, parts[4], "JSON_ARRAY"))
+            if parts[:1] == ["sql-results"] and len(parts) == 2:
+                mock.api_call("result_download")
+                return self._send_bytes(_sales_arrow_stream(), "application/vnd.apache.arrow.stream")
+            if parts[:3] == ["api", "2.0", "serving-endpoints"] and len(parts) == 4:
+                name = parts[3]
+                mock.count(name, "metadata")
+                return self._send_json({
+                    "name": name,
+                    "task": mock.task_of(name),
+                    "state": {"ready": "READY", "config_update": "NOT_UPDATING"},
+                    "config": {"served_entities": [{"name": f"{name}-entity"}, {"name": "feedback"}]},
+                })
+            self._send_json({"error_code": "ENDPOINT_NOT_FOUND", "message": self.path}, 404)
+
+        def do_POST(self):
+            length = int(self.headers.get("Content-Length") or 0)
+            payload = self.rfile.read(length)
+            parts = self.path.split("?")[0].strip("/").split("/")
+            if parts == ["oidc", "v1", "token"]:
+                # client credentials are form encoded, not JSON
+                mock.api_call("token")
+                return self._send_json({"access_token": str(uuid.uuid4()), "token_type": "Bearer", "expires_in": 3600})
+            body = json.loads(payload or b"{}")
+            if parts == ["api", "2.0", "sql", "statements"]:
+                mock.api_call("execute_statement")
+                return self._send_json(_statement(mock, str(uuid.uuid4()), body.get("format") or "JSON_ARRAY"))
+            if len(parts) < 3 or parts[0] != "serving-endpoints":
+                return self._send_json({"error_code": "NOT_FOUND", "message": self.path}, 404)
+            name = parts[1]
+
+            if parts[2:] == ["served-models", "feedback", "invocations"]:
+                records = body.get("dataframe_records") or []
+                mock.count(name, "feedback")
+                return self._send_json({"predictions": [{"result": "ok"} for _ in records]})
+            if parts[2:] != ["invocations"]:
+                return self._send_json({"error_code": "NOT_FOUND", "message": self.path}, 404)
+
+            mock.wait_until_warm(name)
+            if mock.should_fail():
+                mock.count(name, "error")
+                headers = {"Retry-After": f"{mock.retry_after:g}"} if mock.error_status == 429 else None
+                return self._send_json(
+                    {"error_code": "TEMPORARILY_UNAVAILABLE", "message": "Injected error"},
+                    mock.error_status,
+                    headers,
+                )
+
+            stream = bool(body.get("stream"))
+            mock.count(name, "stream" if stream else "predict")
+            request_id = str(uuid.uuid4())
+            prompt = _last_user_text(body)
+            tokens = mock.answer_tokens(prompt)
+            try:
+                if "input" in body:
+                    self._responses(body, request_id, prompt, tokens, stream)
+                else:
+                    self._chat(body, request_id, tokens, stream)
+            except (BrokenPipeError, ConnectionResetError):
+                # the client went away mid-stream
+                pass
+
+        def _chat(self, body, request_id, tokens, stream):
+            time.sleep(mock.latency)
+            if not stream:
+                time.sleep(mock.token_delay() * len(tokens))
+                return self._send_json({
+                    "id": request_id,
+                    "object": "chat.completion",
+                    "choices": [{
+                        "index": 0,
+                        "message": {"role": "assistant", "content": "".join(tokens).strip()},
+                        "finish_reason": "stop",
+                    }],
+                    "usage": {"completion_tokens": len(tokens)},
+                    **_databricks_output(request_id, body),
+                })
+            self._start_events()
+            for index, token in enumerate(tokens):
+                if index:
+                    time.sleep(mock.token_delay())
+                self._send_event({
+                    "id": request_id,
+                    "object": "chat.completion.chunk",
+                    "choices": [{"index": 0, "delta": {"role": "assistant", "content": token}}],
+                })
+            self._send_event({
+                "id": request_id,
+                "object": "chat.completion.chunk",
+                "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}],
+                **_databricks_output(request_id, body),
+            })
+            self._end_events()
+
+        def _responses(self, body, request_id, prompt, tokens, stream):
+            message_id = f"msg_{uuid.uuid4().hex[:12]}"
+            items = list(_tool_call_items(prompt)) if mock.tool_calls else []
+            time.sleep(mock.latency)
+            if not stream:
+                time.sleep(mock.token_delay() * len(tokens))
+                return self._send_json({
+                    "id": request_id,
+                    "object": "response",
+                    "output": items + [_message_item(message_id, "".join(tokens).strip())],
+                    **_databricks_output(request_id, body),
+                })
+            self._start_events()
+            if items:
+                function_call, function_call_output = items
+                self._send_event({"type": "response.output_item.added", "item": {**function_call, "arguments": ""}})
+                arguments = function_call["arguments"]
+                for start in range(0, len(arguments), 16):
+                    self._send_event({
+                        "type": "response.function_call_arguments.delta",
+                        "item_id": function_call["id"],
+                        "delta": arguments[start:start + 16],
+                    })
+                self._send_event({"type": "response.output_item.done", "item": function_call})
+                self._send_event({"type": "response.output_item.done", "item": function_call_output})
+            for index, token in enumerate(tokens):
+                if index:
+                    time.sleep(mock.token_delay())
+                self._send_event({"type": "response.output_text.delta", "item_id": message_id, "delta": token})
+            self._send_event({
+                "type": "response.output_item.done",
+                "item": _message_item(message_id, "".join(tokens)),
+                **_databricks_output(request_id, body),
+            })
+            self._end_events()
+
+    return Handler
+
+def _endpoint_task(value):
+    name, _, task = value.partition("=")
+    if not task:
+        raise argparse.ArgumentTypeError("expected NAME=TASK")
+    return name, task
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--task", default="llm/v1/chat", help="task of every endpoint, e.g. agent/v1/responses")
+    parser.add_argument("--endpoint-task", type=_endpoint_task, action="append", default=[],
+                        metavar="NAME=TASK", help="task of one endpoint; can be repeated")
+    parser.add_argument("--latency", type=float, default=0.05, help="seconds before the first token")
+    parser.add_argument("--tokens-per-second", type=float, default=50.0)
+    parser.add_argument("--response-tokens", type=int, default=40)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of invocations that fail")
+    parser.add_argument("--error-status", type=int, default=503)
+    parser.add_argument("--retry-after", type=float, default=1.0, help="Retry-After of injected 429s")
+    parser.add_argument("--cold-start", type=float, default=0.0, help="seconds the first request waits")
+    parser.add_argument("--idle-timeout", type=float, default=None,
+                        help="seconds without requests after which the endpoint is cold again")
+    parser.add_argument("--no-tool-calls", action="store_true", help="responses agents answer without a tool call")
+    parser.add_argument("--api-latency", type=float, default=0.0,
+                        help="seconds each OAuth, SCIM and SQL statement request takes")
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    mock = MockServingEndpoint(
+        host=args.host,
+        port=args.port,
+        task=args.task,
+        endpoint_tasks=dict(args.endpoint_task),
+        latency=args.latency,
+        tokens_per_second=args.tokens_per_second,
+        response_tokens=args.response_tokens,
+        error_rate=args.error_rate,
+        error_status=args.error_status,
+        retry_after=args.retry_after,
+        cold_start=args.cold_start,
+        idle_timeout=args.idle_timeout,
+        tool_calls=not args.no_tool_calls,
+        api_latency=args.api_latency,
+        seed=args.seed,
+    )
+    print(f"Mock serving endpoints listening on {mock.url}")
+    try:
+        mock.server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    main()
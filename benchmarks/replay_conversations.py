@@ -0,0 +1,272 @@
+"""
+Replay a corpus of multi-turn chat conversations through a lab chat app and
+report throughput, latency percentiles, time to first token, UI updates per
+answer and memory per session.
+
+By default the conversations in conversations.json are replayed through the
+app's `query_llm` handler against an in-process `MockServingEndpoint`, so the
+benchmark needs no network or workspace. Sessions arrive at a fixed rate (a
+Poisson process) or all at once, and at most `--concurrency` run at a time.
+Results are written as JSON so runs can be compared between releases.
+
+Usage:
+
+    python benchmarks/replay_conversations.py --sessions 200 --concurrency 16 \\
+        --arrival-rate 20 --output results.json
+"""
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+import argparse
+import json
+import logging
+import os
+import platform
+import random
+import sys
+import threading
+import time
+import tracemalloc
+import types
+
+from mock_serving_endpoint import MockServingEndpoint
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+DEFAULT_APP_DIR = REPO_ROOT / "01 - Introduction to Databricks Apps" / "lab_solution"
+DEFAULT_CORPUS = Path(__file__).resolve().parent / "conversations.json"
+
+def percentiles(values) -> dict:
+    """Mean, max and p50/p95/p99 (linear interpolation between closest ranks) of `values`."""
+    if not values:
+        return {"count": 0, "mean": None, "max": None, "p50": None, "p95": None, "p99": None}
+    ordered = sorted(values)
+
+    def percentile(q):
+        position = (len(ordered) - 1) * q
+        lower = int(position)
+        upper = min(lower + 1, len(ordered) - 1)
+        return ordered[lower] + (ordered[upper] - ordered[lower]) * (position - lower)
+
+    return {
+        "count": len(ordered),
+        "mean": sum(ordered) / len(ordered),
+        "max": ordered[-1],
+        "p50": percentile(0.50),
+        "p95": percentile(0.95),
+        "p99": percentile(0.99),
+    }
+
+class TurnResult:
+    __slots__ = ("conversation_id", "session_id", "turn", "latency", "ttft", "updates", "response_chars", "error")
+
+    def __init__(self, conversation_id, session_id, turn):
+        self.conversation_id = conversation_id
+        self.session_id = session_id
+        self.turn = turn
+        self.latency = None
+        self.ttft = None
+        # responses yielded to the UI, each one a re-render sent over the websocket
+        self.updates = 0
+        self.response_chars = 0
+        self.error = None
+
+def _load_target(args):
+    """Import the app (or only model_serving_utils) and return `send(message, history, session_id)`."""
+    sys.path.insert(0, str(args.app_dir))
+    # configured first, so the modules' own logging.basicConfig calls don't turn on debug logging
+    logging.basicConfig(level=args.log_level)
+    if args.target == "app":
+        import app
+
+        def send(message, history, session_id):
+            yield from app.query_llm(message, history, types.SimpleNamespace(session_hash=session_id))
+
+        return send, sys.modules["model_serving_utils"]
+
+    import model_serving_utils
+    endpoint = os.environ["SERVING_ENDPOINT"]
+    # like the app, build the clients before the first turn
+    if hasattr(model_serving_utils, "start_warm_up"):
+        model_serving_utils.start_warm_up(endpoint)
+
+    def send(message, history, session_id):
+        messages = history + [{"role": "user", "content": message}]
+        if args.no_stream:
+            result_messages, _ = model_serving_utils.query_endpoint(endpoint, messages, False, session_id=session_id)
+            yield result_messages[-1]["content"]
+            return
+        response = ""
+        for text in model_serving_utils.query_endpoint_text_stream(endpoint, messages, False, session_id=session_id):
+            response += text
+            yield response
+
+    return send, model_serving_utils
+
+def _run_session(send, conversation, session_id, think_time, results, lock):
+    history = []
+    for turn, message in enumerate(conversation["turns"]):
+        result = TurnResult(conversation["id"], session_id, turn)
+        start_time = time.perf_counter()
+        response = ""
+        try:
+            for response in send(message, history, session_id):
+                response = response if isinstance(response, str) else response.get("content", "")
+                result.updates += 1
+                if result.ttft is None and response:
+                    result.ttft = time.perf_counter() - start_time
+            result.latency = time.perf_counter() - start_time
+            if response.startswith("Error:"):
+                result.error = response
+        except Exception as e:
+            result.error = f"{type(e).__name__}: {e}"
+        result.response_chars = len(response)
+        with lock:
+            results.append(result)
+        history.append({"role": "user", "content": message})
+        history.append({"role": "assistant", "content": response})
+        if think_time:
+            time.sleep(think_time)
+
+def run(args) -> dict:
+    corpus = json.loads(Path(args.corpus).read_text())
+    mock = None
+    if args.endpoint_url:
+        os.environ["DATABRICKS_HOST"] = args.endpoint_url
+    else:
+        mock = MockServingEndpoint(
+            task=args.task,
+            latency=args.latency,
+            tokens_per_second=args.tokens_per_second,
+            response_tokens=args.response_tokens,
+            error_rate=args.error_rate,
+            seed=args.seed,
+        ).start()
+        os.environ["DATABRICKS_HOST"] = mock.url
+    os.environ.setdefault("DATABRICKS_TOKEN", "dummy")
+    # keep the cost of writing traces, without leaving a file behind
+    os.environ.setdefault("TRACE_STORE_PATH", os.devnull)
+    os.environ["SERVING_ENDPOINT"] = args.endpoint
+    os.environ["STREAM_RESPONSES"] = "false" if args.no_stream else "true"
+    if args.no_coalesce:
+        os.environ["COALESCE_REQUESTS"] = "false"
+
+    send, model_serving_utils = _load_target(args)
+    if hasattr(model_serving_utils, "wait_until_ready"):
+        model_serving_utils.wait_until_ready()
+    if mock is not None:
+        # the app looks up the endpoint while warming up; count only the replayed traffic
+        mock.reset_stats()
+
+    rng = random.Random(args.seed)
+    sessions = [(corpus[index % len(corpus)], f"session-{index}") for index in range(args.sessions)]
+    results = []
+    lock = threading.Lock()
+
+    if args.memory:
+        tracemalloc.start()
+        memory_baseline = tracemalloc.get_traced_memory()[0]
+
+    start_time = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        for conversation, session_id in sessions:
+            executor.submit(_run_session, send, conversation, session_id, args.think_time, results, lock)
+            if args.arrival_rate > 0:
+                time.sleep(rng.expovariate(args.arrival_rate))
+    duration = time.perf_counter() - start_time
+
+    memory = None
+    if args.memory:
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        memory = {
+            # state kept per chat session (converters, caches) after its turns finished
+            "retained_bytes_per_session": (current - memory_baseline) / max(1, args.sessions),
+            "peak_bytes": peak - memory_baseline,
+        }
+
+    succeeded = [result for result in results if result.error is None]
+    errors = {}
+    for result in results:
+        if result.error is not None:
+            errors[result.error.split(":")[0]] = errors.get(result.error.split(":")[0], 0) + 1
+
+    return {
+        "label": args.label,
+        "timestamp": time.time(),
+        "python": platform.python_version(),
+        "config": {
+            "target": args.target,
+            "app_dir": str(args.app_dir),
+            "endpoint": args.endpoint,
+            "task": args.task,
+            "stream": not args.no_stream,
+            "coalesce": not args.no_coalesce,
+            "sessions": args.sessions,
+            "concurrency": args.concurrency,
+            "arrival_rate": args.arrival_rate,
+            "think_time": args.think_time,
+            "latency": args.latency,
+            "tokens_per_second": args.tokens_per_second,
+            "response_tokens": args.response_tokens,
+            "error_rate": args.error_rate,
+        },
+        "duration_seconds": duration,
+        "turns": len(results),
+        "errors": errors,
+        "throughput": {
+            "turns_per_second": len(succeeded) / duration if duration else None,
+            "sessions_per_second": args.sessions / duration if duration else None,
+        },
+        "latency_seconds": percentiles([result.latency for result in succeeded]),
+        "ttft_seconds": percentiles([result.ttft for result in succeeded if result.ttft is not None]),
+        "ui_updates_per_turn": percentiles([result.updates for result in succeeded]),
+        "memory": memory,
+        "upstream_requests": mock.stats() if mock is not None else None,
+        "single_flight": model_serving_utils.single_flight_stats(),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--corpus", default=str(DEFAULT_CORPUS))
+    parser.add_argument("--app-dir", type=Path, default=DEFAULT_APP_DIR, help="lab directory with app.py")
+    parser.add_argument("--target", choices=("app", "module"), default="app",
+                        help="replay through app.query_llm or model_serving_utils directly")
+    parser.add_argument("--no-stream", action="store_true", help="wait for full responses instead of streaming")
+    parser.add_argument("--no-coalesce", action="store_true", help="disable coalescing of identical requests")
+    parser.add_argument("--sessions", type=int, default=100, help="number of conversations to replay")
+    parser.add_argument("--concurrency", type=int, default=8, help="sessions running at the same time")
+    parser.add_argument("--arrival-rate", type=float, default=0.0,
+                        help="new sessions per second; 0 starts them all at once")
+    parser.add_argument("--think-time", type=float, default=0.0, help="seconds between the turns of a session")
+    parser.add_argument("--endpoint", default="mock", help="serving endpoint name")
+    parser.add_argument("--endpoint-url", help="workspace or mock server URL, instead of an in-process mock")
+    parser.add_argument("--task", default="agent/v1/responses", help="task of the in-process mock endpoint")
+    parser.add_argument("--latency", type=float, default=0.05, help="mock time to first token in seconds")
+    parser.add_argument("--tokens-per-second", type=float, default=200.0)
+    parser.add_argument("--response-tokens", type=int, default=40)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--no-memory", dest="memory", action="store_false", help="skip tracemalloc")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--label", default=None, help="name of this run, e.g. a release tag")
+    parser.add_argument("--log-level", default="WARNING")
+    parser.add_argument("--output", default="replay_results.json")
+    args = parser.parse_args()
+
+    results = run(args)
+    Path(args.output).write_text(json.dumps(results, indent=2))
+
+    def quantiles(stats):
+        if not stats["count"]:
+            return "n/a"
+        return f"{stats['p50']:.3f}/{stats['p95']:.3f}/{stats['p99']:.3f}s"
+
+    print(
+        f"{results['turns']} turns in {results['duration_seconds']:.2f}s "
+        f"({results['throughput']['turns_per_second']:.1f} turns/s), "
+        f"latency p50/p95/p99 {quantiles(results['latency_seconds'])}, "
+        f"TTFT p50/p95/p99 {quantiles(results['ttft_seconds'])}, "
+        f"{results['ui_updates_per_turn']['mean'] or 0:.1f} UI updates/turn, "
+        f"errors {results['errors']}; results written to {args.output}"
+    )
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,149 @@
+"""
+Measure how long a lab chat app takes to start and to answer its first request.
+
+Runs in fresh interpreters, so nothing is cached in-process:
+
+1. `python -X importtime -c "import app"` to report the import time of each
+   module the app imports directly, and of the slowest modules overall;
+2. a cold start that imports the app and sends one message through
+   `query_llm`, reporting the time to import, to the end of the background
+   warm-up (with `--wait-for-warm-up`), to the first token and to the full
+   answer.
+
+The app talks to an in-process `MockServingEndpoint`, so no workspace is needed.
+
+Usage:
+
+    python benchmarks/startup_time.py --top 20 --output startup.json
+"""
+from pathlib import Path
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+from mock_serving_endpoint import MockServingEndpoint
+
+DEFAULT_APP_DIR = Path(__file__).resolve().parent.parent / "01 - Introduction to Databricks Apps" / "lab_solution"
+
+FIRST_REQUEST_SCRIPT = """
+import json, sys, time, types
+start = time.perf_counter()
+import app
+imported = time.perf_counter()
+# the app serves requests right away; the warm-up only decides how soon they stop paying for client setup
+warm_up = getattr(sys.modules.get("model_serving_utils"), "wait_until_ready", None)
+if WAIT_FOR_WARM_UP and warm_up is not None:
+    warm_up()
+ready = time.perf_counter()
+first_token = None
+for response in app.query_llm("Which cookies are best sellers in Seattle?", [], types.SimpleNamespace(session_hash="startup")):
+    if first_token is None and response:
+        first_token = time.perf_counter()
+done = time.perf_counter()
+print(json.dumps({
+    "import_seconds": imported - start,
+    "ready_seconds": ready - start,
+    "first_token_seconds": (first_token or done) - start,
+    "first_response_seconds": done - start,
+    "response_ok": not str(response).startswith("Error"),
+}))
+"""
+
+def parse_importtime(stderr: str) -> list:
+    """Parse `-X importtime` output into (module, self seconds, cumulative seconds, depth) rows."""
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        depth = (len(name) - len(name.lstrip(" ")) - 1) // 2
+        rows.append((name.strip(), int(self_us) / 1e6, int(cumulative_us) / 1e6, depth))
+    return rows
+
+def direct_imports(rows, module) -> list:
+    """The modules imported by `module` itself, slowest first."""
+    # children are reported before their parent, one level deeper
+    end = next(index for index, row in enumerate(rows) if row[0] == module and row[3] == 0)
+    children = []
+    for row in reversed(rows[:end]):
+        if row[3] == 0:
+            break
+        if row[3] == 1:
+            children.append(row)
+    return sorted(children, key=lambda row: row[2], reverse=True)
+
+def run(args, env) -> dict:
+    # -X importtime output of the warm-up thread would interleave with the main thread's
+    importtime = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {args.module}"],
+        cwd=args.app_dir, env=dict(env, WARM_UP="false"), capture_output=True, text=True, timeout=args.timeout,
+    )
+    if importtime.returncode != 0:
+        raise RuntimeError(f"Importing {args.module} failed:\n{importtime.stderr[-2000:]}")
+    rows = parse_importtime(importtime.stderr)
+    total = next(row[2] for row in rows if row[0] == args.module and row[3] == 0)
+    slowest = sorted(rows, key=lambda row: row[1], reverse=True)
+
+    cold_start = subprocess.run(
+        [sys.executable, "-c", f"WAIT_FOR_WARM_UP = {args.wait_for_warm_up}\n{FIRST_REQUEST_SCRIPT}"],
+        cwd=args.app_dir, env=env, capture_output=True, text=True, timeout=args.timeout,
+    )
+    if cold_start.returncode != 0:
+        raise RuntimeError(f"Cold start failed:\n{cold_start.stderr[-2000:]}")
+
+    return {
+        "app_dir": str(args.app_dir),
+        "module": args.module,
+        "total_import_seconds": total,
+        "direct_imports": [
+            {"module": name, "cumulative_seconds": cumulative}
+            for name, _, cumulative, _ in direct_imports(rows, args.module)[:args.top]
+        ],
+        "slowest_modules": [
+            {"module": name, "self_seconds": self_time} for name, self_time, _, _ in slowest[:args.top]
+        ],
+        "cold_start": json.loads(cold_start.stdout.strip().splitlines()[-1]),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--app-dir", type=Path, default=DEFAULT_APP_DIR, help="lab directory with app.py")
+    parser.add_argument("--module", default="app", help="module to import")
+    parser.add_argument("--task", default="agent/v1/responses", help="task of the mock endpoint")
+    parser.add_argument("--wait-for-warm-up", action="store_true",
+                        help="send the first request only after the app's background warm-up finished")
+    parser.add_argument("--top", type=int, default=15, help="number of modules to report")
+    parser.add_argument("--timeout", type=float, default=300)
+    parser.add_argument("--output", default=None, help="write the results to this JSON file")
+    args = parser.parse_args()
+
+    mock = MockServingEndpoint(task=args.task).start()
+    env = dict(
+        os.environ,
+        DATABRICKS_HOST=mock.url,
+        DATABRICKS_TOKEN=os.getenv("DATABRICKS_TOKEN", "dummy"),
+        SERVING_ENDPOINT="mock",
+        MLFLOW_DISABLE_AGENT_HINT="1",
+    )
+    # the dashboard apps check this at import; the cold start never queries the warehouse
+    env.setdefault("DATABRICKS_WAREHOUSE_ID", "startup-benchmark")
+    results = run(args, env)
+    mock.stop()
+
+    print(f"Importing {args.module}: {results['total_import_seconds']:.2f}s")
+    for row in results["direct_imports"]:
+        print(f"  {row['cumulative_seconds']:8.3f}s  {row['module']}")
+    cold_start = results["cold_start"]
+    print(
+        f"Cold start: import {cold_start['import_seconds']:.2f}s, "
+        f"ready {cold_start['ready_seconds']:.2f}s, "
+        f"first token {cold_start['first_token_seconds']:.2f}s, "
+        f"first response {cold_start['first_response_seconds']:.2f}s"
+    )
+    if args.output:
+        Path(args.output).write_text(json.dumps(results, indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# the chat app's modules are shared by every lab; test the copy in the first lab's solution
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir, "01 - Introduction to Databricks Apps", "lab_solution"))
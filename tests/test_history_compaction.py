@@ -0,0 +1,39 @@
+from history_compaction import HistoryCompactor, message_tokens
+
+
+def _conversation(turns, words=20):
+    messages = []
+    for turn in range(turns):
+        messages.append({"role": "user", "content": f"question {turn} " + "word " * words})
+        messages.append({"role": "assistant", "content": f"answer {turn} " + "word " * words})
+    return messages
+
+
+def test_history_within_budget_is_unchanged():
+    messages = [{"role": "system", "content": "Be helpful."}] + _conversation(2)
+
+    assert HistoryCompactor(token_budget=1000).compact(messages) is messages
+
+
+def test_older_turns_are_summarized():
+    messages = [{"role": "system", "content": "Be helpful."}] + _conversation(20)
+    messages.append({"role": "user", "content": "latest question"})
+
+    compacted = HistoryCompactor(token_budget=300).compact(messages)
+
+    assert compacted[0] == messages[0]
+    assert compacted[1]["content"].startswith("Summary of the earlier part of this conversation:")
+    assert compacted[-1] == messages[-1]
+    assert len(compacted) < len(messages)
+
+
+def test_latest_message_is_kept_when_system_messages_exceed_budget():
+    latest = {"role": "user", "content": "What were the best selling cookies in Seattle last month?"}
+    messages = [{"role": "system", "content": "instructions " * 2000}] + _conversation(3) + [latest]
+
+    compacted = HistoryCompactor(token_budget=400).compact(messages)
+
+    assert compacted[-1] == latest
+    assert compacted[0]["role"] == "system"
+    assert message_tokens(compacted[0]) < message_tokens(messages[0])
+    assert sum(message_tokens(msg) for msg in compacted) <= 400
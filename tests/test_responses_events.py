@@ -0,0 +1,38 @@
+from responses_events import DONE, TEXT_DELTA, ResponsesStreamAssembler, iter_responses_events
+
+
+def _delta(item_id, text):
+    return {"type": "response.output_text.delta", "item_id": item_id, "delta": text}
+
+
+def test_streamed_message_is_assembled_on_done_event():
+    assembler = ResponsesStreamAssembler()
+    events = list(iter_responses_events([
+        _delta("msg_1", "Hello, "),
+        _delta("msg_1", "world"),
+        {"type": "response.output_item.done", "item": {"type": "message", "id": "msg_1"}},
+    ], assembler))
+
+    assert [event.kind for event in events] == [TEXT_DELTA, TEXT_DELTA, DONE]
+    assert assembler.result()[0] == [{"role": "assistant", "content": "Hello, world"}]
+
+
+def test_deltas_without_done_event_are_kept():
+    assembler = ResponsesStreamAssembler()
+    list(iter_responses_events([
+        _delta("msg_1", "Hello, "),
+        _delta("msg_1", "world"),
+        _delta("msg_2", "Bye"),
+    ], assembler))
+
+    assert assembler.result()[0] == [
+        {"role": "assistant", "content": "Hello, world"},
+        {"role": "assistant", "content": "Bye"},
+    ]
+
+
+def test_empty_stream_has_no_response():
+    assembler = ResponsesStreamAssembler()
+    list(iter_responses_events([], assembler))
+
+    assert assembler.result()[0] == [{"role": "assistant", "content": "No response found"}]